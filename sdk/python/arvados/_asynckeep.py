@@ -0,0 +1,392 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""AsyncKeepClient, for arvados.asynckeep.
+
+This module uses Python 3.5 syntax, so arvados.asynckeep only imports
+it on Python 3.5 or later.
+"""
+
+import asyncio
+import functools
+import hashlib
+import logging
+
+import pycurl
+
+import arvados.errors
+import arvados.retry as retry
+from arvados.keep import KeepClient, KeepLocator, _block_result, _block_view
+
+_logger = logging.getLogger('arvados.keep')
+
+
+def _log_failure(message, future):
+    # Done callback for a background future that nothing awaits.
+    if not future.cancelled() and future.exception() is not None:
+        _logger.warning("%s: %s", message, future.exception())
+
+
+class _CurlMultiDriver(object):
+    """Run pycurl transfers on an asyncio event loop.
+
+    libcurl tells us which sockets to watch and when to wake it up;
+    we pass those events back to it with socket_action().
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._multi = pycurl.CurlMulti()
+        self._multi.setopt(pycurl.M_SOCKETFUNCTION, self._watch_socket)
+        self._multi.setopt(pycurl.M_TIMERFUNCTION, self._set_timer)
+        self._futures = {}
+        self._timer = None
+
+    def _watch_socket(self, what, fd, multi, data):
+        self._loop.remove_reader(fd)
+        self._loop.remove_writer(fd)
+        if what in (pycurl.POLL_IN, pycurl.POLL_INOUT):
+            self._loop.add_reader(fd, self._socket_ready, fd, pycurl.CSELECT_IN)
+        if what in (pycurl.POLL_OUT, pycurl.POLL_INOUT):
+            self._loop.add_writer(fd, self._socket_ready, fd, pycurl.CSELECT_OUT)
+
+    def _set_timer(self, timeout_ms):
+        # libcurl doesn't allow socket_action() to be called from its
+        # own callbacks, so always go through the event loop.
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if timeout_ms >= 0:
+            self._timer = self._loop.call_later(timeout_ms / 1000.0, self._timeout)
+
+    def _socket_ready(self, fd, event):
+        self._multi.socket_action(fd, event)
+        self._collect()
+
+    def _timeout(self):
+        self._timer = None
+        self._multi.socket_action(pycurl.SOCKET_TIMEOUT, 0)
+        self._collect()
+
+    def _collect(self):
+        while True:
+            queued, succeeded, failed = self._multi.info_read()
+            for curl in succeeded:
+                self._finish(curl, None)
+            for curl, errno, errmsg in failed:
+                self._finish(curl, pycurl.error(errno, errmsg))
+            if not queued:
+                return
+
+    def _finish(self, curl, error):
+        self._multi.remove_handle(curl)
+        future = self._futures.pop(curl, None)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+    async def perform(self, curl):
+        """Run the transfer set up on curl, like curl.perform()."""
+        future = self._loop.create_future()
+        self._futures[curl] = future
+        self._multi.add_handle(curl)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if self._futures.pop(curl, None) is not None:
+                self._multi.remove_handle(curl)
+            raise
+
+
+class _AsyncRetryLoop(retry.RetryLoop):
+    """RetryLoop for `async for`: waits between tries without blocking."""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        wait_time = self._wait_time()
+        if wait_time is None:
+            raise StopAsyncIteration
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+        return self._next_try()
+
+
+class _AsyncWriter(KeepClient.KeepWriterThreadPool):
+    """Upload one block, choosing services and counting copies like
+    KeepWriterThreadPool, with each upload running as a coroutine."""
+
+    def __init__(self, async_client, *args, **kwargs):
+        super(_AsyncWriter, self).__init__(*args, **kwargs)
+        self.async_client = async_client
+
+    async def join(self):
+        running = set()
+        while True:
+            while len(running) < self.max_concurrency:
+                with self._lock:
+                    task = self._next_task()
+                if task is None:
+                    break
+                running.add(asyncio.ensure_future(self._upload(*task)))
+            if not running:
+                return
+            _, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+    async def _upload(self, service, service_root):
+        try:
+            success = bool(await self.async_client._perform(
+                service._put_request(self.data_hash, self.data, timeout=self.timeout),
+                len(self.data)))
+            result = self.task_result(service, service_root, success)
+        except Exception as e:
+            if e is not self.TaskFailed:
+                _logger.exception("Exception in AsyncKeepClient upload")
+            result = None
+        self._task_finished(result)
+
+
+class AsyncKeepClient(object):
+    """Read and write Keep blocks from asyncio coroutines.
+
+    get(), head() and put() behave like the KeepClient methods of the
+    same name: services are tried in the same order, with the same
+    retries, timeouts and checksum verification, and blocks are read
+    from and saved in the KeepClient's block cache.  Many transfers can
+    run at once on a single event loop.
+
+    Transfers wait for the KeepClient's throttle, but a bandwidth
+    limit is applied to each block as a whole before it is sent or
+    received, rather than chunk by chunk.
+    """
+
+    # How often to check for room under the throttle's max_in_flight.
+    THROTTLE_POLL = 0.01
+
+    def __init__(self, keep_client=None, **kwargs):
+        """Initialize a new AsyncKeepClient.
+
+        Arguments:
+        :keep_client:
+          The KeepClient to share services, caches and settings with.
+          If not provided, a new KeepClient is built with the other
+          keyword arguments.
+        """
+        if keep_client is None:
+            keep_client = KeepClient(**kwargs)
+        elif kwargs:
+            raise ValueError("can't build AsyncKeepClient with both a KeepClient and KeepClient arguments")
+        self.keep_client = keep_client
+        self._driver = None
+        self._pending = {}
+
+    async def _perform(self, request, nbytes=0):
+        # Like KeepService._perform(), but runs the transfer on the
+        # event loop.  nbytes is the expected size of the transfer.
+        loop = asyncio.get_event_loop()
+        if self._driver is None or self._driver._loop is not loop:
+            self._driver = _CurlMultiDriver(loop)
+        throttle = self.keep_client.throttle
+        # KeepThrottle.start() would block the event loop.
+        while not throttle.try_start():
+            await asyncio.sleep(self.THROTTLE_POLL)
+        try:
+            delay = throttle.reserve(nbytes)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            curl = next(request)
+            try:
+                await self._driver.perform(curl)
+            except asyncio.CancelledError:
+                request.close()
+                raise
+            except Exception as e:
+                return request.throw(e)
+            return request.send(None)
+        finally:
+            throttle.finish()
+
+    def _num_retries(self, num_retries):
+        if num_retries is None:
+            return self.keep_client.num_retries
+        return num_retries
+
+    async def _map_services(self, roots_map, locator, force_rebuild, need_writable, headers):
+        kc = self.keep_client
+        if force_rebuild or not (kc._static_services_list or kc._keep_services):
+            # Listing services is a blocking API call.
+            await self._in_executor(kc.build_services_list, force_rebuild)
+        return kc.map_new_services(roots_map, locator, force_rebuild=False,
+                                   need_writable=need_writable, headers=headers)
+
+    async def get(self, loc_s, num_retries=None, request_id=None, view=False):
+        """Get data from Keep.  See KeepClient.get()."""
+        blob = await self._get(loc_s, num_retries, request_id)
+        return _block_result(blob, view)
+
+    async def _get(self, loc_s, num_retries, request_id):
+        kc = self.keep_client
+        if hasattr(kc, 'local_store'):
+            return await self._in_executor(kc.get, loc_s, num_retries=num_retries, view=True)
+        if ',' in loc_s:
+            blobs = await asyncio.gather(*[
+                self._get(loc, num_retries, request_id)
+                for loc in loc_s.split(',')])
+            return b''.join(blobs)
+
+        kc.get_counter.add(1)
+        locator = KeepLocator(loc_s)
+        kc._raise_if_known_missing(locator)
+
+        pending = self._pending.get(locator.md5sum)
+        if pending is not None:
+            # Another coroutine is already fetching this block.
+            kc.hits_counter.add(1)
+            blob = await asyncio.shield(pending)
+            if blob is None:
+                raise arvados.errors.KeepReadError("failed to read {}".format(loc_s))
+            return blob
+        slot, first = kc.block_cache.reserve_cache(locator.md5sum)
+        if not first:
+            kc.hits_counter.add(1)
+            if slot.ready.is_set():
+                blob = slot.content
+            else:
+                # A thread is filling the slot.
+                blob = await self._in_executor(slot.get)
+            if blob is None:
+                raise arvados.errors.KeepReadError("failed to read {}".format(loc_s))
+            return blob
+
+        pending = self._pending[locator.md5sum] = asyncio.get_event_loop().create_future()
+        blob = None
+        from_disk = False
+        try:
+            if kc.block_cache.disk_cache is not None:
+                blob = await self._in_executor(kc.block_cache.get_from_disk, locator.md5sum)
+            if blob is not None:
+                from_disk = True
+                kc.hits_counter.add(1)
+            else:
+                blob = await self._fetch(loc_s, locator, "GET", num_retries, request_id)
+            return blob
+        finally:
+            kc.block_cache.set(slot, blob, persist=False)
+            if blob is not None and not from_disk and kc.block_cache.disk_cache is not None:
+                # Waiters already have the block from the slot, so
+                # don't wait for the disk write.
+                failed = "Unable to write block {} to the disk cache".format(locator.md5sum)
+                future = self._in_executor(kc.block_cache.persist, slot, blob)
+                future.add_done_callback(functools.partial(_log_failure, failed))
+            del self._pending[locator.md5sum]
+            pending.set_result(blob)
+
+    def _in_executor(self, func, *args, **kwargs):
+        # Run blocking I/O in the event loop's default executor.
+        return asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(func, *args, **kwargs))
+
+    async def head(self, loc_s, num_retries=None, request_id=None, headers=None):
+        """Check that a block exists.  See KeepClient.head()."""
+        kc = self.keep_client
+        if hasattr(kc, 'local_store'):
+            return await self._in_executor(kc.head, loc_s, num_retries=num_retries)
+        kc.get_counter.add(1)
+        locator = KeepLocator(loc_s)
+        return await self._fetch(loc_s, locator, "HEAD", num_retries, request_id, headers)
+
+    async def _fetch(self, loc_s, locator, method, num_retries, request_id, headers=None):
+        kc = self.keep_client
+        num_retries = self._num_retries(num_retries)
+        kc.misses_counter.add(1)
+        headers = kc._request_headers(request_id, headers)
+        sorted_roots = []
+        roots_map = {}
+        blob = None
+        loop = _AsyncRetryLoop(num_retries, kc._check_loop_result, backoff_start=2)
+        async for tries_left in loop:
+            try:
+                sorted_roots = await self._map_services(
+                    roots_map, locator,
+                    force_rebuild=(tries_left < num_retries),
+                    need_writable=False,
+                    headers=headers)
+            except Exception as error:
+                loop.save_result(error)
+                continue
+            services_to_try = [roots_map[root]
+                               for root in kc._prefer_healthy(sorted_roots)
+                               if roots_map[root].usable()]
+            timeout = kc.current_timeout(num_retries - tries_left)
+            for keep_service in services_to_try:
+                blob = await self._perform(keep_service._get_request(
+                    locator, method=method, timeout=timeout),
+                    (locator.size or 0) if method == "GET" else 0)
+                if blob is not None:
+                    break
+            loop.save_result((blob, len(services_to_try)))
+        if loop.attempts() > 1:
+            kc.metrics.retried(method, loop.attempts() - 1)
+        if loop.success():
+            return blob
+        kc._raise_read_error(loc_s, locator, loop, sorted_roots, roots_map, method)
+
+    async def put(self, data, copies=2, num_retries=None, request_id=None):
+        """Save data in Keep.  See KeepClient.put()."""
+        kc = self.keep_client
+        if hasattr(kc, 'local_store'):
+            return await self._in_executor(kc.put, data, copies=copies, num_retries=num_retries)
+        data = _block_view(data)
+        kc.put_counter.add(1)
+
+        data_hash = hashlib.md5(data).hexdigest()
+        loc_s = data_hash + '+' + str(len(data))
+        if copies < 1:
+            return loc_s
+        locator = KeepLocator(loc_s)
+
+        num_retries = self._num_retries(num_retries)
+        headers = kc._request_headers(request_id, {
+            'X-Keep-Desired-Replicas': str(copies),
+        })
+        roots_map = {}
+        sorted_roots = []
+        writer = None
+        loop = _AsyncRetryLoop(num_retries, kc._check_loop_result, backoff_start=2)
+        done = 0
+        async for tries_left in loop:
+            try:
+                sorted_roots = await self._map_services(
+                    roots_map, locator,
+                    force_rebuild=(tries_left < num_retries),
+                    need_writable=True,
+                    headers=headers)
+            except Exception as error:
+                loop.save_result(error)
+                continue
+
+            writer = _AsyncWriter(self, data=data,
+                                  data_hash=data_hash,
+                                  copies=copies - done,
+                                  max_service_replicas=kc.max_replicas_per_service,
+                                  timeout=kc.current_timeout(num_retries - tries_left))
+            for service_root, ks in [(root, roots_map[root])
+                                     for root in kc._prefer_healthy(sorted_roots)]:
+                if ks.finished():
+                    continue
+                writer.add_task(ks, service_root)
+            await writer.join()
+            done += writer.done()
+            loop.save_result((done >= copies, writer.total_task_nr))
+        if loop.attempts() > 1:
+            kc.metrics.retried("PUT", loop.attempts() - 1)
+
+        if loop.success():
+            kc.not_found_cache.discard(data_hash)
+            return writer.response()
+        kc._raise_write_error(data_hash, loop, sorted_roots, roots_map, copies, writer)
@@ -15,12 +15,16 @@ import copy
 import errno
 import functools
 import hashlib
+import heapq
+import itertools
 import logging
+import mmap
 import os
 import queue
 import re
 import sys
 import threading
+import time
 import uuid
 import zlib
 
@@ -277,6 +281,95 @@ class StateChangeError(Exception):
         self.state = state
         self.nextstate = nextstate
 
+class _BufferPool(object):
+    """Block-sized buffers for _BufferBlocks to reuse.
+
+    Allocating a new buffer for each block of a big upload, and copying
+    it each time the block outgrows it, churns hundreds of MiB through
+    the allocator.  Instead, a _BufferBlock that grows past `min_size`
+    bytes moves its data into a `buffer_size` buffer from the pool, and
+    gives the buffer back when the block is committed or deleted.  The
+    pool keeps up to `max_idle` buffers for reuse, so a steady stream
+    of uploads doesn't allocate any.  Small blocks still grow in
+    ordinary bytearrays, so many small files don't tie up a big buffer
+    each.
+
+    With use_mmap, buffers are anonymous mmaps rather than bytearrays,
+    so their memory goes straight back to the operating system when
+    they're freed.
+
+    A buffer belongs to its _BufferBlock until the block gives it back,
+    which it does only once nothing else can use it: after
+    KeepClient.put() has returned for a committed block, and never for a
+    block deleted while its upload was running.  Readers of a pooled
+    buffer get copies of the data, not views of the buffer.
+    """
+
+    def __init__(self, buffer_size, max_idle, use_mmap=False):
+        self.buffer_size = buffer_size
+        self.min_size = buffer_size // 16
+        self.max_idle = max_idle
+        self.use_mmap = use_mmap
+        self.allocated = 0
+        self.reused = 0
+        self._idle = []
+        # id()s of the buffers this pool made that haven't been freed.
+        self._ids = set()
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return a buffer of buffer_size bytes, with arbitrary contents."""
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.allocated += 1
+        if self.use_mmap:
+            buf = mmap.mmap(-1, self.buffer_size)
+        else:
+            buf = bytearray(self.buffer_size)
+        with self._lock:
+            self._ids.add(id(buf))
+        return buf
+
+    def owns(self, buf):
+        """Return True if `buf` is one of this pool's buffers."""
+        with self._lock:
+            return id(buf) in self._ids
+
+    def put(self, buf):
+        """Give a buffer back for reuse.  Nothing may use it afterwards."""
+        with self._lock:
+            if id(buf) not in self._ids:
+                return
+            if len(self._idle) < self.max_idle:
+                self._idle.append(buf)
+            else:
+                self._ids.discard(id(buf))
+
+    def discard(self, buf):
+        """Forget a buffer that won't be given back, e.g., because an
+        upload may still be reading it."""
+        with self._lock:
+            self._ids.discard(id(buf))
+
+    def clear(self):
+        """Free the idle buffers."""
+        with self._lock:
+            for buf in self._idle:
+                self._ids.discard(id(buf))
+            self._idle = []
+
+    def stats(self):
+        """Return the numbers of buffers allocated, reused and idle, as a dict."""
+        with self._lock:
+            return {
+                'allocated': self.allocated,
+                'reused': self.reused,
+                'idle': len(self._idle),
+            }
+
+
 class _BufferBlock(object):
     """A stand-in for a Keep block that is in the process of being written.
 
@@ -303,7 +396,7 @@ class _BufferBlock(object):
     ERROR = 3
     DELETED = 4
 
-    def __init__(self, blockid, starting_capacity, owner):
+    def __init__(self, blockid, starting_capacity, owner, pool=None):
         """
         :blockid:
           the identifier for this block
@@ -314,10 +407,13 @@ class _BufferBlock(object):
         :owner:
           ArvadosFile that owns this block
 
+        :pool:
+          _BufferPool to take big buffers from, and return them to
+
         """
         self.blockid = blockid
-        self.buffer_block = bytearray(starting_capacity)
-        self.buffer_view = memoryview(self.buffer_block)
+        self._pool = pool
+        self._set_buffer(self._new_buffer(starting_capacity))
         self.write_pointer = 0
         self._state = _BufferBlock.WRITABLE
         self._locator = None
@@ -337,11 +433,14 @@ class _BufferBlock(object):
         if self._state == _BufferBlock.WRITABLE:
             if not isinstance(data, bytes) and not isinstance(data, memoryview):
                 data = data.encode()
-            while (self.write_pointer+len(data)) > len(self.buffer_block):
-                new_buffer_block = bytearray(len(self.buffer_block) * 2)
-                new_buffer_block[0:self.write_pointer] = self.buffer_block[0:self.write_pointer]
-                self.buffer_block = new_buffer_block
-                self.buffer_view = memoryview(self.buffer_block)
+            if (self.write_pointer+len(data)) > len(self.buffer_block):
+                capacity = len(self.buffer_block) * 2
+                while (self.write_pointer+len(data)) > capacity:
+                    capacity *= 2
+                new_buffer_block = self._new_buffer(capacity, self.write_pointer+len(data))
+                new_buffer_block[0:self.write_pointer] = self.buffer_view[0:self.write_pointer]
+                self._release_buffer()
+                self._set_buffer(new_buffer_block)
             self.buffer_view[self.write_pointer:self.write_pointer+len(data)] = data
             self.write_pointer += len(data)
             self._locator = None
@@ -365,8 +464,7 @@ class _BufferBlock(object):
 
         if self._state == _BufferBlock.COMMITTED:
             self._locator = val
-            self.buffer_view = None
-            self.buffer_block = None
+            self._release_buffer()
             self.wait_for_commit.set()
 
         if self._state == _BufferBlock.ERROR:
@@ -392,16 +490,56 @@ class _BufferBlock(object):
     def clone(self, new_blockid, owner):
         if self._state == _BufferBlock.COMMITTED:
             raise AssertionError("Cannot duplicate committed buffer block")
-        bufferblock = _BufferBlock(new_blockid, self.size(), owner)
+        bufferblock = _BufferBlock(new_blockid, self.size(), owner, self._pool)
         bufferblock.append(self.buffer_view[0:self.size()])
         return bufferblock
 
+    @synchronized
+    def contents(self, start, end):
+        """Return the data from `start` to `end` for a reader, or None if
+        the buffer has been released.
+
+        Data in a pooled buffer is copied, since the buffer is reused
+        once the block is committed.  Otherwise, return a view.
+        """
+        if self.buffer_view is None:
+            return None
+        if self._pool is not None and self._pool.owns(self.buffer_block):
+            return self.buffer_view[start:end].tobytes()
+        return self.buffer_view[start:end]
+
     @synchronized
     def clear(self):
+        # An upload still running would keep reading the buffer, so
+        # don't let it be reused.
+        reuse = self._state != _BufferBlock.PENDING
         self._state = _BufferBlock.DELETED
         self.owner = None
+        self._release_buffer(reuse)
+
+    def _new_buffer(self, capacity, needed=None):
+        # Return a buffer of at least `capacity` bytes, from the pool
+        # if that's big enough and a pooled buffer holds `needed` bytes.
+        if needed is None:
+            needed = capacity
+        if (self._pool is not None and capacity >= self._pool.min_size and
+            needed <= self._pool.buffer_size):
+            return self._pool.get()
+        return bytearray(capacity)
+
+    def _set_buffer(self, buf):
+        self.buffer_block = buf
+        self.buffer_view = memoryview(buf)
+
+    def _release_buffer(self, reuse=True):
+        buf = self.buffer_block
         self.buffer_block = None
         self.buffer_view = None
+        if buf is not None and self._pool is not None:
+            if reuse:
+                self._pool.put(buf)
+            else:
+                self._pool.discard(buf)
 
     @synchronized
     def repack_writes(self):
@@ -430,16 +568,18 @@ class _BufferBlock(object):
             # If there's more than one segment referencing this block, it is
             # due to out-of-order writes and will produce a fragmented
             # manifest, so try to optimize by re-packing into a new buffer.
-            contents = self.buffer_view[0:self.write_pointer].tobytes()
-            new_bb = _BufferBlock(None, write_total, None)
+            contents = self.buffer_view[0:self.write_pointer]
+            new_bb = _BufferBlock(None, write_total, None, self._pool)
             for t in bufferblock_segs:
                 new_bb.append(contents[t.segment_offset:t.segment_offset+t.range_size])
                 t.segment_offset = new_bb.size() - t.range_size
+            del contents
 
-            self.buffer_block = new_bb.buffer_block
-            self.buffer_view = new_bb.buffer_view
+            self._release_buffer()
+            self._set_buffer(new_bb.buffer_block)
             self.write_pointer = new_bb.write_pointer
             self._locator = None
+            new_bb.buffer_block = new_bb.buffer_view = None
             new_bb.clear()
             self.owner.set_segments(segs)
 
@@ -470,6 +610,102 @@ def must_be_writable(orig_func):
     return must_be_writable_wrapper
 
 
+class _PrefetchQueue(object):
+    """Blocks waiting for the prefetch threads, in priority order.
+
+    Blocks that a reader is about to read (DEMAND) come before
+    readahead, and blocks with the same priority are fetched in the
+    order they were queued.  Each block is queued once: queueing it
+    again can only raise its priority.  At most `maxsize` blocks are
+    queued; when the queue is full, a DEMAND block displaces the most
+    recently queued readahead block, and other blocks aren't queued.
+
+    Each block can have owners, so that a reader can cancel the blocks
+    it queued when it doesn't need them any more.  A block queued by
+    several readers stays queued until all of them cancel it, and a
+    block queued without an owner is never cancelled.
+
+    Not thread-safe: _BlockManager holds its prefetch lock while using it.
+    """
+
+    DEMAND = 0
+    READAHEAD = 1
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        # Heap of [priority, sequence, locator, owners] entries.
+        # Removed entries stay in the heap with locator None.
+        self._heap = []
+        self._entries = {}
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, locator):
+        return locator in self._entries
+
+    def push(self, locator, priority, owner=None):
+        """Queue a block, and return the blocks dropped to make room.
+
+        Check `locator in queue` afterwards to see whether the block
+        was queued.
+        """
+        entry = self._entries.get(locator)
+        owners = {owner}
+        if entry is not None:
+            if priority >= entry[0]:
+                entry[3].add(owner)
+                return []
+            owners.update(entry[3])
+            self.remove(locator)
+        dropped = []
+        if len(self._entries) >= self.maxsize:
+            last = max(self._entries.values())
+            if last[0] <= priority:
+                return []
+            dropped.append(last[2])
+            self.remove(last[2])
+        entry = [priority, next(self._sequence), locator, owners]
+        self._entries[locator] = entry
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * self.maxsize:
+            self._heap = [e for e in self._heap if e[2] is not None]
+            heapq.heapify(self._heap)
+        return dropped
+
+    def pop(self):
+        """Return the next block to fetch, or None if the queue is empty."""
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if entry[2] is not None:
+                del self._entries[entry[2]]
+                return entry[2]
+        return None
+
+    def remove(self, locator):
+        """Remove a block from the queue.  Return True if it was queued."""
+        entry = self._entries.pop(locator, None)
+        if entry is None:
+            return False
+        entry[2] = None
+        entry[3] = None
+        return True
+
+    def cancel(self, owner):
+        """Drop `owner` from the blocks it queued.  Remove the blocks
+        nobody else queued, and return them."""
+        locators = []
+        for loc, entry in listitems(self._entries):
+            if owner in entry[3]:
+                entry[3].discard(owner)
+                if not entry[3]:
+                    locators.append(loc)
+        for loc in locators:
+            self.remove(loc)
+        return locators
+
+
 class _BlockManager(object):
     """BlockManager handles buffer blocks.
 
@@ -479,15 +715,48 @@ class _BlockManager(object):
     """
 
     DEFAULT_PUT_THREADS = 2
+    # Most bytes of buffer blocks waiting for, or being uploaded by, the
+    # put threads.  Writers wait while more than this is pending.  The
+    # default, four full blocks, is the same size as the default
+    # download block cache in KeepClient.
+    DEFAULT_MAX_PENDING_BYTES = 4 * config.KEEP_BLOCK_SIZE
     DEFAULT_GET_THREADS = 2
-
-    def __init__(self, keep, copies=None, put_threads=None, num_retries=None):
-        """keep: KeepClient object to use"""
+    # Prefetch threads are added, up to this many, while prefetches
+    # are queued faster than the threads can fetch them.
+    DEFAULT_MAX_GET_THREADS = 8
+    # Fraction of the KeepClient's block cache that blocks prefetched
+    # but not yet read may take up, so readahead doesn't evict blocks
+    # that readers are using.
+    PREFETCH_CACHE_SHARE = 0.5
+    DEFAULT_PREFETCH_QUEUE_SIZE = 256
+    # Idle block-sized buffers to keep for new buffer blocks.
+    DEFAULT_BUFFER_POOL_SIZE = 4
+
+    # How to read part of a block that isn't cached: fetch the whole
+    # block (and cache it), or, for reads up to range_read_max bytes,
+    # fetch just the part needed with KeepClient.get_range().  Range
+    # reads suit random access to large files, where most of each
+    # block is never read.
+    READ_WHOLE_BLOCKS = 'block'
+    READ_RANGES = 'range'
+    DEFAULT_RANGE_READ_MAX = 2**20
+
+    def __init__(self, keep, copies=None, put_threads=None, num_retries=None,
+                 read_policy=None, buffer_pool_size=None, buffer_pool_mmap=False,
+                 max_pending_bytes=None):
+        """keep: KeepClient object to use
+
+        buffer_pool_size: the most idle block-sized buffers to keep for
+        reuse (see _BufferPool); 0 turns off pooling.  buffer_pool_mmap:
+        allocate the buffers as anonymous mmaps.
+
+        max_pending_bytes: the most bytes of buffer blocks to queue for
+        the put threads before commit_bufferblock() waits.
+        """
         self._keep = keep
         self._bufferblocks = collections.OrderedDict()
         self._put_queue = None
         self._put_threads = None
-        self._prefetch_queue = None
         self._prefetch_threads = None
         self.lock = threading.Lock()
         self.prefetch_enabled = True
@@ -495,12 +764,43 @@ class _BlockManager(object):
             self.num_put_threads = put_threads
         else:
             self.num_put_threads = _BlockManager.DEFAULT_PUT_THREADS
+        self.max_pending_bytes = max_pending_bytes or _BlockManager.DEFAULT_MAX_PENDING_BYTES
+        # Bytes queued for, or being uploaded by, the put threads.
+        self._put_budget = threading.Condition(threading.Lock())
+        self._put_pending_bytes = 0
+        self.put_blocks = 0
+        self.put_bytes = 0
+        self.put_budget_waits = 0
+        self.put_budget_wait_seconds = 0.0
+        self.put_queue_wait_seconds = 0.0
         self.num_get_threads = _BlockManager.DEFAULT_GET_THREADS
+        self.max_get_threads = _BlockManager.DEFAULT_MAX_GET_THREADS
+        # stop_threads() holds self.lock while waiting for the
+        # prefetch threads, so they use a lock of their own.
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_ready = threading.Condition(self._prefetch_lock)
+        self._prefetch_queue = _PrefetchQueue(_BlockManager.DEFAULT_PREFETCH_QUEUE_SIZE)
+        self._prefetch_stopping = False
+        # Prefetched blocks that haven't been read yet: queued or
+        # being fetched, and fetched, with the total of their sizes.
+        self._prefetch_pending = {}
+        self._prefetched = collections.OrderedDict()
+        self._prefetch_bytes = 0
+        self.prefetch_requests = 0
+        self.prefetch_hits = 0
+        self.prefetch_wasted = 0
+        self.prefetch_cancelled = 0
         self.copies = copies
         self._pending_write_size = 0
         self.threads_lock = threading.Lock()
         self.padding_block = None
         self.num_retries = num_retries
+        self.read_policy = read_policy or _BlockManager.READ_WHOLE_BLOCKS
+        self.range_read_max = _BlockManager.DEFAULT_RANGE_READ_MAX
+        if buffer_pool_size is None:
+            buffer_pool_size = _BlockManager.DEFAULT_BUFFER_POOL_SIZE
+        self.buffer_pool = _BufferPool(config.KEEP_BLOCK_SIZE, buffer_pool_size,
+                                       use_mmap=buffer_pool_mmap)
 
     @synchronized
     def alloc_bufferblock(self, blockid=None, starting_capacity=2**14, owner=None):
@@ -521,7 +821,8 @@ class _BlockManager(object):
     def _alloc_bufferblock(self, blockid=None, starting_capacity=2**14, owner=None):
         if blockid is None:
             blockid = str(uuid.uuid4())
-        bufferblock = _BufferBlock(blockid, starting_capacity=starting_capacity, owner=owner)
+        bufferblock = _BufferBlock(blockid, starting_capacity=starting_capacity, owner=owner,
+                                   pool=self.buffer_pool)
         self._bufferblocks[bufferblock.blockid] = bufferblock
         return bufferblock
 
@@ -549,37 +850,37 @@ class _BlockManager(object):
         """Background uploader thread."""
 
         while True:
+            item = self._put_queue.get()
+            if item is None:
+                self._put_queue.task_done()
+                return
+            bufferblock, size, queued_at = item
             try:
-                bufferblock = self._put_queue.get()
-                if bufferblock is None:
-                    return
-
+                with self._put_budget:
+                    self.put_queue_wait_seconds += time.time() - queued_at
                 if self.copies is None:
-                    loc = self._keep.put(bufferblock.buffer_view[0:bufferblock.write_pointer].tobytes(), num_retries=self.num_retries)
+                    loc = self._keep.put(bufferblock.buffer_view[0:bufferblock.write_pointer], num_retries=self.num_retries)
                 else:
-                    loc = self._keep.put(bufferblock.buffer_view[0:bufferblock.write_pointer].tobytes(), num_retries=self.num_retries, copies=self.copies)
+                    loc = self._keep.put(bufferblock.buffer_view[0:bufferblock.write_pointer], num_retries=self.num_retries, copies=self.copies)
                 bufferblock.set_state(_BufferBlock.COMMITTED, loc)
             except Exception as e:
                 bufferblock.set_state(_BufferBlock.ERROR, e)
             finally:
-                if self._put_queue is not None:
-                    self._put_queue.task_done()
+                with self._put_budget:
+                    self._put_pending_bytes -= size
+                    self.put_blocks += 1
+                    self.put_bytes += size
+                    self._put_budget.notify_all()
+                self._put_queue.task_done()
 
     def start_put_threads(self):
         with self.threads_lock:
             if self._put_threads is None:
-                # Start uploader threads.
-
-                # If we don't limit the Queue size, the upload queue can quickly
-                # grow to take up gigabytes of RAM if the writing process is
-                # generating data more quickly than it can be send to the Keep
-                # servers.
-                #
-                # With two upload threads and a queue size of 2, this means up to 4
-                # blocks pending.  If they are full 64 MiB blocks, that means up to
-                # 256 MiB of internal buffering, which is the same size as the
-                # default download block cache in KeepClient.
-                self._put_queue = queue.Queue(maxsize=2)
+                # Start uploader threads.  The queue itself is
+                # unbounded: commit_bufferblock() limits the bytes
+                # queued to max_pending_bytes, so small blocks don't
+                # take up queue slots meant for full ones.
+                self._put_queue = queue.Queue()
 
                 self._put_threads = []
                 for i in range(0, self.num_put_threads):
@@ -591,24 +892,41 @@ class _BlockManager(object):
     def _block_prefetch_worker(self):
         """The background downloader thread."""
         while True:
+            with self._prefetch_lock:
+                while not (self._prefetch_queue or self._prefetch_stopping):
+                    self._prefetch_ready.wait()
+                b = self._prefetch_queue.pop()
+            if b is None:
+                return
+            fetched = False
             try:
-                b = self._prefetch_queue.get()
-                if b is None:
-                    return
-                self._keep.get(b)
+                if not self._cached(b):
+                    # Only the cache needs the block, so don't copy it.
+                    self._keep.get(b, view=True)
+                fetched = True
             except Exception:
                 _logger.exception("Exception doing block prefetch")
+            finally:
+                with self._prefetch_lock:
+                    size = self._prefetch_pending.pop(b, None)
+                    if size is not None:
+                        if fetched:
+                            self._prefetched[b] = size
+                        else:
+                            self._prefetch_bytes -= size
 
     @synchronized
     def start_get_threads(self):
         if self._prefetch_threads is None:
-            self._prefetch_queue = queue.Queue()
             self._prefetch_threads = []
             for i in range(0, self.num_get_threads):
-                thread = threading.Thread(target=self._block_prefetch_worker)
-                self._prefetch_threads.append(thread)
-                thread.daemon = True
-                thread.start()
+                self._start_get_thread()
+
+    def _start_get_thread(self):
+        thread = threading.Thread(target=self._block_prefetch_worker)
+        self._prefetch_threads.append(thread)
+        thread.daemon = True
+        thread.start()
 
 
     @synchronized
@@ -624,12 +942,17 @@ class _BlockManager(object):
         self._put_queue = None
 
         if self._prefetch_threads is not None:
-            for t in self._prefetch_threads:
-                self._prefetch_queue.put(None)
+            # The threads fetch the blocks still queued before they exit.
+            with self._prefetch_lock:
+                self._prefetch_stopping = True
+                self._prefetch_ready.notify_all()
             for t in self._prefetch_threads:
                 t.join()
+            with self._prefetch_lock:
+                self._prefetch_stopping = False
         self._prefetch_threads = None
-        self._prefetch_queue = None
+
+        self.buffer_pool.clear()
 
     def __enter__(self):
         return self
@@ -680,7 +1003,7 @@ class _BlockManager(object):
             bb = small_blocks.pop(0)
             new_bb.owner.append(bb.owner)
             self._pending_write_size -= bb.size()
-            new_bb.append(bb.buffer_view[0:bb.write_pointer].tobytes())
+            new_bb.append(bb.buffer_view[0:bb.write_pointer])
             files.append((bb, new_bb.write_pointer - bb.size()))
 
         self.commit_bufferblock(new_bb, sync=sync)
@@ -703,8 +1026,9 @@ class _BlockManager(object):
         :sync:
           If `sync` is True, upload the block synchronously.
           If `sync` is False, upload the block asynchronously.  This will
-          return immediately unless the upload queue is at capacity, in
-          which case it will wait on an upload queue slot.
+          return immediately unless the blocks already queued add up to
+          max_pending_bytes, in which case it will wait for enough of
+          them to be uploaded.
 
         """
         try:
@@ -726,16 +1050,28 @@ class _BlockManager(object):
         if sync:
             try:
                 if self.copies is None:
-                    loc = self._keep.put(block.buffer_view[0:block.write_pointer].tobytes(), num_retries=self.num_retries)
+                    loc = self._keep.put(block.buffer_view[0:block.write_pointer], num_retries=self.num_retries)
                 else:
-                    loc = self._keep.put(block.buffer_view[0:block.write_pointer].tobytes(), num_retries=self.num_retries, copies=self.copies)
+                    loc = self._keep.put(block.buffer_view[0:block.write_pointer], num_retries=self.num_retries, copies=self.copies)
                 block.set_state(_BufferBlock.COMMITTED, loc)
             except Exception as e:
                 block.set_state(_BufferBlock.ERROR, e)
                 raise
         else:
             self.start_put_threads()
-            self._put_queue.put(block)
+            size = block.write_pointer
+            with self._put_budget:
+                # If the queue is empty, take the block whatever its
+                # size, so a budget smaller than a block can't stop
+                # uploads altogether.
+                if self._put_pending_bytes and self._put_pending_bytes + size > self.max_pending_bytes:
+                    self.put_budget_waits += 1
+                    t0 = time.time()
+                    while self._put_pending_bytes and self._put_pending_bytes + size > self.max_pending_bytes:
+                        self._put_budget.wait()
+                    self.put_budget_wait_seconds += time.time() - t0
+                self._put_pending_bytes += size
+            self._put_queue.put((block, size, time.time()))
 
     @synchronized
     def get_bufferblock(self, locator):
@@ -752,7 +1088,10 @@ class _BlockManager(object):
         """
 
         if self.padding_block is None:
-            self.padding_block = self._alloc_bufferblock(starting_capacity=config.KEEP_BLOCK_SIZE)
+            self.padding_block = self._alloc_bufferblock()
+            # Anonymous memory reads as zeros, and until it's written,
+            # it doesn't take up any memory.
+            self.padding_block._set_buffer(mmap.mmap(-1, config.KEEP_BLOCK_SIZE))
             self.padding_block.write_pointer = config.KEEP_BLOCK_SIZE
             self.commit_bufferblock(self.padding_block, False)
         return self.padding_block
@@ -777,13 +1116,49 @@ class _BlockManager(object):
             if locator in self._bufferblocks:
                 bufferblock = self._bufferblocks[locator]
                 if bufferblock.state() != _BufferBlock.COMMITTED:
-                    return bufferblock.buffer_view[0:bufferblock.write_pointer].tobytes()
+                    return bufferblock.contents(0, bufferblock.write_pointer)
                 else:
                     locator = bufferblock._locator
+        self._prefetch_used(locator, cache_only)
         if cache_only:
-            return self._keep.get_from_cache(locator)
+            return self._keep.get_from_cache(locator, view=True)
         else:
-            return self._keep.get(locator, num_retries=num_retries)
+            return self._keep.get(locator, num_retries=num_retries, view=True)
+
+    def use_range_read(self, size):
+        """Should a read of `size` bytes from an uncached block use a
+        range request?"""
+        return (self.read_policy == _BlockManager.READ_RANGES and
+                size <= self.range_read_max)
+
+    def get_block_range(self, locator, offset, size, num_retries, cache_only=False):
+        """Fetch `size` bytes of a block starting at `offset`.
+
+        Like get_block_contents(), but returns only the requested part
+        of the block, fetching just that part from Keep if
+        use_range_read() says so.
+
+        """
+        with self.lock:
+            if locator in self._bufferblocks:
+                bufferblock = self._bufferblocks[locator]
+                if bufferblock.state() != _BufferBlock.COMMITTED:
+                    end = min(offset + size, bufferblock.write_pointer)
+                    return bufferblock.contents(offset, end)
+                else:
+                    locator = bufferblock._locator
+        self._prefetch_used(locator, cache_only)
+        if self.use_range_read(size):
+            return self._keep.get_range(locator, offset, size, num_retries=num_retries,
+                                        cache_only=cache_only)
+        if cache_only:
+            block = self._keep.get_from_cache(locator, view=True)
+        else:
+            block = self._keep.get(locator, num_retries=num_retries, view=True)
+        if block is None:
+            return None
+        # Slice without copying.
+        return memoryview(block)[offset:offset+size]
 
     def commit_all(self):
         """Commit all outstanding buffer blocks.
@@ -829,7 +1204,7 @@ class _BlockManager(object):
                         owner.flush(sync=True)
                     self.delete_bufferblock(k)
 
-    def block_prefetch(self, locator):
+    def block_prefetch(self, locator, owner=None, demand=False):
         """Initiate a background download of a block.
 
         This assumes that the underlying KeepClient implements a block cache,
@@ -837,20 +1212,207 @@ class _BlockManager(object):
         downloads (unless the block is evicted from the cache.)  This method
         does not block.
 
+        Blocks that are already queued are skipped, and so are
+        readahead blocks while the prefetched blocks that haven't been
+        read yet would take up more than PREFETCH_CACHE_SHARE of the
+        block cache.  More prefetch threads are started, up to
+        max_get_threads, while there are more blocks queued than
+        threads to fetch them.
+
+        :owner:
+          The object the block is prefetched for, which can stop the
+          prefetch with cancel_prefetch().  Readers pass their
+          _Readahead.
+
+        :demand:
+          If True, the block is about to be read, so fetch it before
+          any readahead blocks.
+
         """
 
         if not self.prefetch_enabled:
             return
 
-        if self._keep.get_from_cache(locator) is not None:
+        if getattr(self._keep, 'local_store', None):
+            # Blocks from a local store aren't cached, so there's
+            # nowhere to prefetch them to.
             return
 
         with self.lock:
             if locator in self._bufferblocks:
                 return
 
+        if self._cached(locator):
+            return
+
+        size = KeepLocator.size_of(locator)
+        if size is None:
+            size = config.KEEP_BLOCK_SIZE
+        if demand:
+            priority = _PrefetchQueue.DEMAND
+            budget = None
+        else:
+            priority = _PrefetchQueue.READAHEAD
+            budget = self._prefetch_budget()
+
+        with self._prefetch_lock:
+            if locator in self._prefetched:
+                return
+            if locator in self._prefetch_pending:
+                if locator in self._prefetch_queue:
+                    self._prefetch_queue.push(locator, priority, owner)
+                return
+            self._reap_prefetched()
+            if budget is not None and self._prefetch_bytes + size > budget:
+                return
+            for dropped in self._prefetch_queue.push(locator, priority, owner):
+                self._prefetch_bytes -= self._prefetch_pending.pop(dropped)
+                self.prefetch_cancelled += 1
+            if locator not in self._prefetch_queue:
+                return
+            self._prefetch_pending[locator] = size
+            self._prefetch_bytes += size
+            self.prefetch_requests += 1
+            self._prefetch_ready.notify()
+            pending = len(self._prefetch_pending)
+
         self.start_get_threads()
-        self._prefetch_queue.put(locator)
+        with self.lock:
+            if (pending > len(self._prefetch_threads) and
+                len(self._prefetch_threads) < self.max_get_threads):
+                self._start_get_thread()
+
+    def _cached(self, locator):
+        # Return True if the block is in the Keep client's cache, or
+        # being read into it, without copying it or counting a use.
+        block_cache = getattr(self._keep, 'block_cache', None)
+        if block_cache is None:
+            return self._keep.get_from_cache(locator, view=True) is not None
+        return KeepLocator.md5_of(locator) in block_cache
+
+    def cancel_prefetch(self, owner):
+        """Drop the blocks queued by block_prefetch() for `owner` that
+        haven't started downloading yet, unless another owner queued
+        them too."""
+        with self._prefetch_lock:
+            for locator in self._prefetch_queue.cancel(owner):
+                self._prefetch_bytes -= self._prefetch_pending.pop(locator)
+                self.prefetch_cancelled += 1
+
+    def _prefetch_budget(self):
+        block_cache = getattr(self._keep, 'block_cache', None)
+        if block_cache is None:
+            return None
+        return int(block_cache.cache_max * self.PREFETCH_CACHE_SHARE)
+
+    def _prefetch_used(self, locator, cache_only):
+        # Count a read of a block that was prefetched (or is being
+        # prefetched) as a prefetch hit.  Reads that only check the
+        # cache don't count unless the prefetch has finished.  If no
+        # thread has started fetching the block yet, the reader will
+        # fetch it, so take it off the queue.
+        with self._prefetch_lock:
+            size = self._prefetched.pop(locator, None)
+            if size is None and not cache_only:
+                size = self._prefetch_pending.pop(locator, None)
+                if size is not None and self._prefetch_queue.remove(locator):
+                    self._prefetch_bytes -= size
+                    return
+            if size is not None:
+                self._prefetch_bytes -= size
+                self.prefetch_hits += 1
+
+    def _reap_prefetched(self):
+        # Forget prefetched blocks that were evicted from the cache
+        # before anyone read them, and count them as wasted.
+        block_cache = getattr(self._keep, 'block_cache', None)
+        if block_cache is None:
+            return
+        for locator in [loc for loc in self._prefetched
+                        if KeepLocator.md5_of(loc) not in block_cache]:
+            self._prefetch_bytes -= self._prefetched.pop(locator)
+            self.prefetch_wasted += 1
+
+    def prefetch_stats(self):
+        """Return counts of prefetched blocks as a dict.
+
+        `hits` counts prefetched blocks that were later read, `wasted`
+        counts those evicted from the block cache before being read,
+        `cancelled` counts those dropped from the queue before being
+        fetched, and `queued`, `pending` and `unread` are the blocks
+        waiting for a thread, queued or being fetched, and fetched but
+        not read yet.
+        """
+        with self._prefetch_lock:
+            self._reap_prefetched()
+            return {
+                'requests': self.prefetch_requests,
+                'hits': self.prefetch_hits,
+                'wasted': self.prefetch_wasted,
+                'cancelled': self.prefetch_cancelled,
+                'queued': len(self._prefetch_queue),
+                'pending': len(self._prefetch_pending),
+                'unread': len(self._prefetched),
+                'unread_bytes': self._prefetch_bytes,
+                'threads': len(self._prefetch_threads or ()),
+            }
+
+    def put_stats(self):
+        """Return upload queue metrics as a dict.
+
+        `pending_bytes` is the size of the blocks queued for or being
+        uploaded by the put threads, out of `max_pending_bytes`.
+        `blocks` and `bytes` count the blocks they have uploaded (or
+        failed to).  `budget_waits` counts the times a writer waited for
+        the queue to drain, and `budget_wait_seconds` the time it spent
+        waiting; `queue_wait_seconds` is the total time blocks waited in
+        the queue for a put thread.
+        """
+        with self._put_budget:
+            return {
+                'pending_bytes': self._put_pending_bytes,
+                'max_pending_bytes': self.max_pending_bytes,
+                'blocks': self.put_blocks,
+                'bytes': self.put_bytes,
+                'budget_waits': self.put_budget_waits,
+                'budget_wait_seconds': self.put_budget_wait_seconds,
+                'queue_wait_seconds': self.put_queue_wait_seconds,
+                'threads': len(self._put_threads or ()),
+            }
+
+
+class _Readahead(object):
+    """Track how a reader is reading an ArvadosFile, to size its readahead.
+
+    The window starts at one block.  Each read that starts where the
+    previous one ended doubles it, up to MAX_BLOCKS, and each read
+    somewhere else halves it.  A seek in the middle of a long
+    sequential read therefore only shrinks the window, while random
+    access turns readahead off after a read or two, until reads are
+    sequential again.
+
+    Each ArvadosFileReader has its own, so readers at different
+    positions don't disturb each other's windows.  The file has one
+    for callers that read through it directly.  The ArvadosFile's lock
+    guards the state.
+    """
+
+    MAX_BLOCKS = 16
+
+    __slots__ = ('blocks', 'next_offset')
+
+    def __init__(self):
+        self.blocks = 1
+        self.next_offset = None
+
+    def window(self, offset):
+        """Return the number of blocks to prefetch after a read at `offset`."""
+        if self.next_offset is not None:
+            if offset == self.next_offset:
+                self.blocks = min(max(1, self.blocks * 2), self.MAX_BLOCKS)
+            else:
+                self.blocks //= 2
+        return self.blocks
 
 
 class ArvadosFile(object):
@@ -865,7 +1427,7 @@ class ArvadosFile(object):
     """
 
     __slots__ = ('parent', 'name', '_writers', '_committed',
-                 '_segments', 'lock', '_current_bblock', 'fuse_entry')
+                 '_segments', 'lock', '_current_bblock', 'fuse_entry', '_readahead')
 
     def __init__(self, parent, name, stream=[], segments=[]):
         """
@@ -883,6 +1445,7 @@ class ArvadosFile(object):
         self._committed = False
         self._segments = []
         self.lock = parent.root_collection().lock
+        self._readahead = _Readahead()
         for s in segments:
             self._add_segment(stream, s.locator, s.range_size)
         self._current_bblock = None
@@ -985,7 +1548,7 @@ class ArvadosFile(object):
                 if other.parent._my_block_manager().is_bufferblock(loc2):
                     loc2 = other.parent._my_block_manager().get_bufferblock(loc2).locator()
 
-                if (KeepLocator(loc1).stripped() != KeepLocator(loc2).stripped() or
+                if (KeepLocator.strip_hints(loc1) != KeepLocator.strip_hints(loc2) or
                     seg1.range_start != seg2.range_start or
                     seg1.range_size != seg2.range_size or
                     seg1.segment_offset != seg2.segment_offset):
@@ -1087,38 +1650,108 @@ class ArvadosFile(object):
             # size == self.size()
             pass
 
-    def readfrom(self, offset, size, num_retries, exact=False):
+    def readfrom(self, offset, size, num_retries, exact=False, readahead=None):
         """Read up to `size` bytes from the file starting at `offset`.
 
         :exact:
          If False (default), return less data than requested if the read
          crosses a block boundary and the next block isn't cached.  If True,
          only return less data than requested when hitting EOF.
+
+        :readahead:
+         The _Readahead of the reader making this read.  Default: the
+         file's own.
+
+        Also prefetches the blocks after the ones read: up to
+        _Readahead.MAX_BLOCKS blocks' worth for sequential reads, and
+        none for random access.  Readahead queued for an earlier
+        position is cancelled when a read starts somewhere else.
         """
+        # The slices are views of the blocks; join() makes the only copy.
+        return b''.join(self._readslices(offset, size, num_retries, exact, readahead))
+
+    def readinto_from(self, offset, buf, num_retries=None, exact=False, readahead=None):
+        """Read from the file starting at `offset` into `buf`, and return
+        the number of bytes read.
 
+        Like readfrom(), reading up to the size of `buf`, which can be
+        any writable object that supports the buffer protocol, e.g., a
+        bytearray, a memoryview or a numpy array.  The data is copied
+        straight from the blocks into `buf`.
+        """
+        view = memoryview(buf)
+        if view.format != 'B' or view.ndim != 1:
+            view = view.cast('B')
+        pos = 0
+        for data in self._readslices(offset, view.nbytes, num_retries, exact, readahead):
+            view[pos:pos+len(data)] = data
+            pos += len(data)
+        return pos
+
+    def _readslices(self, offset, size, num_retries, exact, readahead=None):
+        # Return a list of slices of the blocks holding the data that
+        # readfrom() returns, and start prefetching.
+        if readahead is None:
+            readahead = self._readahead
         with self.lock:
             if size == 0 or offset >= self.size():
-                return b''
+                return []
             readsegs = locators_and_ranges(self._segments, offset, size)
-            prefetch = locators_and_ranges(self._segments, offset + size, config.KEEP_BLOCK_SIZE, limit=32)
+            seeked = readahead.next_offset not in (None, offset)
+            window = readahead.window(offset)
+            if window:
+                prefetch = locators_and_ranges(self._segments, offset + size, window * config.KEEP_BLOCK_SIZE, limit=32 * window)
+            else:
+                prefetch = []
+
+        block_manager = self.parent._my_block_manager()
+        if seeked:
+            # Readahead queued for the old position isn't needed now.
+            block_manager.cancel_prefetch(readahead)
+        if exact and not block_manager.use_range_read(size):
+            # Fetch the rest of the blocks needed in the background
+            # while reading the first one.
+            for lr in readsegs[1:]:
+                if lr.locator != readsegs[0].locator:
+                    block_manager.block_prefetch(lr.locator, owner=readahead, demand=True)
 
         locs = set()
         data = []
         for lr in readsegs:
-            block = self.parent._my_block_manager().get_block_contents(lr.locator, num_retries=num_retries, cache_only=(bool(data) and not exact))
+            block = block_manager.get_block_range(lr.locator, lr.segment_offset, lr.segment_size, num_retries=num_retries, cache_only=(bool(data) and not exact))
             if block:
-                blockview = memoryview(block)
-                data.append(blockview[lr.segment_offset:lr.segment_offset+lr.segment_size].tobytes())
+                data.append(block)
                 locs.add(lr.locator)
             else:
                 break
 
+        if block_manager.use_range_read(size):
+            # Small reads with range requests are presumably random
+            # access, so don't fetch the following blocks.
+            prefetch = []
         for lr in prefetch:
             if lr.locator not in locs:
-                self.parent._my_block_manager().block_prefetch(lr.locator)
+                block_manager.block_prefetch(lr.locator, owner=readahead)
                 locs.add(lr.locator)
 
-        return b''.join(data)
+        with self.lock:
+            readahead.next_offset = offset + sum(len(block) for block in data)
+        return data
+
+    def cancel_prefetch(self, readahead=None):
+        """Stop prefetching the blocks one reader of this file queued
+        that haven't started downloading yet.  Blocks that other
+        readers queued too stay queued.
+
+        :readahead:
+         The _Readahead of the reader that is done with the file.
+         Default: the file's own.
+        """
+        if readahead is None:
+            readahead = self._readahead
+        if readahead.next_offset is not None:
+            # Only readfrom() queues blocks.
+            self.parent._my_block_manager().cancel_prefetch(readahead)
 
     @must_be_writable
     @synchronized
@@ -1240,8 +1873,8 @@ class ArvadosFile(object):
                     continue
                 loc = self.parent._my_block_manager().get_bufferblock(loc).locator()
             if portable_locators:
-                loc = KeepLocator(loc).stripped()
-            filestream.append(LocatorAndRange(loc, KeepLocator(loc).size,
+                loc = KeepLocator.strip_hints(loc)
+            filestream.append(LocatorAndRange(loc, KeepLocator.size_of(loc),
                                  segment.segment_offset, segment.range_size))
         buf += ' '.join(normalize_stream(stream_name, {self.name: filestream}))
         buf += "\n"
@@ -1269,6 +1902,7 @@ class ArvadosFileReader(ArvadosFileReaderBase):
     def __init__(self, arvadosfile, mode="r", num_retries=None):
         super(ArvadosFileReader, self).__init__(arvadosfile.name, mode=mode, num_retries=num_retries)
         self.arvadosfile = arvadosfile
+        self._readahead = _Readahead()
 
     def size(self):
         return self.arvadosfile.size()
@@ -1276,10 +1910,19 @@ class ArvadosFileReader(ArvadosFileReaderBase):
     def stream_name(self):
         return self.arvadosfile.parent.stream_name()
 
-    def readinto(self, b):
-        data = self.read(len(b))
-        b[:len(data)] = data
-        return len(data)
+    @_FileLikeObjectBase._before_close
+    @retry_method
+    def readinto(self, b, num_retries=None):
+        """Read into `b`, a writable buffer, and return the number of
+        bytes read.
+
+        Starts at the current file position, and copies the data
+        straight from the blocks into `b`.
+        """
+        n = self.arvadosfile.readinto_from(self._filepos, b, num_retries, exact=True,
+                                           readahead=self._readahead)
+        self._filepos += n
+        return n
 
     @_FileLikeObjectBase._before_close
     @retry_method
@@ -1291,14 +1934,17 @@ class ArvadosFileReader(ArvadosFileReaderBase):
         """
         if size is None:
             data = []
-            rd = self.arvadosfile.readfrom(self._filepos, config.KEEP_BLOCK_SIZE, num_retries)
+            rd = self.arvadosfile.readfrom(self._filepos, config.KEEP_BLOCK_SIZE, num_retries,
+                                           readahead=self._readahead)
             while rd:
                 data.append(rd)
                 self._filepos += len(rd)
-                rd = self.arvadosfile.readfrom(self._filepos, config.KEEP_BLOCK_SIZE, num_retries)
+                rd = self.arvadosfile.readfrom(self._filepos, config.KEEP_BLOCK_SIZE, num_retries,
+                                               readahead=self._readahead)
             return b''.join(data)
         else:
-            data = self.arvadosfile.readfrom(self._filepos, size, num_retries, exact=True)
+            data = self.arvadosfile.readfrom(self._filepos, size, num_retries, exact=True,
+                                             readahead=self._readahead)
             self._filepos += len(data)
             return data
 
@@ -1309,11 +1955,17 @@ class ArvadosFileReader(ArvadosFileReaderBase):
 
         This method does not change the file position.
         """
-        return self.arvadosfile.readfrom(offset, size, num_retries)
+        return self.arvadosfile.readfrom(offset, size, num_retries,
+                                         readahead=self._readahead)
 
     def flush(self):
         pass
 
+    def close(self):
+        if not self.closed:
+            self.arvadosfile.cancel_prefetch(self._readahead)
+        super(ArvadosFileReader, self).close()
+
 
 class ArvadosFileWriter(ArvadosFileReader):
     """Wraps ArvadosFile in a file-like object supporting both reading and writing.
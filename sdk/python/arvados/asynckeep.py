@@ -0,0 +1,23 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""asyncio interface to Keep.
+
+AsyncKeepClient reads and writes blocks from coroutines, without a
+thread per transfer.  It wraps a KeepClient, and shares its service
+list, block cache, service health records and metrics, so the two can
+be used side by side.  Requests are made with the same pycurl
+settings as KeepClient, driven by a pycurl.CurlMulti on the event
+loop.  Disk I/O (the disk cache and the local store) runs in the
+event loop's default executor.
+
+This module needs Python 3.5 or later.
+"""
+
+import sys
+
+if sys.version_info < (3, 5):
+    raise ImportError("arvados.asynckeep needs Python 3.5 or later")
+
+from arvados._asynckeep import AsyncKeepClient
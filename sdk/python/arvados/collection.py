@@ -1052,8 +1052,8 @@ class RichCollectionBase(CollectionBase):
                             continue
                         loc = arvfile.parent._my_block_manager().get_bufferblock(loc).locator()
                     if strip:
-                        loc = KeepLocator(loc).stripped()
-                    filestream.append(LocatorAndRange(loc, KeepLocator(loc).size,
+                        loc = KeepLocator.strip_hints(loc)
+                    filestream.append(LocatorAndRange(loc, KeepLocator.size_of(loc),
                                          segment.segment_offset, segment.range_size))
                 stream[filename] = filestream
             if stream:
@@ -1261,7 +1261,9 @@ class Collection(RichCollectionBase):
                  apiconfig=None,
                  block_manager=None,
                  replication_desired=None,
-                 put_threads=None):
+                 put_threads=None,
+                 read_policy=None,
+                 max_pending_bytes=None):
         """Collection constructor.
 
         :manifest_locator_or_text:
@@ -1293,6 +1295,19 @@ class Collection(RichCollectionBase):
           configuration applies. If not None, this value will also be used
           for determining the number of block copies being written.
 
+        :put_threads:
+          Number of threads uploading blocks in the background.
+
+        :max_pending_bytes:
+          The most bytes of blocks to queue for the upload threads.
+          Writers wait while this much is queued.  Default
+          _BlockManager.DEFAULT_MAX_PENDING_BYTES.
+
+        :read_policy:
+          How to read parts of blocks that aren't cached: fetch whole
+          blocks (_BlockManager.READ_WHOLE_BLOCKS, the default), or use
+          HTTP Range requests for small reads (_BlockManager.READ_RANGES).
+
         """
         super(Collection, self).__init__(parent)
         self._api_client = api_client
@@ -1300,6 +1315,8 @@ class Collection(RichCollectionBase):
         self._block_manager = block_manager
         self.replication_desired = replication_desired
         self.put_threads = put_threads
+        self.read_policy = read_policy
+        self.max_pending_bytes = max_pending_bytes
 
         if apiconfig:
             self._config = apiconfig
@@ -1410,7 +1427,7 @@ class Collection(RichCollectionBase):
             copies = (self.replication_desired or
                       self._my_api()._rootDesc.get('defaultCollectionReplication',
                                                    2))
-            self._block_manager = _BlockManager(self._my_keep(), copies=copies, put_threads=self.put_threads, num_retries=self.num_retries)
+            self._block_manager = _BlockManager(self._my_keep(), copies=copies, put_threads=self.put_threads, num_retries=self.num_retries, read_policy=self.read_policy, max_pending_bytes=self.max_pending_bytes)
         return self._block_manager
 
     def _remember_api_response(self, response):
@@ -21,6 +21,29 @@ retry_opt.add_argument('--retries', type=_pos_int, default=3, help="""
 Maximum number of times to retry server requests that encounter temporary
 failures (e.g., server down).  Default 3.""")
 
+def _byte_count(s):
+    # A number of bytes, optionally with a K, M, G or T suffix
+    # (powers of 1024).
+    units = 'KMGT'
+    s = s.strip()
+    scale = 1
+    if s and s[-1].upper() in units:
+        scale = 1024 ** (units.index(s[-1].upper()) + 1)
+        s = s[:-1]
+    num = int(float(s) * scale)
+    if num <= 0:
+        raise ValueError("can't accept non-positive value: %s" % (s,))
+    return num
+
+throttle_opt = argparse.ArgumentParser(add_help=False)
+throttle_opt.add_argument('--max-bandwidth', type=_byte_count, metavar='BYTES',
+                          default=None, help="""
+Limit the total Keep transfer rate to this many bytes per second (e.g.,
+500K, 20M).  Default: no limit.""")
+throttle_opt.add_argument('--max-requests', type=_pos_int, metavar='N',
+                          default=None, help="""
+Limit the number of Keep requests in progress at once.  Default: no limit.""")
+
 def _ignore_error(error):
     return None
 
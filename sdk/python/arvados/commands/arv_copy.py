@@ -111,7 +111,7 @@ def main():
 
     parser = argparse.ArgumentParser(
         description='Copy a workflow or collection from one Arvados instance to another.',
-        parents=[copy_opts, arv_cmd.retry_opt])
+        parents=[copy_opts, arv_cmd.retry_opt, arv_cmd.throttle_opt])
     args = parser.parse_args()
 
     if args.verbose:
@@ -532,8 +532,12 @@ def copy_collection(obj_uuid, src, dst, args):
     # Copy each block from src_keep to dst_keep.
     # Use the newly signed locators returned from dst_keep to build
     # a new manifest as we go.
-    src_keep = arvados.keep.KeepClient(api_client=src, num_retries=args.retries)
-    dst_keep = arvados.keep.KeepClient(api_client=dst, num_retries=args.retries)
+    src_keep = arvados.keep.KeepClient(api_client=src, num_retries=args.retries,
+                                       max_bytes_per_second=args.max_bandwidth,
+                                       max_in_flight=args.max_requests)
+    dst_keep = arvados.keep.KeepClient(api_client=dst, num_retries=args.retries,
+                                       max_bytes_per_second=args.max_bandwidth,
+                                       max_in_flight=args.max_requests)
     dst_manifest = io.StringIO()
     dst_locators = {}
     bytes_written = 0
@@ -22,7 +22,7 @@ logger = logging.getLogger('arvados.arv-get')
 
 parser = argparse.ArgumentParser(
     description='Copy data from Keep to a local file or pipe.',
-    parents=[arv_cmd.retry_opt])
+    parents=[arv_cmd.retry_opt, arv_cmd.throttle_opt])
 parser.add_argument('--version', action='version',
                     version="%s %s" % (sys.argv[0], __version__),
                     help='Print version and exit.')
@@ -97,6 +97,11 @@ group.add_argument('--strip-manifest', action='store_true', default=False,
 When getting a collection manifest, strip its access tokens before writing
 it.
 """)
+parser.add_argument('--shared-cache', action='store_true', default=False,
+                    help="""
+Keep downloaded blocks in shared memory, where other processes on this
+host (e.g., arv-mount --shared-cache) can use them.
+""")
 
 def parse_arguments(arguments, stdout, stderr):
     args = parser.parse_args(arguments)
@@ -189,9 +194,17 @@ def main(arguments=None, stdout=sys.stdout, stderr=sys.stderr):
                     raise
         return 0
 
+    keep_client = None
+    if args.shared_cache or args.max_bandwidth or args.max_requests:
+        keep_client = arvados.keep.KeepClient(
+            api_client=api_client, num_retries=args.retries,
+            block_cache=arvados.keep.KeepBlockCache(shared_cache=args.shared_cache),
+            max_bytes_per_second=args.max_bandwidth,
+            max_in_flight=args.max_requests)
     try:
         reader = arvados.CollectionReader(
-            col_loc, api_client=api_client, num_retries=args.retries)
+            col_loc, api_client=api_client, keep_client=keep_client,
+            num_retries=args.retries)
     except Exception as error:
         logger.error("failed to read collection: {}".format(error))
         return 1
@@ -312,7 +325,9 @@ def files_in_collection(c):
 def write_block_or_manifest(dest, src, api_client, args):
     if '+A' in src:
         # block locator
-        kc = arvados.keep.KeepClient(api_client=api_client)
+        kc = arvados.keep.KeepClient(api_client=api_client,
+                                     max_bytes_per_second=args.max_bandwidth,
+                                     max_in_flight=args.max_requests)
         dest.write(kc.get(src, num_retries=args.retries))
     else:
         # collection UUID or portable data hash
@@ -250,7 +250,7 @@ date/time that the upload process finishes.
 
 arg_parser = argparse.ArgumentParser(
     description='Copy data from the local filesystem to Keep.',
-    parents=[upload_opts, run_opts, arv_cmd.retry_opt])
+    parents=[upload_opts, run_opts, arv_cmd.retry_opt, arv_cmd.throttle_opt])
 
 def parse_arguments(arguments):
     args = arg_parser.parse_args(arguments)
@@ -445,7 +445,7 @@ class ArvPutUploadJob(object):
                  update_time=60.0, update_collection=None, storage_classes=None,
                  logger=logging.getLogger('arvados.arv_put'), dry_run=False,
                  follow_links=True, exclude_paths=[], exclude_names=None,
-                 trash_at=None):
+                 trash_at=None, keep_client=None):
         self.paths = paths
         self.resume = resume
         self.use_cache = use_cache
@@ -465,6 +465,7 @@ class ArvPutUploadJob(object):
         self.filename = filename
         self.storage_classes = storage_classes
         self._api_client = api_client
+        self._keep_client = keep_client
         self._state_lock = threading.Lock()
         self._state = None # Previous run state (file list & manifest)
         self._current_files = [] # Current run file list
@@ -869,6 +870,7 @@ class ArvPutUploadJob(object):
                 self._remote_collection = arvados.collection.Collection(
                     update_collection,
                     api_client=self._api_client,
+                    keep_client=self._keep_client,
                     num_retries=self.num_retries)
             except arvados.errors.ApiError as error:
                 raise CollectionUpdateError("Cannot read collection {} ({})".format(update_collection, error))
@@ -913,6 +915,7 @@ class ArvPutUploadJob(object):
                 replication_desired=self.replication_desired,
                 put_threads=self.put_threads,
                 api_client=self._api_client,
+                keep_client=self._keep_client,
                 num_retries=self.num_retries)
 
     def _cached_manifest_valid(self):
@@ -1243,6 +1246,13 @@ def main(arguments=None, stdout=sys.stdout, stderr=sys.stderr,
         # specified inside quotes and got changed by the shell expansion.
         logger.info("Exclude patterns: {}".format(args.exclude))
 
+    keep_client = None
+    if args.max_bandwidth or args.max_requests:
+        keep_client = arvados.keep.KeepClient(
+            api_client=api_client, num_retries=args.retries,
+            max_bytes_per_second=args.max_bandwidth,
+            max_in_flight=args.max_requests)
+
     # If this is used by a human, and there's at least one directory to be
     # uploaded, the expected bytes calculation can take a moment.
     if args.progress and any([os.path.isdir(f) for f in args.paths]):
@@ -1267,7 +1277,8 @@ def main(arguments=None, stdout=sys.stdout, stderr=sys.stderr,
                                  follow_links=args.follow_links,
                                  exclude_paths=exclude_paths,
                                  exclude_names=exclude_names,
-                                 trash_at=trash_at)
+                                 trash_at=trash_at,
+                                 keep_client=keep_client)
     except ResumeCacheConflict:
         logger.error("\n".join([
             "arv-put: Another process is already uploading this data.",
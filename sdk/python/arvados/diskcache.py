@@ -0,0 +1,387 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from builtins import object
+import collections
+import errno
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import arvados.util
+
+_logger = logging.getLogger('arvados.keep')
+
+class DiskCache(object):
+    """Persistent cache of Keep blocks on local disk.
+
+    Each block is stored in its own file, named by its md5 hash, in a
+    subdirectory named by the first three digits of the hash.  Blocks
+    are written to a temporary file and renamed into place, so other
+    processes sharing the cache directory never see a partial block.
+    Blocks of at least MMAP_MIN_SIZE bytes are read back through mmap;
+    smaller ones are read into bytes, because each map holds a file
+    descriptor open for as long as the RAM cache keeps it.  Blocks read
+    back are checked against their hash, and corrupt ones are removed.
+
+    The cache is trimmed to cache_max bytes by deleting the least
+    recently used blocks.  Use is tracked with file modification times,
+    so the ordering carries over when the cache is reopened by another
+    process.  The total size is kept in a small file in the cache
+    directory, and changed only while holding an exclusive lock on the
+    directory's lock file, so the limit covers every process sharing
+    the directory.
+    """
+
+    # Remove temporary files left behind by crashed writers once they
+    # are this old.
+    STALE_TMP_AGE = 60*60
+    MMAP_MIN_SIZE = 2**20
+
+    def __init__(self, cachedir, cache_max=None):
+        """
+        :cachedir:
+          Directory to store blocks in.  It is created if necessary.
+
+        :cache_max:
+          Maximum total size of cached blocks, in bytes, across all
+          processes.  Default: 10% of the free space on the filesystem
+          holding cachedir.  Processes sharing a cache should agree on
+          this.
+
+        """
+        self.cachedir = cachedir
+        arvados.util.mkdir_dash_p(self.cachedir)
+        if cache_max is None:
+            fs = os.statvfs(self.cachedir)
+            cache_max = fs.f_bavail * fs.f_frsize // 10
+        self.cache_max = cache_max
+        self._index = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._lockfile = os.open(os.path.join(cachedir, 'lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        fd = os.open(os.path.join(cachedir, 'total'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < 8:
+                os.ftruncate(fd, 8)
+            self._total = mmap.mmap(fd, 8)
+        finally:
+            os.close(fd)
+        self._scan()
+
+    def _path(self, locator):
+        return os.path.join(self.cachedir, locator[0:3], locator)
+
+    def _shared_lock(self):
+        return _FileLock(self._lock, self._lockfile)
+
+    @property
+    def cache_total(self):
+        return struct.unpack('<q', self._total[0:8])[0]
+
+    def _set_total(self, total):
+        self._total[0:8] = struct.pack('<q', total)
+        return total
+
+    def _add_total(self, size):
+        return self._set_total(self.cache_total + size)
+
+    def _find_blocks(self):
+        # Return (mtime, locator, size) for every block in the
+        # directory, least recently used first, and remove stale
+        # temporary files.
+        found = []
+        stale = time.time() - self.STALE_TMP_AGE
+        for shard in os.listdir(self.cachedir):
+            sharddir = os.path.join(self.cachedir, shard)
+            if len(shard) != 3 or not os.path.isdir(sharddir):
+                continue
+            for name in os.listdir(sharddir):
+                path = os.path.join(sharddir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if arvados.util.is_hex(name, 32):
+                    found.append((st.st_mtime, name, st.st_size))
+                elif name.endswith('.tmp') and st.st_mtime < stale:
+                    self._unlink(path)
+        found.sort()
+        return found
+
+    def _scan(self):
+        """Index the blocks already on disk, least recently used first,
+        and recount the total."""
+        with self._shared_lock():
+            found = self._find_blocks()
+            self._index = collections.OrderedDict(
+                (name, size) for _, name, size in found)
+            self._set_total(sum(size for _, _, size in found))
+            self._cap(self.cache_max)
+
+    def _evict(self, target):
+        # Called with the shared lock held.  Count every block in the
+        # directory, remove the least recently used ones until the
+        # total is at most target, and save the new total.
+        found = self._find_blocks()
+        total = sum(size for _, _, size in found)
+        for _, name, size in found:
+            if total <= target:
+                break
+            self._unlink(self._path(name))
+            self._index.pop(name, None)
+            total -= size
+        self._set_total(total)
+
+    def _cap(self, target):
+        # Called with the shared lock held.  Remove the blocks this
+        # process knows about, least recently used first, until the
+        # total is at most target.  Blocks already removed by another
+        # process don't count.  If that isn't enough, other processes
+        # have added blocks, so look at the whole directory.
+        total = self.cache_total
+        while total > target and self._index:
+            locator, size = self._index.popitem(last=False)
+            if self._unlink(self._path(locator)):
+                total -= size
+        if total > target:
+            self._evict(target)
+        else:
+            self._set_total(total)
+
+    def _touch(self, locator, path, size):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        with self._lock:
+            self._index.pop(locator, None)
+            self._index[locator] = size
+
+    @staticmethod
+    def _unlink(path):
+        # Return True if the file was removed.
+        try:
+            os.unlink(path)
+            return True
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                _logger.warning("Unable to remove %s from disk cache: %s", path, err)
+            return False
+
+    def _discard(self, locator):
+        # Remove a block, and take the size it was stored with (if this
+        # process knows it) off the total.
+        with self._shared_lock():
+            path = self._path(locator)
+            size = self._index.pop(locator, None)
+            if size is None:
+                try:
+                    size = os.stat(path).st_size
+                except OSError:
+                    return
+            if self._unlink(path):
+                self._add_total(-size)
+
+    def _read(self, locator, verify=True):
+        # Return the block's content, or None if it isn't cached or,
+        # when verifying, doesn't match its hash.
+        with open(self._path(locator), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                content = b''
+            elif size < self.MMAP_MIN_SIZE:
+                content = f.read()
+            else:
+                content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if verify and hashlib.md5(content).hexdigest() != locator:
+            _logger.warning("Removing corrupt block %s from %s", locator, self.cachedir)
+            self._discard(locator)
+            return None
+        return content
+
+    def get(self, locator, verify=True):
+        """Return the cached block, or None if it is not in the cache.
+
+        Blocks of at least MMAP_MIN_SIZE bytes are returned as mmaps,
+        smaller ones as bytes.  With verify=False, the content isn't
+        checked against the block's hash.
+        """
+        try:
+            content = self._read(locator, verify)
+        except (IOError, OSError):
+            with self._lock:
+                self._index.pop(locator, None)
+            return None
+        if content is not None:
+            self._touch(locator, self._path(locator), len(content))
+        return content
+
+    def set(self, locator, content):
+        """Store a block.  Return True if it is now in the cache."""
+        path = self._path(locator)
+        size = len(content)
+        if os.path.exists(path):
+            self._touch(locator, path, size)
+            return True
+        if size > self.cache_max:
+            return False
+        sharddir = os.path.dirname(path)
+        tmpname = None
+        try:
+            arvados.util.mkdir_dash_p(sharddir)
+            fd, tmpname = tempfile.mkstemp(dir=sharddir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            with self._shared_lock():
+                # Another process may have stored it first.
+                if not os.path.exists(path):
+                    os.rename(tmpname, path)
+                    tmpname = None
+                    self._add_total(size)
+                self._index.pop(locator, None)
+                self._index[locator] = size
+                if self.cache_total > self.cache_max:
+                    self._cap(self.cache_max)
+        except (IOError, OSError) as err:
+            _logger.warning("Unable to write block %s to disk cache: %s", locator, err)
+            return False
+        finally:
+            if tmpname:
+                self._unlink(tmpname)
+        return True
+
+    def cap_cache(self):
+        '''Cap the cache size to self.cache_max'''
+        with self._shared_lock():
+            self._cap(self.cache_max)
+
+
+class SharedMemoryCache(DiskCache):
+    """Cache of Keep blocks in shared memory, for all processes on a host.
+
+    Blocks are stored like DiskCache stores them, but by default in a
+    directory under /dev/shm, so the files live in RAM.  Every process
+    that maps a block shares the same pages, so a block read by
+    several programs on the same node is only held in memory once.
+
+    Processes share the total size as they do with DiskCache, but
+    don't keep their own index of blocks: when the total goes over
+    cache_max, the least recently used blocks (by modification time,
+    which get() updates) are deleted until it's under LOW_WATER of
+    cache_max.  Blocks that a process has already mapped stay readable
+    until it lets go of them.
+
+    Like DiskCache, get() only maps blocks of at least MMAP_MIN_SIZE
+    bytes, since each map holds a file descriptor open.  Smaller blocks
+    are copied into the process's memory.
+    """
+
+    # After eviction, the cache is this fraction of cache_max, so that
+    # every set() doesn't need to scan the directory.
+    LOW_WATER = 0.9
+
+    def __init__(self, cachedir=None, cache_max=None):
+        """
+        :cachedir:
+          Directory to store blocks in.  Default:
+          /dev/shm/arvados-keep-<uid>, or a directory under the
+          system temporary directory if there is no /dev/shm.
+
+        :cache_max:
+          Maximum total size of cached blocks, in bytes, across all
+          processes.  Default: 10% of the free space on the
+          filesystem holding cachedir.  Processes sharing a cache
+          should agree on this.
+
+        """
+        if cachedir is None:
+            shm = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            cachedir = os.path.join(shm, 'arvados-keep-{}'.format(os.getuid()))
+        if not os.path.isdir(cachedir):
+            try:
+                os.mkdir(cachedir, 0o700)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+        super(SharedMemoryCache, self).__init__(cachedir, cache_max)
+
+    def _scan(self):
+        with self._shared_lock():
+            self._evict(self.cache_max)
+
+    def _touch(self, locator, path, size):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def set(self, locator, content):
+        """Store a block.  Return True if it is now in the cache."""
+        path = self._path(locator)
+        if os.path.exists(path):
+            self._touch(locator, path, None)
+            return True
+        if len(content) > self.cache_max:
+            return False
+        sharddir = os.path.dirname(path)
+        tmpname = None
+        try:
+            arvados.util.mkdir_dash_p(sharddir)
+            fd, tmpname = tempfile.mkstemp(dir=sharddir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            with self._shared_lock():
+                if os.path.exists(path):
+                    # Another process stored it first.
+                    self._touch(locator, path, None)
+                    return True
+                os.rename(tmpname, path)
+                tmpname = None
+                if self._add_total(len(content)) > self.cache_max:
+                    self._evict(int(self.cache_max * self.LOW_WATER))
+        except (IOError, OSError) as err:
+            _logger.warning("Unable to write block %s to shared cache: %s", locator, err)
+            return False
+        finally:
+            if tmpname:
+                self._unlink(tmpname)
+        return True
+
+    def cap_cache(self):
+        '''Cap the cache size to self.cache_max'''
+        with self._shared_lock():
+            if self.cache_total > self.cache_max:
+                self._evict(int(self.cache_max * self.LOW_WATER))
+
+
+class _FileLock(object):
+    """Hold a threading lock and an exclusive flock() together.
+
+    flock() locks are shared by all threads using the same file
+    descriptor, so the threading lock keeps threads in this process
+    apart, and the flock() keeps other processes out.
+    """
+
+    def __init__(self, lock, fd):
+        self._lock = lock
+        self._fd = fd
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except:
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
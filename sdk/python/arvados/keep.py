@@ -11,12 +11,14 @@ from builtins import next
 from builtins import str
 from builtins import range
 from builtins import object
+import bisect
 import collections
 import datetime
 import hashlib
 import io
 import logging
 import math
+import mmap
 import os
 import pycurl
 import queue
@@ -25,6 +27,7 @@ import socket
 import ssl
 import sys
 import threading
+import time
 from . import timer
 import urllib.parse
 
@@ -35,6 +38,8 @@ else:
 
 import arvados
 import arvados.config as config
+import arvados.diskcache
+import arvados.localstore
 import arvados.errors
 import arvados.retry as retry
 import arvados.util
@@ -55,11 +60,42 @@ if sys.platform == 'darwin':
 
 
 class KeepLocator(object):
+    """A parsed Keep block locator.
+
+    Locators in their usual form (as written by Keep and in
+    manifests) are matched with a single regular expression, and
+    their hints are only split out when something asks for them.
+    Results are kept in a cache keyed by locator string, so the many
+    repeats of a locator in a manifest are only parsed once; the cache
+    is emptied when it reaches PARSE_CACHE_SIZE entries.
+    Other locators go through the full parser, which also reports
+    what's wrong with invalid ones.
+    """
+
+    __slots__ = ('_md5sum', 'size', '_hint_str', '_hints', '_perm_sig', '_perm_expiry')
+
     EPOCH_DATETIME = datetime.datetime.utcfromtimestamp(0)
     HINT_RE = re.compile(r'^[A-Z][A-Za-z0-9@_-]+$')
+    # Locators that str() would give back unchanged: a permission
+    # hint, if any, comes first and has an 8-digit expiry.
+    FAST_RE = re.compile(
+        r'([0-9a-fA-F]{32})'
+        r'(?:\+(0|[1-9][0-9]*)'
+        r'((?:\+A[0-9a-fA-F]{40}@[0-9a-f]{8})?(?:\+[B-Z][A-Za-z0-9@_-]+)*))?\Z')
+
+    PARSE_CACHE_SIZE = 65536
+    _parse_cache = {}
 
     def __init__(self, locator_str):
-        self.hints = []
+        parsed = self._parse(locator_str)
+        if parsed is not None:
+            self._md5sum, self.size, self._hint_str, _ = parsed
+            self._hints = None
+            self._perm_sig = None
+            self._perm_expiry = None
+            return
+        self._hint_str = ''
+        self._hints = []
         self._perm_sig = None
         self._perm_expiry = None
         pieces = iter(locator_str.split('+'))
@@ -74,9 +110,81 @@ class KeepLocator(object):
             elif hint.startswith('A'):
                 self.parse_permission_hint(hint)
             else:
-                self.hints.append(hint)
+                self._hints.append(hint)
+
+    @classmethod
+    def _parse(cls, locator_str):
+        # Return (md5sum, size, hint string, stripped locator) for a
+        # locator in the usual form, or None for anything else.
+        parsed = cls._parse_cache.get(locator_str)
+        if parsed is not None:
+            return parsed
+        m = cls.FAST_RE.match(locator_str)
+        if m is None:
+            return None
+        size = m.group(2)
+        if size is None:
+            parsed = (m.group(1), None, '', locator_str)
+        else:
+            end = m.end(2)
+            parsed = (m.group(1), int(size), locator_str[end:], locator_str[:end])
+        if len(cls._parse_cache) >= cls.PARSE_CACHE_SIZE:
+            # Cheaper than keeping track of the least recently used
+            # entries, and each entry is cheap to rebuild.
+            cls._parse_cache.clear()
+        cls._parse_cache[locator_str] = parsed
+        return parsed
+
+    @classmethod
+    def strip_hints(cls, locator_str):
+        """Return locator_str without its hints, like stripped()."""
+        parsed = cls._parse(locator_str)
+        if parsed is not None:
+            return parsed[3]
+        return cls(locator_str).stripped()
+
+    @classmethod
+    def md5_of(cls, locator_str):
+        """Return the block hash in locator_str."""
+        parsed = cls._parse(locator_str)
+        if parsed is not None:
+            return parsed[0]
+        return cls(locator_str).md5sum
+
+    @classmethod
+    def size_of(cls, locator_str):
+        """Return the block size given in locator_str, or None."""
+        parsed = cls._parse(locator_str)
+        if parsed is not None:
+            return parsed[1]
+        return cls(locator_str).size
+
+    def _parse_hints(self):
+        self._hints = []
+        for hint in self._hint_str.split('+')[1:]:
+            if hint.startswith('A'):
+                self._perm_sig, expiry = hint[1:].split('@', 1)
+                self._perm_expiry = datetime.datetime.utcfromtimestamp(int(expiry, 16))
+            else:
+                self._hints.append(hint)
+
+    @property
+    def hints(self):
+        if self._hints is None:
+            self._parse_hints()
+        return self._hints
+
+    @hints.setter
+    def hints(self, value):
+        if self._hints is None:
+            self._parse_hints()
+        self._hints = value
 
     def __str__(self):
+        if self._hints is None:
+            if self.size is None:
+                return native_str(self._md5sum)
+            return native_str('{}+{}{}'.format(self._md5sum, self.size, self._hint_str))
         return '+'.join(
             native_str(s)
             for s in [self.md5sum, self.size,
@@ -89,24 +197,32 @@ class KeepLocator(object):
         else:
             return self.md5sum
 
-    def _make_hex_prop(name, length):
+    def _make_hex_prop(name, length, from_hints=False):
         # Build and return a new property with the given name that
-        # must be a hex string of the given length.
+        # must be a hex string of the given length.  If from_hints is
+        # true, the value comes from the hints, which are parsed
+        # first if necessary.
         data_name = '_{}'.format(name)
         def getter(self):
+            if from_hints and self._hints is None:
+                self._parse_hints()
             return getattr(self, data_name)
         def setter(self, hex_str):
             if not arvados.util.is_hex(hex_str, length):
                 raise ValueError("{} is not a {}-digit hex string: {!r}".
                                  format(name, length, hex_str))
+            if from_hints and self._hints is None:
+                self._parse_hints()
             setattr(self, data_name, hex_str)
         return property(getter, setter)
 
     md5sum = _make_hex_prop('md5sum', 32)
-    perm_sig = _make_hex_prop('perm_sig', 40)
+    perm_sig = _make_hex_prop('perm_sig', 40, from_hints=True)
 
     @property
     def perm_expiry(self):
+        if self._hints is None:
+            self._parse_hints()
         return self._perm_expiry
 
     @perm_expiry.setter
@@ -115,6 +231,8 @@ class KeepLocator(object):
             raise ValueError(
                 "permission timestamp must be a hex Unix timestamp: {}".
                 format(value))
+        if self._hints is None:
+            self._parse_hints()
         self._perm_expiry = datetime.datetime.utcfromtimestamp(int(value, 16))
 
     def permission_hint(self):
@@ -174,11 +292,74 @@ class Keep(object):
         return Keep.global_client_object().put(data, **kwargs)
 
 class KeepBlockCache(object):
+    """LRU cache of Keep blocks, keyed by md5 hash.
+
+    Slots live in an OrderedDict with the most recently used slot at
+    the end, and the total size of the ready slots is kept in
+    `cache_total`, so lookups, reservations and evictions don't need
+    to scan the whole cache.
+
+    Optionally, blocks are also kept in a persistent DiskCache, which
+    is checked before going to the network and can be shared with
+    other processes and reused after a restart.  Alternatively, blocks
+    can be kept in a SharedMemoryCache, shared by all processes on the
+    host: then the RAM cache holds maps of the shared copies instead
+    of private ones.
+    """
+
     # Default RAM cache is 256MiB
-    def __init__(self, cache_max=(256 * 1024 * 1024)):
+    def __init__(self, cache_max=(256 * 1024 * 1024), disk_cache=False,
+                 disk_cache_dir=None, disk_cache_max=None,
+                 shared_cache=False, shared_cache_dir=None, shared_cache_max=None):
+        """
+        :cache_max:
+          Maximum size of the RAM cache, in bytes.
+
+        :disk_cache:
+          If True, also cache blocks on local disk.
+
+        :disk_cache_dir:
+          Directory for the disk cache.  Implies disk_cache=True.
+          Default: ~/.cache/arvados/keep
+
+        :disk_cache_max:
+          Maximum size of the disk cache, in bytes.  Default: 10% of
+          the free space on the filesystem holding disk_cache_dir.
+
+        :shared_cache:
+          If True, keep blocks in shared memory, where other processes
+          on this host can use them.  Can't be combined with
+          disk_cache.
+
+        :shared_cache_dir:
+          Directory for the shared cache.  Implies shared_cache=True.
+          Default: /dev/shm/arvados-keep-<uid>
+
+        :shared_cache_max:
+          Maximum size of the shared cache, in bytes, across all
+          processes.  Default: 10% of the free space on the filesystem
+          holding shared_cache_dir.
+
+        """
         self.cache_max = cache_max
-        self._cache = []
+        self.cache_total = 0
+        self.evictions = 0
+        self._cache = collections.OrderedDict()
         self._cache_lock = threading.Lock()
+        self.disk_cache = None
+        self._shared = bool(shared_cache or shared_cache_dir)
+        if self._shared:
+            if disk_cache or disk_cache_dir:
+                raise arvados.errors.ArgumentError(
+                    "can't use both a disk cache and a shared cache")
+            self.disk_cache = arvados.diskcache.SharedMemoryCache(
+                shared_cache_dir, shared_cache_max)
+        elif disk_cache or disk_cache_dir:
+            if disk_cache_dir is None:
+                disk_cache_dir = os.path.join(
+                    os.path.expanduser('~'), '.cache', 'arvados', 'keep')
+            self.disk_cache = arvados.diskcache.DiskCache(
+                disk_cache_dir, disk_cache_max)
 
     class CacheSlot(object):
         __slots__ = ("locator", "ready", "content")
@@ -205,33 +386,56 @@ class KeepBlockCache(object):
     def cap_cache(self):
         '''Cap the cache size to self.cache_max'''
         with self._cache_lock:
-            # Select all slots except those where ready.is_set() and content is
-            # None (that means there was an error reading the block).
-            self._cache = [c for c in self._cache if not (c.ready.is_set() and c.content is None)]
-            sm = sum([slot.size() for slot in self._cache])
-            while len(self._cache) > 0 and sm > self.cache_max:
-                for i in range(len(self._cache)-1, -1, -1):
-                    if self._cache[i].ready.is_set():
-                        del self._cache[i]
-                        break
-                sm = sum([slot.size() for slot in self._cache])
+            self._cap_cache()
+
+    def _cap_cache(self):
+        if self.cache_total <= self.cache_max:
+            return
+        # Evict least recently used slots first.  Slots that are still
+        # being filled don't count toward cache_total and can't be
+        # evicted yet.
+        evict = []
+        freed = 0
+        for slot in self._cache.values():
+            if self.cache_total - freed <= self.cache_max:
+                break
+            if slot.ready.is_set():
+                evict.append(slot)
+                freed += slot.size()
+        for slot in evict:
+            del self._cache[slot.locator]
+        self.cache_total -= freed
+        self.evictions += len(evict)
+
+    def stats(self):
+        """Return the RAM cache's size, limit, block count and
+        number of evictions so far, as a dict."""
+        with self._cache_lock:
+            return {
+                'bytes': self.cache_total,
+                'max_bytes': self.cache_max,
+                'blocks': len(self._cache),
+                'evictions': self.evictions,
+            }
 
     def _get(self, locator):
         # Test if the locator is already in the cache
-        for i in range(0, len(self._cache)):
-            if self._cache[i].locator == locator:
-                n = self._cache[i]
-                if i != 0:
-                    # move it to the front
-                    del self._cache[i]
-                    self._cache.insert(0, n)
-                return n
-        return None
+        n = self._cache.pop(locator, None)
+        if n is not None:
+            # move it to the most recently used end (OrderedDict has
+            # no move_to_end() on Python 2)
+            self._cache[locator] = n
+        return n
 
     def get(self, locator):
         with self._cache_lock:
             return self._get(locator)
 
+    def __contains__(self, locator):
+        # Unlike get(), doesn't count as a use of the block.
+        with self._cache_lock:
+            return locator in self._cache
+
     def reserve_cache(self, locator):
         '''Reserve a cache slot for the specified locator,
         or return the existing slot.'''
@@ -242,9 +446,291 @@ class KeepBlockCache(object):
             else:
                 # Add a new cache slot for the locator
                 n = KeepBlockCache.CacheSlot(locator)
-                self._cache.insert(0, n)
+                self._cache[locator] = n
                 return n, True
 
+    def set(self, slot, blob, persist=True):
+        '''Fill a slot returned by reserve_cache() and cap the cache.
+
+        If blob is None (the block could not be read), the slot is
+        dropped from the cache, so the next reader will try again.
+
+        Otherwise, unless persist is False (e.g., because the block came
+        from there), the block is also written to the disk cache, after
+        filling the slot, so readers waiting for it don't wait for the
+        disk.
+
+        A slot that is already filled is left alone, so its size is
+        only counted once.'''
+        with self._cache_lock:
+            if slot.ready.is_set():
+                return
+            slot.set(blob)
+            if self._cache.get(slot.locator) is slot:
+                if blob is None:
+                    del self._cache[slot.locator]
+                else:
+                    self.cache_total += slot.size()
+            self._cap_cache()
+        if persist:
+            self.persist(slot, blob)
+
+    def persist(self, slot, blob):
+        '''Write a block that set() put in `slot` to the disk cache, if
+        there is one.'''
+        if blob is None or self.disk_cache is None:
+            return
+        if self.disk_cache.set(slot.locator, blob) and self._shared:
+            # Keep a map of the shared copy instead of a private one.
+            # It was just written from blob, so skip the hash check.
+            mapped = self.disk_cache.get(slot.locator, verify=False)
+            if isinstance(mapped, mmap.mmap):
+                with self._cache_lock:
+                    if slot.content is blob:
+                        slot.content = mapped
+
+    def get_from_disk(self, locator):
+        '''Return the block from the disk cache, or None if it is not there
+        (or there is no disk cache).'''
+        if self.disk_cache is None:
+            return None
+        return self.disk_cache.get(locator)
+
+class KeepRangeCache(object):
+    """LRU cache of partial Keep blocks fetched with HTTP Range requests.
+
+    A partial block can't be checked against the block's hash, so it
+    is kept here rather than in the KeepBlockCache, where it could be
+    mistaken for (or replace) a verified block.  Ranges are keyed by
+    block hash and start offset, and a lookup succeeds if any cached
+    range of the block covers the requested bytes.
+    """
+
+    # Default cache is 16MiB
+    def __init__(self, cache_max=(16 * 1024 * 1024)):
+        self.cache_max = cache_max
+        self.cache_total = 0
+        self._ranges = collections.OrderedDict()
+        self._starts = {}
+        self._lock = threading.Lock()
+
+    def get(self, locator, offset, length):
+        """Return the `length` bytes of the block starting at `offset`,
+        or None if no cached range covers them."""
+        with self._lock:
+            for start in self._starts.get(locator, ()):
+                data = self._ranges[(locator, start)]
+                if start <= offset and offset + length <= start + len(data):
+                    self._ranges[(locator, start)] = self._ranges.pop((locator, start))
+                    return memoryview(data)[offset-start:offset-start+length]
+        return None
+
+    def set(self, locator, offset, data):
+        with self._lock:
+            key = (locator, offset)
+            old = self._ranges.pop(key, None)
+            if old is not None:
+                self.cache_total -= len(old)
+            self._ranges[key] = data
+            self._starts.setdefault(locator, set()).add(offset)
+            self.cache_total += len(data)
+            while self._ranges and self.cache_total > self.cache_max:
+                (loc, start), old = self._ranges.popitem(last=False)
+                self.cache_total -= len(old)
+                self._starts[loc].discard(start)
+                if not self._starts[loc]:
+                    del self._starts[loc]
+
+class KeepNotFoundCache(object):
+    """Short-lived record of blocks that every Keep service reported missing.
+
+    When a read fails because each service answered 404 or 410, the
+    error is remembered for `ttl` seconds, so that repeated reads of
+    the same missing block fail right away instead of asking every
+    service again.  Entries are keyed by block hash; the oldest are
+    dropped when there are more than `max_entries`.
+
+    KeepClient only uses this for GET requests, and only if asked to
+    (see its not_found_ttl argument): a block that another client
+    writes meanwhile is reported missing until the entry expires.
+    """
+
+    DEFAULT_TTL = 10
+    DEFAULT_MAX_ENTRIES = 10000
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._missing = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, locator):
+        """Return the saved (message, service_errors) for a missing
+        block, or None if it isn't known to be missing."""
+        with self._lock:
+            entry = self._missing.get(locator)
+            if entry is None:
+                return None
+            expires, error = entry
+            if time.time() >= expires:
+                del self._missing[locator]
+                return None
+            return error
+
+    def set(self, locator, message, service_errors):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._missing.pop(locator, None)
+            self._missing[locator] = (time.time() + self.ttl, (message, service_errors))
+            while len(self._missing) > self.max_entries:
+                self._missing.popitem(last=False)
+
+    def discard(self, locator):
+        with self._lock:
+            self._missing.pop(locator, None)
+
+    def clear(self):
+        with self._lock:
+            self._missing.clear()
+
+class KeepThrottle(object):
+    """Limit the bandwidth and concurrency of Keep transfers.
+
+    A KeepClient's throttle is shared by every thread using the
+    client.  Bandwidth is limited with a token bucket: tokens are added
+    at max_bytes_per_second, up to BURST_SECONDS worth, and each chunk
+    of data sent or received takes its size in tokens, waiting for the
+    bucket to refill if necessary.  Because the limit is applied chunk
+    by chunk, concurrent transfers share the bandwidth instead of
+    taking turns.  At most max_in_flight requests run at once; others
+    wait for one to finish.
+
+    Both limits can be changed at any time, and None means no limit.
+    """
+
+    BURST_SECONDS = 0.25
+
+    # The most pycurl sends or receives in one callback.
+    CHUNK_SIZE = 65536
+
+    def __init__(self, max_bytes_per_second=None, max_in_flight=None):
+        self._cond = threading.Condition()
+        self._max_bytes_per_second = max_bytes_per_second
+        self._max_in_flight = max_in_flight
+        self._tokens = float('inf')
+        self._refilled = time.time()
+        self.in_flight = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self, now):
+        # Called with the lock held.
+        rate = self._max_bytes_per_second
+        if rate:
+            self._tokens = min(self._tokens + (now - self._refilled) * rate,
+                               rate * self.BURST_SECONDS)
+        self._refilled = now
+
+    @property
+    def max_bytes_per_second(self):
+        return self._max_bytes_per_second
+
+    @max_bytes_per_second.setter
+    def max_bytes_per_second(self, value):
+        with self._cond:
+            self._max_bytes_per_second = value
+            self._tokens = float('inf')
+            self._refill(time.time())
+
+    @property
+    def max_in_flight(self):
+        return self._max_in_flight
+
+    @max_in_flight.setter
+    def max_in_flight(self, value):
+        with self._cond:
+            self._max_in_flight = value
+            self._cond.notify_all()
+
+    def limits_bandwidth(self):
+        return bool(self._max_bytes_per_second)
+
+    def stall_limits(self, bytes_per_second, seconds):
+        """Return the (bytes_per_second, seconds) low-speed limits for a
+        transfer that has started under this throttle, given the limits
+        it would have without one.
+
+        Requests in flight share the bandwidth limit, so a transfer is
+        only sure of an even share of it.  Below half that share, it is
+        stalled rather than held back, and should be aborted.  The
+        window is long enough to average over a few throttled chunks.
+        """
+        with self._cond:
+            rate = self._max_bytes_per_second
+            if not rate:
+                return bytes_per_second, seconds
+            share = float(rate) / max(self._max_in_flight or 0, self.in_flight, 1)
+        return (max(1, min(bytes_per_second, share / 2)),
+                max(seconds, 4.0 * self.CHUNK_SIZE / share))
+
+    def reserve(self, nbytes):
+        """Take nbytes worth of tokens.  Return the number of seconds
+        the caller must wait before sending or receiving them."""
+        if not self._max_bytes_per_second:
+            return 0
+        with self._cond:
+            rate = self._max_bytes_per_second
+            if not rate:
+                return 0
+            self._refill(time.time())
+            self._tokens -= nbytes
+            if self._tokens >= 0:
+                return 0
+            delay = -self._tokens / rate
+            self.wait_seconds += delay
+            return delay
+
+    def consume(self, nbytes):
+        """Wait until nbytes can be sent or received."""
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    def try_start(self):
+        """Start a request if there's room.  Return True if it started."""
+        with self._cond:
+            if self._max_in_flight and self.in_flight >= self._max_in_flight:
+                return False
+            self.in_flight += 1
+            return True
+
+    def start(self):
+        """Wait until there's room, then start a request."""
+        with self._cond:
+            if self._max_in_flight and self.in_flight >= self._max_in_flight:
+                t0 = time.time()
+                while self._max_in_flight and self.in_flight >= self._max_in_flight:
+                    self._cond.wait()
+                self.wait_seconds += time.time() - t0
+            self.in_flight += 1
+
+    def finish(self):
+        """Record that a request started with start() or try_start() is done."""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def snapshot(self):
+        """Return the current limits, the number of requests in flight,
+        and the total time callers have spent waiting (in seconds)."""
+        with self._cond:
+            return {
+                'max_bytes_per_second': self._max_bytes_per_second,
+                'max_in_flight': self._max_in_flight,
+                'in_flight': self.in_flight,
+                'wait_seconds': self.wait_seconds,
+            }
+
 class Counter(object):
     def __init__(self, v=0):
         self._lk = threading.Lock()
@@ -259,6 +745,487 @@ class Counter(object):
             return self._val
 
 
+class _Histogram(object):
+    """Count observations in buckets with the given upper bounds.
+
+    Not thread-safe: KeepMetrics holds its lock while updating.
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """Return a dict with the count, sum and cumulative bucket
+        counts, as [upper_bound, count] pairs ending with +Inf."""
+        buckets = []
+        total = 0
+        for bound, n in zip(self.bounds, self.counts):
+            total += n
+            buckets.append([bound, total])
+        buckets.append([float('inf'), self.count])
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+
+class KeepMetrics(object):
+    """Request statistics for a KeepClient.
+
+    KeepClient calls the methods below as requests to Keep services
+    start and finish.  Pass a subclass as KeepClient's `metrics`
+    argument to send these events somewhere else as well.
+    KeepClient.metrics_snapshot() combines this with the client's
+    counters and cache statistics; KeepPrometheusCollector exports
+    it for Prometheus.
+    """
+
+    # Upper bounds, in seconds, of the latency histogram buckets.
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                       1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._ttfb = {}
+        self._retries = collections.defaultdict(int)
+        self._bytes_in_flight = collections.defaultdict(int)
+
+    def request_started(self, service_root, method, nbytes):
+        """A request that will transfer about nbytes has started."""
+        with self._lock:
+            self._bytes_in_flight[method] += nbytes
+
+    def request_finished(self, service_root, method, nbytes, status, elapsed, ttfb=None):
+        """A request has finished.
+
+        status is the HTTP status code, or 0 if there was no response.
+        elapsed and ttfb (time to first byte) are in seconds.
+        """
+        with self._lock:
+            self._bytes_in_flight[method] -= nbytes
+            key = (service_root, method, status)
+            hist = self._latency.get(key)
+            if hist is None:
+                hist = self._latency[key] = _Histogram(self.buckets)
+            hist.observe(elapsed)
+            if ttfb:
+                key = (service_root, method)
+                hist = self._ttfb.get(key)
+                if hist is None:
+                    hist = self._ttfb[key] = _Histogram(self.buckets)
+                hist.observe(ttfb)
+
+    def retried(self, method, count=1):
+        """A get or put needed `count` more rounds of requests."""
+        with self._lock:
+            self._retries[method] += count
+
+    def snapshot(self):
+        """Return the statistics collected so far as a dict.
+
+        'latency' is keyed by service root, method and status code;
+        'ttfb' by service root and method.  Each histogram is a dict
+        as returned by _Histogram.snapshot().
+        """
+        with self._lock:
+            latency = {}
+            for (root, method, status), hist in self._latency.items():
+                latency.setdefault(root, {}).setdefault(method, {})[status] = hist.snapshot()
+            ttfb = {}
+            for (root, method), hist in self._ttfb.items():
+                ttfb.setdefault(root, {})[method] = hist.snapshot()
+            return {
+                'latency': latency,
+                'ttfb': ttfb,
+                'retries': dict(self._retries),
+                'bytes_in_flight': dict(self._bytes_in_flight),
+            }
+
+
+class KeepPrometheusCollector(object):
+    """Export a KeepClient's metrics_snapshot() to Prometheus.
+
+    Register it with a prometheus_client registry, e.g.,
+    ``prometheus_client.REGISTRY.register(KeepPrometheusCollector(kc))``.
+    The values are read from the client each time Prometheus scrapes
+    them.  Requires the prometheus_client package.
+    """
+
+    def __init__(self, keep_client, prefix='arvados_keep'):
+        # Fail now, rather than on the first scrape, if
+        # prometheus_client isn't installed.
+        import prometheus_client.core
+        self._metric_types = prometheus_client.core
+        self.keep_client = keep_client
+        self.prefix = prefix
+
+    def collect(self):
+        core = self._metric_types
+        snap = self.keep_client.metrics_snapshot()
+        prefix = self.prefix
+
+        def histogram_buckets(hist):
+            return [['+Inf' if le == float('inf') else str(le), n]
+                    for le, n in hist['buckets']]
+
+        latency = core.HistogramMetricFamily(
+            prefix + '_request_duration_seconds',
+            'Time taken by requests to Keep services',
+            labels=['service', 'method', 'status'])
+        for root, methods in snap['latency'].items():
+            for method, statuses in methods.items():
+                for status, hist in statuses.items():
+                    latency.add_metric([root, method, str(status)],
+                                       histogram_buckets(hist), hist['sum'])
+        yield latency
+
+        ttfb = core.HistogramMetricFamily(
+            prefix + '_time_to_first_byte_seconds',
+            'Time until Keep services started responding',
+            labels=['service', 'method'])
+        for root, methods in snap['ttfb'].items():
+            for method, hist in methods.items():
+                ttfb.add_metric([root, method], histogram_buckets(hist), hist['sum'])
+        yield ttfb
+
+        retries = core.CounterMetricFamily(
+            prefix + '_retries', 'Extra rounds of requests needed by get and put',
+            labels=['method'])
+        for method, n in snap['retries'].items():
+            retries.add_metric([method], n)
+        yield retries
+
+        in_flight = core.GaugeMetricFamily(
+            prefix + '_bytes_in_flight', 'Bytes being transferred to or from Keep services',
+            labels=['method'])
+        for method, n in snap['bytes_in_flight'].items():
+            in_flight.add_metric([method], n)
+        yield in_flight
+
+        for name, value in sorted(snap['counters'].items()):
+            yield core.CounterMetricFamily(
+                '{}_{}'.format(prefix, name), 'KeepClient {} counter'.format(name), value=value)
+
+        for name, value in sorted(snap['block_cache'].items()):
+            if name == 'evictions':
+                yield core.CounterMetricFamily(
+                    prefix + '_block_cache_evictions', 'Blocks evicted from the block cache',
+                    value=value)
+            else:
+                yield core.GaugeMetricFamily(
+                    '{}_block_cache_{}'.format(prefix, name),
+                    'Block cache {}'.format(name), value=value)
+
+
+class _WholeBlock(object):
+    """A whole block, checked against its hash, returned by
+    KeepService.get() when the service ignored a Range request."""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class _ResponseBody(object):
+    """Receive a GET response body into a single preallocated buffer.
+
+    Use write() as the pycurl WRITEFUNCTION.  The buffer is allocated
+    on the first write, sized from the Content-Length header or the
+    caller's size hint, so the body is copied once (from libcurl into
+    the buffer) and never reassembled.  The md5 digest is updated as
+    data arrives, so checking it doesn't take another pass.
+    """
+
+    def __init__(self, headers, size_hint=None):
+        self._headers = headers
+        self._size_hint = size_hint
+        self._buf = None
+        self.size = 0
+        self.md5 = hashlib.md5()
+
+    def _allocate(self):
+        try:
+            size = int(self._headers['content-length'])
+        except (KeyError, ValueError):
+            size = self._size_hint or 0
+        # Don't trust a hint bigger than any Keep block.
+        return bytearray(min(size, config.KEEP_BLOCK_SIZE))
+
+    def write(self, data):
+        if self._buf is None:
+            self._buf = self._allocate()
+        end = self.size + len(data)
+        # Copies into the preallocated space, or grows the buffer if
+        # the response is longer than expected.
+        self._buf[self.size:end] = data
+        self.md5.update(data)
+        self.size = end
+
+    def getvalue(self):
+        """Return the body as a bytearray (without copying it)."""
+        if self._buf is None:
+            return bytearray()
+        if self.size < len(self._buf):
+            del self._buf[self.size:]
+        return self._buf
+
+
+def _block_result(blob, view=False):
+    """Return a block read from Keep the way get() returns it.
+
+    Blocks in the cache may be bytearrays, mmaps or memoryviews, and are
+    shared with other readers.  By default, return those as bytes,
+    copying the block.  With view=True, return a read-only
+    memoryview of the block instead, without copying it (except on
+    Pythons too old to make read-only views of writable memory).
+    """
+    if not view:
+        if isinstance(blob, (bytearray, memoryview, mmap.mmap)):
+            return bytes(blob)
+        return blob
+    blobview = memoryview(blob)
+    if not blobview.readonly:
+        try:
+            blobview = blobview.toreadonly()
+        except AttributeError:
+            blobview = memoryview(bytes(blobview))
+    return blobview
+
+
+def _block_view(data):
+    """Return a flat byte view of data to upload.
+
+    bytes and bytearray are returned as is.  Other objects supporting
+    the buffer protocol (memoryview, mmap, ...) are wrapped in a
+    memoryview without copying them; anything else (i.e., text) is
+    encoded.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        return data
+    try:
+        view = memoryview(data)
+    except TypeError:
+        return data.encode()
+    if view.ndim != 1 or view.itemsize != 1:
+        view = view.cast('B')
+    return view
+
+
+class _RequestBody(object):
+    """Send a PUT request body from a shared buffer.
+
+    Use read() as the pycurl READFUNCTION.  Each call returns a slice
+    of a memoryview over the block, so the block is never copied, and
+    any number of writer threads can upload the same buffer at once.
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._pos = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def read(self, size):
+        chunk = self._view[self._pos:self._pos+size]
+        self._pos += len(chunk)
+        return chunk
+
+    def close(self):
+        """Drop the reference to the block.  The pycurl handle keeps
+        read() as its READFUNCTION after the request, until the
+        handle is reused."""
+        self._view = memoryview(b'')
+
+
+class _UserAgentPool(object):
+    """Idle pycurl handles for one Keep service.
+
+    libcurl keeps the connection open in a handle after each request,
+    so handing the handle back out for the same service lets the next
+    request skip the TCP (and TLS) handshake.  Handles are reused most
+    recently used first; handles idle longer than idle_timeout, and
+    any beyond max_idle, are closed.
+    """
+
+    def __init__(self, max_idle=8, idle_timeout=60):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+    def get(self):
+        expired = []
+        ua = None
+        with self._lock:
+            if self._idle:
+                ua, last_used = self._idle.pop()
+                if time.time() - last_used > self.idle_timeout:
+                    # Everything older than this is stale too.
+                    expired = [ua] + [u for u, _ in self._idle]
+                    self._idle.clear()
+                    ua = None
+        for u in expired:
+            u.close()
+        if ua is None:
+            ua = pycurl.Curl()
+        return ua
+
+    def put(self, ua):
+        expired = []
+        stale = time.time() - self.idle_timeout
+        with self._lock:
+            self._idle.append((ua, time.time()))
+            while self._idle and (len(self._idle) > self.max_idle or
+                                  self._idle[0][1] < stale):
+                expired.append(self._idle.popleft()[0])
+        for u in expired:
+            u.close()
+
+
+def _split_timeout(timeouts):
+    """Return (connection_timeout, read_timeout, minimum_bandwidth) for
+    a KeepClient timeout setting (a number, or a 2- or 3-tuple)."""
+    if isinstance(timeouts, tuple):
+        if len(timeouts) == 2:
+            return timeouts + (KeepClient.DEFAULT_TIMEOUT[2],)
+        return timeouts
+    return (timeouts, timeouts, KeepClient.DEFAULT_TIMEOUT[2])
+
+
+class KeepServiceHealth(object):
+    """Long-lived record of how well one Keep service is responding.
+
+    KeepClient keeps one of these for each service it talks to, and
+    updates it after every request.  It tracks moving averages of
+    request latency, time to first byte, download bandwidth and error
+    rate, and runs a circuit breaker: after FAILURE_THRESHOLD
+    consecutive failures (network errors or 5xx responses) the circuit
+    is "open" for OPEN_DURATION seconds, then "half-open" until the
+    next request either succeeds (closing it) or fails (opening it
+    again).
+
+    Services with an open circuit are tried after the others, but are
+    never skipped, since they may hold the only copy of a block.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    FAILURE_THRESHOLD = 5
+    OPEN_DURATION = 30
+    # Weight of the newest sample in the moving averages.
+    EWMA_WEIGHT = 0.2
+    # Only estimate bandwidth from responses at least this big.
+    BANDWIDTH_MIN_SAMPLE = 2**20
+    # Abort a GET that falls below this fraction of the service's
+    # usual bandwidth (for LOW_SPEED_TIME seconds), but don't raise
+    # the minimum bandwidth above BANDWIDTH_FLOOR_CAP.
+    BANDWIDTH_FLOOR_FRACTION = 0.125
+    BANDWIDTH_FLOOR_CAP = 2**20
+    # Connection timeout for a service whose circuit is open.
+    OPEN_CONNECT_TIMEOUT = 1
+
+    def __init__(self, root):
+        self.root = root
+        self.latency = None
+        self.ttfb = None
+        self.bandwidth = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def _average(self, old, sample):
+        if old is None:
+            return sample
+        return old + self.EWMA_WEIGHT * (sample - old)
+
+    def record_success(self, elapsed, ttfb=None, nbytes=0):
+        """Record a request the service answered (including 4xx)."""
+        with self._lock:
+            self.requests += 1
+            self.consecutive_failures = 0
+            self._opened_at = None
+            self.error_rate = self._average(self.error_rate, 0.0)
+            self.latency = self._average(self.latency, elapsed)
+            if ttfb is not None:
+                self.ttfb = self._average(self.ttfb, ttfb)
+                if nbytes >= self.BANDWIDTH_MIN_SAMPLE and elapsed > ttfb:
+                    self.bandwidth = self._average(
+                        self.bandwidth, nbytes / (elapsed - ttfb))
+
+    def record_failure(self):
+        """Record a network error, timeout or 5xx response."""
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.error_rate = self._average(self.error_rate, 1.0)
+            if (self.consecutive_failures >= self.FAILURE_THRESHOLD and
+                (self._opened_at is None or
+                 time.time() - self._opened_at >= self.OPEN_DURATION)):
+                # Open the circuit, or re-open it after a failed probe.
+                self._opened_at = time.time()
+
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return self.CLOSED
+            elif time.time() - self._opened_at < self.OPEN_DURATION:
+                return self.OPEN
+            else:
+                return self.HALF_OPEN
+
+    def adjust_timeout(self, timeouts, for_download=True):
+        """Return timeouts tightened to suit what we've seen of this service.
+
+        Raises the minimum bandwidth for downloads from a service
+        that's usually fast, so a stalled transfer fails over to
+        another replica sooner, and shortens the connection timeout
+        while the circuit is open.
+        """
+        if not timeouts:
+            return timeouts
+        conn_t, xfer_t, bandwidth_bps = _split_timeout(timeouts)
+        if self.state() == self.OPEN:
+            conn_t = min(conn_t, self.OPEN_CONNECT_TIMEOUT)
+        if for_download and self.bandwidth is not None:
+            bandwidth_bps = max(bandwidth_bps, min(
+                self.BANDWIDTH_FLOOR_CAP,
+                self.bandwidth * self.BANDWIDTH_FLOOR_FRACTION))
+        return (conn_t, xfer_t, bandwidth_bps)
+
+    def snapshot(self):
+        """Return the current health record as a dict."""
+        state = self.state()
+        with self._lock:
+            return {
+                'state': state,
+                'latency': self.latency,
+                'ttfb': self.ttfb,
+                'bandwidth': self.bandwidth,
+                'error_rate': self.error_rate,
+                'requests': self.requests,
+                'failures': self.failures,
+                'consecutive_failures': self.consecutive_failures,
+            }
+
+
 class KeepClient(object):
 
     # Default Keep server connection timeout:  2 seconds
@@ -270,6 +1237,44 @@ class KeepClient(object):
     DEFAULT_TIMEOUT = (2, 256, 32768)
     DEFAULT_PROXY_TIMEOUT = (20, 256, 32768)
 
+    # Keep up to this many idle connections to each Keep service, and
+    # close them after this many seconds without use.
+    MAX_IDLE_CONNECTIONS = 8
+    CONNECTION_IDLE_TIMEOUT = 60
+
+    # Default number of blocks get_many() fetches at once.
+    DEFAULT_GET_MANY_CONCURRENCY = 4
+
+    # Default number of blocks head_many() checks at once.
+    DEFAULT_HEAD_MANY_CONCURRENCY = 16
+
+    # Status values in head_many() results.
+    HEAD_PRESENT = 'present'
+    HEAD_MISSING = 'missing'
+    HEAD_ERROR = 'error'
+    HeadResult = collections.namedtuple('HeadResult', ['status', 'value'])
+
+    # Maximum number of uploads to run at once, across all put() calls.
+    DEFAULT_MAX_PUT_THREADS = 16
+
+    # get_range() reads whole multiples of this many bytes.
+    RANGE_READ_ALIGN = 2**16
+
+    # Remember the rendezvous order of Keep services for this many
+    # recently used blocks.
+    SERVICE_ROOTS_CACHE_SIZE = 4096
+
+    # Pass hedge_after=HEDGE_ADAPTIVE to derive the hedging threshold
+    # from each service's observed time to first byte (see
+    # KeepServiceHealth): hedge after
+    # HEDGE_ADAPTIVE_FACTOR times its moving average (but not sooner
+    # than HEDGE_ADAPTIVE_MIN seconds), or after HEDGE_ADAPTIVE_INITIAL
+    # seconds for a service we haven't heard from yet.
+    HEDGE_ADAPTIVE = 'adaptive'
+    HEDGE_ADAPTIVE_FACTOR = 3
+    HEDGE_ADAPTIVE_MIN = 0.01
+    HEDGE_ADAPTIVE_INITIAL = 0.5
+
 
     class KeepService(object):
         """Make requests to a single Keep service, and track results.
@@ -289,12 +1294,19 @@ class KeepClient(object):
             arvados.errors.HttpError,
         )
 
-        def __init__(self, root, user_agent_pool=queue.LifoQueue(),
+        def __init__(self, root, user_agent_pool=None,
                      upload_counter=None,
                      download_counter=None,
                      headers={},
-                     insecure=False):
+                     insecure=False,
+                     new_connections_counter=None,
+                     reused_connections_counter=None,
+                     health=None,
+                     metrics=None,
+                     throttle=None):
             self.root = root
+            if user_agent_pool is None:
+                user_agent_pool = _UserAgentPool()
             self._user_agent_pool = user_agent_pool
             self._result = {'error': None}
             self._usable = True
@@ -305,7 +1317,13 @@ class KeepClient(object):
             self.put_headers = headers
             self.upload_counter = upload_counter
             self.download_counter = download_counter
+            self.new_connections_counter = new_connections_counter
+            self.reused_connections_counter = reused_connections_counter
             self.insecure = insecure
+            self.health = health
+            self.metrics = metrics
+            self.throttle = throttle
+            self.ttfb = None
 
         def usable(self):
             """Is it worth attempting a request?"""
@@ -319,18 +1337,53 @@ class KeepClient(object):
             return self._result
 
         def _get_user_agent(self):
-            try:
-                return self._user_agent_pool.get(block=False)
-            except queue.Empty:
-                return pycurl.Curl()
+            return self._user_agent_pool.get()
 
         def _put_user_agent(self, ua):
             try:
+                # reset() clears options but keeps the open connection.
                 ua.reset()
-                self._user_agent_pool.put(ua, block=False)
+                self._user_agent_pool.put(ua)
             except:
                 ua.close()
 
+        def _record_health(self, ok, elapsed, nbytes=0):
+            if self.health is None:
+                return
+            status = self._result.get('status_code')
+            if ok or (status is not None and status < 500):
+                self.health.record_success(elapsed, self.ttfb, nbytes)
+            else:
+                self.health.record_failure()
+
+        def _record_metrics(self, method, nbytes, elapsed):
+            if self.metrics is None:
+                return
+            self.metrics.request_finished(
+                self.root, method, nbytes, self._result.get('status_code', 0),
+                elapsed, self.ttfb)
+
+        def _count_connection(self, curl):
+            # NUM_CONNECTS is the number of new connections libcurl
+            # made for the last transfer; zero means it reused one.
+            if curl.getinfo(pycurl.NUM_CONNECTS) > 0:
+                counter = self.new_connections_counter
+            else:
+                counter = self.reused_connections_counter
+            if counter:
+                counter.add(1)
+
+        def _setcurlkeepalive(self, curl):
+            if hasattr(pycurl, 'TCP_KEEPALIVE'):
+                curl.setopt(pycurl.TCP_KEEPALIVE, 1)
+                curl.setopt(pycurl.TCP_KEEPIDLE, 75)
+                curl.setopt(pycurl.TCP_KEEPINTVL, 75)
+            else:
+                # pycurl < 7.43 has no CURLOPT_TCP_KEEPALIVE, so
+                # set the socket options ourselves.
+                curl.setopt(pycurl.OPENSOCKETFUNCTION,
+                            lambda *args, **kwargs: self._socket_open(*args, **kwargs))
+
         def _socket_open(self, *args, **kwargs):
             if len(args) + len(kwargs) == 2:
                 return self._socket_open_pycurl_7_21_5(*args, **kwargs)
@@ -355,40 +1408,116 @@ class KeepClient(object):
             self._socket = s
             return s
 
-        def get(self, locator, method="GET", timeout=None):
+        def _progress(self, cancel):
+            # Returning non-zero makes libcurl abort the transfer.
+            if cancel.is_set():
+                return 1
+
+        def _perform(self, request):
+            # Run a request generator from _get_request() or
+            # _put_request() in this thread.  It yields a curl handle
+            # that's ready to go, and then, once the transfer is done
+            # (or has raised an exception), the result.
+            if self.throttle is not None:
+                self.throttle.start()
+            try:
+                curl = next(request)
+                try:
+                    curl.perform()
+                except Exception as e:
+                    return request.throw(e)
+                return request.send(None)
+            finally:
+                if self.throttle is not None:
+                    self.throttle.finish()
+
+        def _abandon(self, curl, method, nbytes, t):
+            # The caller closed a request generator without running
+            # its transfer to the end.
+            curl.close()
+            self._result = {'error': arvados.errors.HttpError(0, 'Request abandoned')}
+            self._record_metrics(method, nbytes, time.time() - t.start)
+
+        def get(self, locator, method="GET", timeout=None, started=None, cancel=None,
+                byte_range=None):
+            return self._perform(self._get_request(
+                locator, method, timeout, started, cancel, byte_range, self.throttle))
+
+        def _get_request(self, locator, method="GET", timeout=None, started=None, cancel=None,
+                         byte_range=None, throttle=None):
             # locator is a KeepLocator object.
+            # started: if given, a threading.Event to set as soon as
+            # the service starts sending its response.
+            # cancel: if given, a threading.Event; setting it aborts
+            # the request.
+            # byte_range: if given, an (offset, length) tuple: only
+            # fetch (and return) that part of the block.
+            # throttle: if given, a KeepThrottle to wait on for each
+            # chunk of the response.
             url = self.root + str(locator)
             _logger.debug("Request: %s %s", method, url)
             curl = self._get_user_agent()
             ok = None
+            self.ttfb = None
+            if method == "HEAD":
+                expect_bytes = 0
+            elif byte_range:
+                expect_bytes = byte_range[1]
+            else:
+                expect_bytes = locator.size or 0
+            if self.metrics is not None:
+                self.metrics.request_started(self.root, method, expect_bytes)
             try:
                 with timer.Timer() as t:
                     self._headers = {}
-                    response_body = BytesIO()
+                    response_body = _ResponseBody(
+                        self._headers, byte_range[1] if byte_range else locator.size)
                     curl.setopt(pycurl.NOSIGNAL, 1)
-                    curl.setopt(pycurl.OPENSOCKETFUNCTION,
-                                lambda *args, **kwargs: self._socket_open(*args, **kwargs))
+                    self._setcurlkeepalive(curl)
                     curl.setopt(pycurl.URL, url.encode('utf-8'))
                     curl.setopt(pycurl.HTTPHEADER, [
                         '{}: {}'.format(k,v) for k,v in self.get_headers.items()])
-                    curl.setopt(pycurl.WRITEFUNCTION, response_body.write)
-                    curl.setopt(pycurl.HEADERFUNCTION, self._headerfunction)
+                    curl.setopt(pycurl.WRITEFUNCTION, self._throttled(
+                        response_body.write, throttle, lambda data, _: len(data)))
+                    if started is None:
+                        curl.setopt(pycurl.HEADERFUNCTION, self._headerfunction)
+                    else:
+                        def headerfunction(header_line):
+                            started.set()
+                            return self._headerfunction(header_line)
+                        curl.setopt(pycurl.HEADERFUNCTION, headerfunction)
+                    if cancel is not None:
+                        curl.setopt(pycurl.NOPROGRESS, 0)
+                        curl.setopt(getattr(pycurl, 'XFERINFOFUNCTION', pycurl.PROGRESSFUNCTION),
+                                    lambda *args: self._progress(cancel))
                     if self.insecure:
                         curl.setopt(pycurl.SSL_VERIFYPEER, 0)
                     else:
                         curl.setopt(pycurl.CAINFO, arvados.util.ca_certs_path())
                     if method == "HEAD":
                         curl.setopt(pycurl.NOBODY, True)
+                    elif byte_range:
+                        curl.setopt(pycurl.RANGE, '{}-{}'.format(
+                            byte_range[0], byte_range[0] + byte_range[1] - 1))
+                    if self.health is not None:
+                        timeout = self.health.adjust_timeout(timeout)
                     self._setcurltimeouts(curl, timeout, method=="HEAD")
-
                     try:
-                        curl.perform()
+                        yield curl
+                    except GeneratorExit:
+                        self._abandon(curl, method, expect_bytes, t)
+                        raise
                     except Exception as e:
                         raise arvados.errors.HttpError(0, str(e))
                     finally:
+                        # pycurl hands libcurl a duplicate of this
+                        # socket, so closing ours doesn't close the
+                        # (reusable) connection.
                         if self._socket:
                             self._socket.close()
                             self._socket = None
+                    self._count_connection(curl)
+                    self.ttfb = curl.getinfo(pycurl.STARTTRANSFER_TIME)
                     self._result = {
                         'status_code': curl.getinfo(pycurl.RESPONSE_CODE),
                         'body': response_body.getvalue(),
@@ -406,6 +1535,9 @@ class KeepClient(object):
                     'error': e,
                 }
             self._usable = ok != False
+            if cancel is None or not cancel.is_set():
+                self._record_health(ok, t.secs, response_body.size)
+            self._record_metrics(method, expect_bytes, t.secs)
             if self._result.get('status_code', None):
                 # The client worked well enough to get an HTTP status
                 # code, so presumably any problems are just on the
@@ -415,6 +1547,9 @@ class KeepClient(object):
                 # Don't return this client to the pool, in case it's
                 # broken.
                 curl.close()
+            yield self._get_result(url, locator, method, byte_range, ok, response_body, t)
+
+        def _get_result(self, url, locator, method, byte_range, ok, response_body, t):
             if not ok:
                 _logger.debug("Request fail: GET %s => %s: %s",
                               url, type(self._result['error']), str(self._result['error']))
@@ -437,28 +1572,40 @@ class KeepClient(object):
 
             if self.download_counter:
                 self.download_counter.add(len(self._result['body']))
-            resp_md5 = hashlib.md5(self._result['body']).hexdigest()
+            if byte_range and self._result['status_code'] == 206:
+                # A partial block can't be checked against its hash.
+                return self._result['body']
+            resp_md5 = response_body.md5.hexdigest()
             if resp_md5 != locator.md5sum:
                 _logger.warning("Checksum fail: md5(%s) = %s",
                                 url, resp_md5)
                 self._result['error'] = arvados.errors.HttpError(
                     0, 'Checksum fail')
                 return None
+            if byte_range:
+                # The service ignored the Range header and sent the
+                # whole block.  It's verified, so the caller can cache it.
+                return _WholeBlock(self._result['body'])
             return self._result['body']
 
         def put(self, hash_s, body, timeout=None):
+            return self._perform(self._put_request(hash_s, body, timeout, self.throttle))
+
+        def _put_request(self, hash_s, body, timeout=None, throttle=None):
             url = self.root + hash_s
             _logger.debug("Request: PUT %s", url)
             curl = self._get_user_agent()
             ok = None
+            self.ttfb = None
+            if self.metrics is not None:
+                self.metrics.request_started(self.root, "PUT", len(body))
             try:
                 with timer.Timer() as t:
                     self._headers = {}
-                    body_reader = BytesIO(body)
+                    body_reader = _RequestBody(body)
                     response_body = BytesIO()
                     curl.setopt(pycurl.NOSIGNAL, 1)
-                    curl.setopt(pycurl.OPENSOCKETFUNCTION,
-                                lambda *args, **kwargs: self._socket_open(*args, **kwargs))
+                    self._setcurlkeepalive(curl)
                     curl.setopt(pycurl.URL, url.encode('utf-8'))
                     # Using UPLOAD tells cURL to wait for a "go ahead" from the
                     # Keep server (in the form of a HTTP/1.1 "100 Continue"
@@ -467,8 +1614,9 @@ class KeepClient(object):
                     # is invalid or the server is read-only, without waiting for
                     # the client to send the entire block.
                     curl.setopt(pycurl.UPLOAD, True)
-                    curl.setopt(pycurl.INFILESIZE, len(body))
-                    curl.setopt(pycurl.READFUNCTION, body_reader.read)
+                    curl.setopt(pycurl.INFILESIZE, len(body_reader))
+                    curl.setopt(pycurl.READFUNCTION, self._throttled(
+                        body_reader.read, throttle, lambda _, chunk: len(chunk)))
                     curl.setopt(pycurl.HTTPHEADER, [
                         '{}: {}'.format(k,v) for k,v in self.put_headers.items()])
                     curl.setopt(pycurl.WRITEFUNCTION, response_body.write)
@@ -477,15 +1625,25 @@ class KeepClient(object):
                         curl.setopt(pycurl.SSL_VERIFYPEER, 0)
                     else:
                         curl.setopt(pycurl.CAINFO, arvados.util.ca_certs_path())
+                    if self.health is not None:
+                        timeout = self.health.adjust_timeout(timeout, for_download=False)
                     self._setcurltimeouts(curl, timeout)
                     try:
-                        curl.perform()
+                        yield curl
+                    except GeneratorExit:
+                        self._abandon(curl, "PUT", len(body), t)
+                        raise
                     except Exception as e:
                         raise arvados.errors.HttpError(0, str(e))
                     finally:
+                        body_reader.close()
+                        # pycurl hands libcurl a duplicate of this
+                        # socket, so closing ours doesn't close the
+                        # (reusable) connection.
                         if self._socket:
                             self._socket.close()
                             self._socket = None
+                    self._count_connection(curl)
                     self._result = {
                         'status_code': curl.getinfo(pycurl.RESPONSE_CODE),
                         'body': response_body.getvalue().decode('utf-8'),
@@ -502,11 +1660,16 @@ class KeepClient(object):
                     'error': e,
                 }
             self._usable = ok != False # still usable if ok is True or None
+            self._record_health(ok, t.secs)
+            self._record_metrics("PUT", len(body), t.secs)
             if self._result.get('status_code', None):
                 # Client is functional. See comment in get().
                 self._put_user_agent(curl)
             else:
                 curl.close()
+            yield self._put_result(url, body, ok, t)
+
+        def _put_result(self, url, body, ok, t):
             if not ok:
                 _logger.debug("Request fail: PUT %s => %s: %s",
                               url, type(self._result['error']), str(self._result['error']))
@@ -520,20 +1683,30 @@ class KeepClient(object):
                 self.upload_counter.add(len(body))
             return True
 
+        @staticmethod
+        def _throttled(func, throttle, nbytes):
+            # Wrap a pycurl read or write function so each chunk waits
+            # for the throttle's bandwidth limit.  nbytes(arg, result)
+            # is the size of the chunk.
+            if throttle is None:
+                return func
+            def throttled(arg):
+                result = func(arg)
+                throttle.consume(nbytes(arg, result))
+                return result
+            return throttled
+
         def _setcurltimeouts(self, curl, timeouts, ignore_bandwidth=False):
             if not timeouts:
                 return
-            elif isinstance(timeouts, tuple):
-                if len(timeouts) == 2:
-                    conn_t, xfer_t = timeouts
-                    bandwidth_bps = KeepClient.DEFAULT_TIMEOUT[2]
-                else:
-                    conn_t, xfer_t, bandwidth_bps = timeouts
-            else:
-                conn_t, xfer_t = (timeouts, timeouts)
-                bandwidth_bps = KeepClient.DEFAULT_TIMEOUT[2]
+            conn_t, xfer_t, bandwidth_bps = _split_timeout(timeouts)
             curl.setopt(pycurl.CONNECTTIMEOUT_MS, int(conn_t*1000))
             if not ignore_bandwidth:
+                if self.throttle is not None:
+                    # A bandwidth limit can hold a transfer below the
+                    # minimum bandwidth in its timeout, so only abort
+                    # it when it's slower than the throttle explains.
+                    bandwidth_bps, xfer_t = self.throttle.stall_limits(bandwidth_bps, xfer_t)
                 curl.setopt(pycurl.LOW_SPEED_TIME, int(math.ceil(xfer_t)))
                 curl.setopt(pycurl.LOW_SPEED_LIMIT, int(math.ceil(bandwidth_bps)))
 
@@ -558,127 +1731,179 @@ class KeepClient(object):
             # Returning None implies all bytes were written
 
 
-    class KeepWriterQueue(queue.Queue):
-        def __init__(self, copies):
-            queue.Queue.__init__(self) # Old-style superclass
-            self.wanted_copies = copies
-            self.successful_copies = 0
-            self.response = None
-            self.successful_copies_lock = threading.Lock()
-            self.pending_tries = copies
-            self.pending_tries_notification = threading.Condition()
-
-        def write_success(self, response, replicas_nr):
-            with self.successful_copies_lock:
-                self.successful_copies += replicas_nr
-                self.response = response
-            with self.pending_tries_notification:
-                self.pending_tries_notification.notify_all()
-
-        def write_fail(self, ks):
-            with self.pending_tries_notification:
-                self.pending_tries += 1
-                self.pending_tries_notification.notify()
-
-        def pending_copies(self):
-            with self.successful_copies_lock:
-                return self.wanted_copies - self.successful_copies
-
-        def get_next_task(self):
-            with self.pending_tries_notification:
-                while True:
-                    if self.pending_copies() < 1:
-                        # This notify_all() is unnecessary --
-                        # write_success() already called notify_all()
-                        # when pending<1 became true, so it's not
-                        # possible for any other thread to be in
-                        # wait() now -- but it's cheap insurance
-                        # against deadlock so we do it anyway:
-                        self.pending_tries_notification.notify_all()
-                        # Drain the queue and then raise Queue.Empty
-                        while True:
-                            self.get_nowait()
-                            self.task_done()
-                    elif self.pending_tries > 0:
-                        service, service_root = self.get_nowait()
-                        if service.finished():
-                            self.task_done()
-                            continue
-                        self.pending_tries -= 1
-                        return service, service_root
-                    elif self.empty():
-                        self.pending_tries_notification.notify_all()
-                        raise queue.Empty
-                    else:
-                        self.pending_tries_notification.wait()
+    class KeepWriterPool(object):
+        """Worker threads that upload blocks for a KeepClient.
+
+        The pool lasts as long as the KeepClient, so put() doesn't
+        start and stop threads for every block.  Each put() submits a
+        KeepWriterThreadPool (one block's uploads), which asks for a
+        worker whenever it has a request to start.  Threads are started
+        as needed up to max_threads, and exit after idle_timeout
+        seconds without work.
+        """
+
+        def __init__(self, max_threads, idle_timeout=60):
+            self.max_threads = max_threads
+            self.idle_timeout = idle_timeout
+            self._queue = queue.Queue()
+            self._lock = threading.Lock()
+            self._threads = 0
+            self._idle = 0
+
+        def submit(self, writer):
+            """Run writer.run_next_task() in a worker thread."""
+            with self._lock:
+                self._queue.put(writer)
+                if self._queue.qsize() > self._idle and self._threads < self.max_threads:
+                    self._threads += 1
+                    t = threading.Thread(target=self._work)
+                    t.daemon = True
+                    t.start()
+
+        def _work(self):
+            while True:
+                with self._lock:
+                    self._idle += 1
+                try:
+                    writer = self._queue.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._idle -= 1
+                        if self._queue.empty():
+                            self._threads -= 1
+                            return
+                    continue
+                with self._lock:
+                    self._idle -= 1
+                writer.run_next_task()
 
 
     class KeepWriterThreadPool(object):
-        def __init__(self, data, data_hash, copies, max_service_replicas, timeout=None):
+        """Upload one block to enough Keep services to store `copies` copies.
+
+        Services are tried in the order they're added with add_task().
+        Up to ceil(copies / max_service_replicas) uploads run at once,
+        and never more than the number of copies still needed (counting
+        uploads in progress as successes), so a fast success doesn't
+        leave extra copies behind.  A failed upload lets the next
+        service be tried.
+
+        Uploads run on `workers`, a KeepWriterPool shared with other
+        blocks; if it's None, threads are started just for this block.
+        """
+
+        TaskFailed = RuntimeError()
+
+        def __init__(self, data, data_hash, copies, max_service_replicas, timeout=None,
+                     workers=None):
+            self.data = data
+            self.data_hash = data_hash
+            self.timeout = timeout
             self.total_task_nr = 0
             self.wanted_copies = copies
+            self.successful_copies = 0
             if (not max_service_replicas) or (max_service_replicas >= copies):
-                num_threads = 1
+                self.max_concurrency = 1
             else:
-                num_threads = int(math.ceil(1.0*copies/max_service_replicas))
-            _logger.debug("Pool max threads is %d", num_threads)
-            self.workers = []
-            self.queue = KeepClient.KeepWriterQueue(copies)
-            # Create workers
-            for _ in range(num_threads):
-                w = KeepClient.KeepWriterThread(self.queue, data, data_hash, timeout)
-                self.workers.append(w)
+                self.max_concurrency = int(math.ceil(1.0*copies/max_service_replicas))
+            _logger.debug("Pool max threads is %d", self.max_concurrency)
+            self.workers = workers
+            self._tasks = collections.deque()
+            self._pending_tries = copies
+            self._in_flight = 0
+            self._response = None
+            self._lock = threading.Lock()
+            self._finished = threading.Event()
 
         def add_task(self, ks, service_root):
-            self.queue.put((ks, service_root))
+            self._tasks.append((ks, service_root))
             self.total_task_nr += 1
 
         def done(self):
-            return self.queue.successful_copies
-
-        def join(self):
-            # Start workers
-            for worker in self.workers:
-                worker.start()
-            # Wait for finished work
-            self.queue.join()
+            return self.successful_copies
 
         def response(self):
-            return self.queue.response
-
+            return self._response
 
-    class KeepWriterThread(threading.Thread):
-        TaskFailed = RuntimeError()
-
-        def __init__(self, queue, data, data_hash, timeout=None):
-            super(KeepClient.KeepWriterThread, self).__init__()
-            self.timeout = timeout
-            self.queue = queue
-            self.data = data
-            self.data_hash = data_hash
-            self.daemon = True
+        def join(self):
+            """Run the uploads, and wait until enough have succeeded or
+            there are no more services to try."""
+            if self.workers is None:
+                self.workers = KeepClient.KeepWriterPool(self.max_concurrency, idle_timeout=1)
+            with self._lock:
+                self._finish_if_idle()
+                starts = min(self.max_concurrency, self._pending_tries)
+            for _ in range(starts):
+                self.workers.submit(self)
+            self._finished.wait()
+            # No upload is running now, and no more will start, so let
+            # go of the block: the caller may reuse its buffer once
+            # put() returns, while workers still hold this pool.
+            self.data = None
+
+        def _next_task(self):
+            # Called with self._lock held.  Returns the next service
+            # to try, or None if we shouldn't start another upload now.
+            if self.wanted_copies - self.successful_copies < 1 or self._pending_tries < 1:
+                return None
+            while self._tasks:
+                service, service_root = self._tasks.popleft()
+                if not service.finished():
+                    self._pending_tries -= 1
+                    self._in_flight += 1
+                    return service, service_root
+            return None
 
-        def run(self):
-            while True:
-                try:
-                    service, service_root = self.queue.get_next_task()
-                except queue.Empty:
+        def _finish_if_idle(self):
+            # Called with self._lock held.
+            if self._in_flight == 0 and (
+                    self.wanted_copies - self.successful_copies < 1 or
+                    not self._tasks or self._pending_tries < 1):
+                self._finished.set()
+
+        def run_next_task(self):
+            """Start the next upload, if any, in the calling thread."""
+            with self._lock:
+                task = self._next_task()
+                if task is None:
+                    self._finish_if_idle()
                     return
-                try:
-                    locator, copies = self.do_task(service, service_root)
-                except Exception as e:
-                    if e is not self.TaskFailed:
-                        _logger.exception("Exception in KeepWriterThread")
-                    self.queue.write_fail(service)
+            service, service_root = task
+            try:
+                result = self.do_task(service, service_root)
+            except Exception as e:
+                if e is not self.TaskFailed:
+                    _logger.exception("Exception in KeepWriterThreadPool")
+                result = None
+            if self._task_finished(result):
+                return
+            # Start the next upload, if there's one to start.
+            self.workers.submit(self)
+
+        def _task_finished(self, result):
+            # Record the (locator, copies) result of an upload, or
+            # None if it failed.  Returns True if no more uploads are
+            # needed.
+            with self._lock:
+                self._in_flight -= 1
+                if result is None:
+                    self._pending_tries += 1
                 else:
-                    self.queue.write_success(locator, copies)
-                finally:
-                    self.queue.task_done()
+                    locator, copies = result
+                    self.successful_copies += copies
+                    self._response = locator
+                self._finish_if_idle()
+                return self._finished.is_set()
 
         def do_task(self, service, service_root):
             success = bool(service.put(self.data_hash,
                                         self.data,
                                         timeout=self.timeout))
+            return self.task_result(service, service_root, success)
+
+        def task_result(self, service, service_root, success):
+            """Return (locator, copies stored) for a finished upload,
+            or raise TaskFailed."""
             result = service.last_result()
 
             if not success:
@@ -689,7 +1914,7 @@ class KeepClient(object):
                                   result['body'])
                 raise self.TaskFailed
 
-            _logger.debug("KeepWriterThread %s succeeded %s+%i %s",
+            _logger.debug("KeepWriterThreadPool %s succeeded %s+%i %s",
                           str(threading.current_thread()),
                           self.data_hash,
                           len(self.data),
@@ -705,7 +1930,9 @@ class KeepClient(object):
     def __init__(self, api_client=None, proxy=None,
                  timeout=DEFAULT_TIMEOUT, proxy_timeout=DEFAULT_PROXY_TIMEOUT,
                  api_token=None, local_store=None, block_cache=None,
-                 num_retries=0, session=None):
+                 num_retries=0, session=None, hedge_after=None,
+                 not_found_ttl=0, metrics=None,
+                 max_bytes_per_second=None, max_in_flight=None):
         """Initialize a new KeepClient.
 
         Arguments:
@@ -753,12 +1980,58 @@ class KeepClient(object):
           KeepClient will fall back to the setting of the $KEEP_LOCAL_STORE
           environment variable.  If you want to ensure KeepClient does not
           use local storage, pass in an empty string.  This is primarily
-          intended to mock a server for testing.
+          intended to mock a server for testing, and to benchmark
+          without a cluster: a KeepLocalStore can be given instead of a
+          directory to simulate latency, bandwidth and the number of
+          Keep services.  When given a directory, the
+          $KEEP_LOCAL_STORE_LATENCY, $KEEP_LOCAL_STORE_BANDWIDTH and
+          $KEEP_LOCAL_STORE_REPLICAS environment variables set these
+          (see KeepLocalStore.from_environment()).
+
+        :block_cache:
+          The KeepBlockCache to use for blocks read with get().  If not
+          provided, KeepClient will use a new 256 MiB RAM cache.  Pass
+          KeepBlockCache(disk_cache=True) to also keep blocks on local
+          disk across processes and restarts.
 
         :num_retries:
           The default number of times to retry failed requests.
           This will be used as the default num_retries value when get() and
           put() are called.  Default 0.
+
+        :hedge_after:
+          If a Keep service hasn't started sending a block after this
+          many seconds, also request it from the next service that
+          should have a copy, and use whichever response arrives first.
+          Pass KeepClient.HEDGE_ADAPTIVE to choose the delay for each
+          service from its recent response times.  Default None (don't
+          hedge: only try the next service after a failure).
+
+        :not_found_ttl:
+          After every Keep service reports that a block doesn't exist
+          (404 or 410), fail further GETs of that block without asking
+          the services again for this many seconds (e.g.,
+          KeepNotFoundCache.DEFAULT_TTL).  Blocks written meanwhile by
+          other clients will look missing until then; this client's
+          own put() clears the entry.  HEAD requests, including
+          refresh_signature(), always ask.  Default 0 (always ask).
+
+        :metrics:
+          The KeepMetrics object to notify about requests to Keep
+          services.  If not provided, KeepClient will use a new
+          KeepMetrics.  See metrics_snapshot().
+
+        :max_bytes_per_second:
+          Limit the total bandwidth of all transfers made by this
+          client, in both directions, to this many bytes per second.
+          Default None (no limit).
+
+        :max_in_flight:
+          Limit the number of requests to Keep services that this
+          client runs at once.  Default None (no limit).
+
+          Both limits can be changed later through the client's
+          `throttle` (a KeepThrottle).
         """
         self.lock = threading.Lock()
         if proxy is None:
@@ -783,23 +2056,46 @@ class KeepClient(object):
             self.insecure = api_client.insecure
 
         self.block_cache = block_cache if block_cache else KeepBlockCache()
+        self.range_cache = KeepRangeCache()
+        self.not_found_cache = KeepNotFoundCache(ttl=not_found_ttl)
         self.timeout = timeout
         self.proxy_timeout = proxy_timeout
-        self._user_agent_pool = queue.LifoQueue()
+        self._user_agent_pools = {}
+        self.max_put_threads = self.DEFAULT_MAX_PUT_THREADS
+        self._writer_pool = None
+        self.max_idle_connections = self.MAX_IDLE_CONNECTIONS
+        self.connection_idle_timeout = self.CONNECTION_IDLE_TIMEOUT
         self.upload_counter = Counter()
         self.download_counter = Counter()
         self.put_counter = Counter()
         self.get_counter = Counter()
         self.hits_counter = Counter()
         self.misses_counter = Counter()
+        self.not_found_hits_counter = Counter()
+        self.metrics = metrics if metrics is not None else KeepMetrics()
+        self.throttle = KeepThrottle(max_bytes_per_second, max_in_flight)
+        self.new_connections_counter = Counter()
+        self.reused_connections_counter = Counter()
+        self.hedge_after = hedge_after
+        self.hedges_fired_counter = Counter()
+        self.hedges_won_counter = Counter()
+        self._service_health = {}
+        self._services_generation = 0
+        self._service_roots_cache = collections.OrderedDict()
+        self._service_roots_lock = threading.Lock()
+        self.num_retries = num_retries
 
         if local_store:
-            self.local_store = local_store
+            if isinstance(local_store, arvados.localstore.KeepLocalStore):
+                self._local_store = local_store
+            else:
+                self._local_store = arvados.localstore.KeepLocalStore.from_environment(local_store)
+            self.local_store = self._local_store.path
             self.head = self.local_store_head
             self.get = self.local_store_get
+            self.get_range = self.local_store_get_range
             self.put = self.local_store_put
         else:
-            self.num_retries = num_retries
             self.max_replicas_per_service = None
             if proxy:
                 proxy_uris = proxy.split()
@@ -833,6 +2129,73 @@ class KeepClient(object):
                 self.using_proxy = None
                 self._static_services_list = False
 
+    def _user_agent_pool(self, root):
+        """Return the pool of idle pycurl handles for a Keep service."""
+        pool = self._user_agent_pools.get(root)
+        if pool is None:
+            pool = self._user_agent_pools.setdefault(root, _UserAgentPool(
+                max_idle=self.max_idle_connections,
+                idle_timeout=self.connection_idle_timeout))
+        return pool
+
+    def _health_record(self, root):
+        """Return the KeepServiceHealth record for a Keep service."""
+        health = self._service_health.get(root)
+        if health is None:
+            health = self._service_health.setdefault(root, KeepServiceHealth(root))
+        return health
+
+    def service_health(self):
+        """Return a dict mapping the root URL of each Keep service this
+        client has dealt with to a snapshot of its KeepServiceHealth
+        record (see KeepServiceHealth.snapshot())."""
+        return {root: health.snapshot()
+                for root, health in list(self._service_health.items())}
+
+    def metrics_snapshot(self):
+        """Return this client's statistics as a dict.
+
+        This is KeepMetrics.snapshot() plus:
+        * 'counters': the totals of this client's Counters.
+        * 'block_cache': KeepBlockCache.stats() for the block cache.
+        * 'throttle': KeepThrottle.snapshot() for the throttle.
+        """
+        snap = self.metrics.snapshot()
+        snap['counters'] = {
+            name[:-len('_counter')]: counter.get()
+            for name, counter in list(vars(self).items())
+            if name.endswith('_counter') and isinstance(counter, Counter)}
+        snap['block_cache'] = self.block_cache.stats()
+        snap['throttle'] = self.throttle.snapshot()
+        return snap
+
+    def _prefer_healthy(self, roots):
+        """Return roots in the same order, except that services whose
+        circuit breaker is open come last."""
+        return sorted(roots, key=lambda root: (
+            root in self._service_health and
+            self._service_health[root].state() == KeepServiceHealth.OPEN))
+
+    def _put_workers(self):
+        """Return the KeepWriterPool that runs this client's uploads."""
+        with self.lock:
+            if self._writer_pool is None:
+                self._writer_pool = self.KeepWriterPool(self.max_put_threads)
+            return self._writer_pool
+
+    def _new_keep_service(self, root, headers):
+        return self.KeepService(
+            root, self._user_agent_pool(root),
+            upload_counter=self.upload_counter,
+            download_counter=self.download_counter,
+            headers=headers,
+            insecure=self.insecure,
+            new_connections_counter=self.new_connections_counter,
+            reused_connections_counter=self.reused_connections_counter,
+            health=self._health_record(root),
+            metrics=self.metrics,
+            throttle=self.throttle)
+
     def current_timeout(self, attempt_number):
         """Return the appropriate timeout to use for this client.
 
@@ -883,7 +2246,7 @@ class KeepClient(object):
                     host,
                     r['service_port'])
 
-            _logger.debug(str(self._gateway_services))
+            _logger.debug("%s", self._gateway_services)
             self._keep_services = [
                 ks for ks in self._gateway_services.values()
                 if not ks.get('service_type', '').startswith('gateway:')]
@@ -897,6 +2260,9 @@ class KeepClient(object):
             else:
                 self.max_replicas_per_service = 1
 
+            # Orderings computed from the old list are now stale.
+            self._services_generation += 1
+
     def _service_weight(self, data_hash, service_uuid):
         """Compute the weight of a Keep service endpoint for a data
         block with a known hash.
@@ -929,17 +2295,32 @@ class KeepClient(object):
 
         # Sort the available local services by weight (heaviest first)
         # for this locator, and return their service_roots (base URIs)
-        # in that order.
-        use_services = self._keep_services
-        if need_writable:
-            use_services = self._writable_services
-        self.using_proxy = self._any_nondisk_services(use_services)
-        sorted_roots.extend([
-            svc['_service_root'] for svc in sorted(
-                use_services,
-                reverse=True,
-                key=lambda svc: self._service_weight(locator.md5sum, svc['uuid']))])
-        _logger.debug("{}: {}".format(locator, sorted_roots))
+        # in that order.  The order only depends on the block hash
+        # and the services list, so recently used orderings are
+        # cached until the list is rebuilt.
+        cache_key = (locator.md5sum, need_writable, self._services_generation)
+        with self._service_roots_lock:
+            cached = self._service_roots_cache.pop(cache_key, None)
+            if cached is not None:
+                self._service_roots_cache[cache_key] = cached
+        if cached is None:
+            use_services = self._keep_services
+            if need_writable:
+                use_services = self._writable_services
+            cached = (
+                tuple(svc['_service_root'] for svc in sorted(
+                    use_services,
+                    reverse=True,
+                    key=lambda svc: self._service_weight(locator.md5sum, svc['uuid']))),
+                self._any_nondisk_services(use_services))
+            with self._service_roots_lock:
+                self._service_roots_cache[cache_key] = cached
+                while len(self._service_roots_cache) > self.SERVICE_ROOTS_CACHE_SIZE:
+                    self._service_roots_cache.popitem(last=False)
+        local_roots, self.using_proxy = cached
+        sorted_roots.extend(local_roots)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("%s: %s", locator, sorted_roots)
         return sorted_roots
 
     def map_new_services(self, roots_map, locator, force_rebuild, need_writable, headers):
@@ -951,12 +2332,7 @@ class KeepClient(object):
         local_roots = self.weighted_service_roots(locator, force_rebuild, need_writable)
         for root in local_roots:
             if root not in roots_map:
-                roots_map[root] = self.KeepService(
-                    root, self._user_agent_pool,
-                    upload_counter=self.upload_counter,
-                    download_counter=self.download_counter,
-                    headers=headers,
-                    insecure=self.insecure)
+                roots_map[root] = self._new_keep_service(root, headers)
         return local_roots
 
     @staticmethod
@@ -977,28 +2353,225 @@ class KeepClient(object):
         else:
             return None
 
-    def get_from_cache(self, loc):
-        """Fetch a block only if is in the cache, otherwise return None."""
-        slot = self.block_cache.get(loc)
+    def get_from_cache(self, loc, view=False):
+        """Fetch a block only if is in the cache, otherwise return None.
+
+        The block is returned as bytes, or with view=True, as a read-only
+        memoryview, like get().
+        """
+        slot = self.block_cache.get(KeepLocator.md5_of(loc))
         if slot is not None and slot.ready.is_set():
-            return slot.get()
-        else:
-            return None
+            blob = slot.get()
+            if blob is not None:
+                return _block_result(blob, view)
+        return None
 
     def refresh_signature(self, loc):
         """Ask Keep to get the remote block and return its local signature"""
+        return self.head(loc, headers=self._refresh_signature_headers())
+
+    def _refresh_signature_headers(self):
         now = datetime.datetime.utcnow().isoformat("T") + 'Z'
-        return self.head(loc, headers={'X-Keep-Signature': 'local, {}'.format(now)})
+        return {'X-Keep-Signature': 'local, {}'.format(now)}
 
     @retry.retry_method
     def head(self, loc_s, **kwargs):
         return self._get_or_head(loc_s, method="HEAD", **kwargs)
 
     @retry.retry_method
-    def get(self, loc_s, **kwargs):
-        return self._get_or_head(loc_s, method="GET", **kwargs)
+    def head_many(self, locators, max_concurrency=None, num_retries=None, request_id=None,
+                  refresh_signatures=False):
+        """Check whether several blocks exist, sending HEAD requests concurrently.
+
+        Returns a list with a HeadResult(status, value) for each
+        locator in `locators`, in the same order:
+        * status HEAD_PRESENT: the block exists.  value is what head()
+          returned: the signed locator from the X-Keep-Locator response
+          header if there was one, otherwise True.
+        * status HEAD_MISSING: every service reported the block as not
+          found.  value is the NotFoundError.
+        * status HEAD_ERROR: the block couldn't be checked, e.g.,
+          because services were unreachable.  value is the exception.
+
+        Arguments:
+        * locators: A list of locator strings.
+        * max_concurrency: The maximum number of requests to run at
+          once.  Default DEFAULT_HEAD_MANY_CONCURRENCY.
+        * num_retries: Passed to head() for each block.
+        * refresh_signatures: If True, ask Keep to copy remote blocks
+          and return a local signature for each, like
+          refresh_signature().
+        """
+        if max_concurrency is None:
+            max_concurrency = self.DEFAULT_HEAD_MANY_CONCURRENCY
+
+        def head(loc_s):
+            headers = self._refresh_signature_headers() if refresh_signatures else None
+            return self.head(loc_s, num_retries=num_retries, request_id=request_id,
+                             headers=headers)
+
+        results = [None] * len(locators)
+        for index, value, error in self._as_completed(head, locators, max_concurrency):
+            if error is None and value is None:
+                # local_store_head() returns None for a missing block.
+                error = arvados.errors.NotFoundError("{} not found".format(locators[index]))
+            if error is None:
+                results[index] = self.HeadResult(self.HEAD_PRESENT, value)
+            elif isinstance(error, arvados.errors.NotFoundError):
+                results[index] = self.HeadResult(self.HEAD_MISSING, error)
+            else:
+                results[index] = self.HeadResult(self.HEAD_ERROR, error)
+        return results
+
+    @retry.retry_method
+    def get(self, loc_s, view=False, **kwargs):
+        """Get data from Keep.  See _get_or_head() for the arguments.
+
+        Returns the data as bytes.  With view=True, returns a read-only
+        memoryview of the block in the block cache instead, saving a copy
+        of the whole block.
+        """
+        return _block_result(self._get_or_head(loc_s, method="GET", **kwargs), view)
+
+    @retry.retry_method
+    def get_range(self, loc_s, offset, length, num_retries=None, request_id=None,
+                  cache_only=False):
+        """Read part of a block.
+
+        Return (as a bytes-like object) `length` bytes of the block
+        starting at `offset`, or fewer if the block ends first.  If the
+        whole block is cached, the bytes are taken from it.  Otherwise
+        they are fetched with an HTTP Range request, rounded out to
+        RANGE_READ_ALIGN boundaries so that nearby reads can be served
+        from the range cache.
+
+        Unlike get(), the data can't be checked against the block
+        hash, so it's kept in `range_cache`, not the block cache.
+
+        Arguments:
+        * loc_s: The locator of a single block.
+        * offset, length: The part of the block to read.
+        * num_retries: Passed to get().
+        * cache_only: If True, return None instead of fetching data
+          that isn't cached.
+        """
+        locator = KeepLocator(loc_s)
+        if locator.size is not None:
+            length = max(0, min(length, locator.size - offset))
+        if length == 0:
+            return b''
+
+        block = self.get_from_cache(locator.md5sum, view=True)
+        if block is not None:
+            return block[offset:offset+length]
+        data = self.range_cache.get(locator.md5sum, offset, length)
+        if data is not None or cache_only:
+            return data
+
+        start = offset - offset % self.RANGE_READ_ALIGN
+        end = offset + length + self.RANGE_READ_ALIGN - 1
+        end -= end % self.RANGE_READ_ALIGN
+        if locator.size is not None:
+            end = min(end, locator.size)
+        data = self._get_or_head(loc_s, method="GET", num_retries=num_retries,
+                                 request_id=request_id, byte_range=(start, end - start))
+        if isinstance(data, _WholeBlock):
+            # The service sent the whole block: keep it in the block
+            # cache, like get() would, and read from that.
+            slot, first = self.block_cache.reserve_cache(locator.md5sum)
+            if first:
+                self.block_cache.set(slot, data.data)
+            return _block_result(data.data, view=True)[offset:offset+length]
+        self.range_cache.set(locator.md5sum, start, data)
+        return memoryview(data)[offset-start:offset-start+length]
+
+    @retry.retry_method
+    def get_as_completed(self, locators, max_concurrency=None, num_retries=None, request_id=None):
+        """Fetch several blocks concurrently, yielding each as it arrives.
+
+        Each block is fetched with get(), so blocks are read from and
+        saved in the block cache as usual.  This is a generator that
+        yields a 3-tuple (index, data, error) for each locator, in
+        completion order: index is the position of the locator in
+        `locators`, and either data is the block content and error is
+        None, or data is None and error is the exception get() raised.
+        If the generator is closed early, blocks that haven't been
+        requested yet are skipped.
+
+        Arguments:
+        * locators: A list of locator strings.
+        * max_concurrency: The maximum number of blocks to fetch at
+          once.  Default DEFAULT_GET_MANY_CONCURRENCY.
+        * num_retries: Passed to get() for each block.
+        """
+        if max_concurrency is None:
+            max_concurrency = self.DEFAULT_GET_MANY_CONCURRENCY
+        return self._as_completed(
+            lambda loc_s: self.get(loc_s, num_retries=num_retries, request_id=request_id),
+            locators, max_concurrency)
+
+    def _as_completed(self, func, locators, max_concurrency):
+        """Call func on each locator in threads, yielding results as they finish.
+
+        Yields (index, result, error) 3-tuples like get_as_completed().
+        """
+        todo = queue.Queue()
+        for task in enumerate(locators):
+            todo.put(task)
+        results = queue.Queue()
+        cancelled = threading.Event()
+
+        def worker():
+            while not cancelled.is_set():
+                try:
+                    index, loc_s = todo.get(block=False)
+                except queue.Empty:
+                    return
+                try:
+                    result = func(loc_s)
+                except Exception as e:
+                    results.put((index, None, e))
+                else:
+                    results.put((index, result, None))
+
+        for _ in range(min(max_concurrency, len(locators))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+        try:
+            for _ in range(len(locators)):
+                yield results.get()
+        finally:
+            cancelled.set()
 
-    def _get_or_head(self, loc_s, method="GET", num_retries=None, request_id=None, headers=None):
+    @retry.retry_method
+    def get_many(self, locators, max_concurrency=None, num_retries=None, request_id=None):
+        """Fetch several blocks concurrently and return them in order.
+
+        Returns a list with the content of each block in `locators`.
+        If any blocks can't be read, raises KeepReadError after all
+        fetches have finished; its request_errors() maps the index of
+        each failed block to the exception raised when reading it.
+        Arguments are the same as get_as_completed().
+        """
+        blobs = [None] * len(locators)
+        errors = []
+        for index, data, error in self.get_as_completed(
+                locators, max_concurrency=max_concurrency,
+                num_retries=num_retries, request_id=request_id):
+            if error is None:
+                blobs[index] = data
+            else:
+                errors.append((index, error))
+        if errors:
+            errors.sort(key=lambda err: err[0])
+            raise arvados.errors.KeepReadError(
+                "failed to read {} of {} blocks".format(len(errors), len(locators)),
+                errors, label="block")
+        return blobs
+
+    def _get_or_head(self, loc_s, method="GET", num_retries=None, request_id=None, headers=None,
+                     byte_range=None, recheck_missing=False):
         """Get data from Keep.
 
         This method fetches one or more blocks of data from Keep.  It
@@ -1008,6 +2581,10 @@ class KeepClient(object):
         sequence.  As soon as one service provides the data, it's
         returned.
 
+        A GET returns the block as it is in the block cache (usually a
+        bytearray, shared with other readers); get() hands it out as
+        bytes or a read-only memoryview.
+
         Arguments:
         * loc_s: A string of one or more comma-separated locators to fetch.
           This method returns the concatenation of these blocks.
@@ -1017,33 +2594,43 @@ class KeepClient(object):
           to fetch data from every available Keep service, along with any
           that are named in location hints in the locator.  The default value
           is set when the KeepClient is initialized.
+        * recheck_missing: If True, ask Keep services for the block
+          even if they recently reported it missing (see not_found_ttl
+          in the constructor).
         """
         if ',' in loc_s:
-            return ''.join(self.get(x) for x in loc_s.split(','))
+            return b''.join(self.get_many(loc_s.split(','), num_retries=num_retries,
+                                          request_id=request_id))
 
         self.get_counter.add(1)
 
         slot = None
         blob = None
+        from_disk = False
         try:
             locator = KeepLocator(loc_s)
-            if method == "GET":
-                slot, first = self.block_cache.reserve_cache(locator.md5sum)
+            if method == "GET" and not recheck_missing:
+                self._raise_if_known_missing(locator)
+            if method == "GET" and byte_range is None:
+                cached, first = self.block_cache.reserve_cache(locator.md5sum)
                 if not first:
                     self.hits_counter.add(1)
-                    blob = slot.get()
+                    blob = cached.get()
                     if blob is None:
                         raise arvados.errors.KeepReadError(
                             "failed to read {}".format(loc_s))
                     return blob
+                # This call reserved the slot, so it must fill it.
+                slot = cached
+                blob = self.block_cache.get_from_disk(locator.md5sum)
+                if blob is not None:
+                    from_disk = True
+                    self.hits_counter.add(1)
+                    return blob
 
             self.misses_counter.add(1)
 
-            if headers is None:
-                headers = {}
-            headers['X-Request-Id'] = (request_id or
-                                        (hasattr(self, 'api_client') and self.api_client.request_id) or
-                                        arvados.util.new_request_id())
+            headers = self._request_headers(request_id, headers)
 
             # If the locator has hints specifying a prefix (indicating a
             # remote keepproxy) or the UUID of a local gateway service,
@@ -1059,11 +2646,7 @@ class KeepClient(object):
                                        )])
             # Map root URLs to their KeepService objects.
             roots_map = {
-                root: self.KeepService(root, self._user_agent_pool,
-                                       upload_counter=self.upload_counter,
-                                       download_counter=self.download_counter,
-                                       headers=headers,
-                                       insecure=self.insecure)
+                root: self._new_keep_service(root, headers)
                 for root in hint_roots
             }
 
@@ -1088,24 +2671,49 @@ class KeepClient(object):
                     continue
 
                 # Query KeepService objects that haven't returned
-                # permanent failure, in our specified shuffle order.
+                # permanent failure, in our specified shuffle order,
+                # leaving services that keep failing until last.
                 services_to_try = [roots_map[root]
-                                   for root in sorted_roots
+                                   for root in self._prefer_healthy(sorted_roots)
                                    if roots_map[root].usable()]
-                for keep_service in services_to_try:
-                    blob = keep_service.get(locator, method=method, timeout=self.current_timeout(num_retries-tries_left))
-                    if blob is not None:
-                        break
+                timeout = self.current_timeout(num_retries-tries_left)
+                if self.hedge_after is None:
+                    for keep_service in services_to_try:
+                        blob = keep_service.get(locator, method=method, timeout=timeout,
+                                                byte_range=byte_range)
+                        if blob is not None:
+                            break
+                else:
+                    blob = self._hedged_get(services_to_try, locator, method, timeout,
+                                            byte_range)
                 loop.save_result((blob, len(services_to_try)))
+            if loop.attempts() > 1:
+                self.metrics.retried(method, loop.attempts() - 1)
 
             # Always cache the result, then return it if we succeeded.
             if loop.success():
                 return blob
         finally:
             if slot is not None:
-                slot.set(blob)
-                self.block_cache.cap_cache()
-
+                self.block_cache.set(slot, blob, persist=not from_disk)
+        self._raise_read_error(loc_s, locator, loop, sorted_roots, roots_map, method)
+
+    def _raise_if_known_missing(self, locator):
+        missing = self.not_found_cache.get(locator.md5sum)
+        if missing is not None:
+            self.not_found_hits_counter.add(1)
+            message, service_errors = missing
+            raise arvados.errors.NotFoundError(message, service_errors)
+
+    def _request_headers(self, request_id, headers=None):
+        if headers is None:
+            headers = {}
+        headers['X-Request-Id'] = (request_id or
+                                   (hasattr(self, 'api_client') and self.api_client.request_id) or
+                                   arvados.util.new_request_id())
+        return headers
+
+    def _raise_read_error(self, loc_s, locator, loop, sorted_roots, roots_map, method="GET"):
         # Q: Including 403 is necessary for the Keep tests to continue
         # passing, but maybe they should expect KeepReadError instead?
         not_founds = sum(1 for key in sorted_roots
@@ -1117,12 +2725,80 @@ class KeepClient(object):
                 "failed to read {}: no Keep services available ({})".format(
                     loc_s, loop.last_result()))
         elif not_founds == len(sorted_roots):
+            service_errors = list(service_errors)
+            if method == "GET" and all(
+                    roots_map[key].last_result().get('status_code') in {404, 410}
+                    for key in sorted_roots):
+                self.not_found_cache.set(locator.md5sum, "{} not found".format(loc_s),
+                                         service_errors)
             raise arvados.errors.NotFoundError(
                 "{} not found".format(loc_s), service_errors)
         else:
             raise arvados.errors.KeepReadError(
                 "failed to read {} after {}".format(loc_s, loop.attempts_str()), service_errors, label="service")
 
+    def _hedge_delay(self, keep_service):
+        if self.hedge_after != self.HEDGE_ADAPTIVE:
+            return self.hedge_after
+        ttfb = self._health_record(keep_service.root).ttfb
+        if ttfb is None:
+            return self.HEDGE_ADAPTIVE_INITIAL
+        return max(self.HEDGE_ADAPTIVE_MIN, ttfb * self.HEDGE_ADAPTIVE_FACTOR)
+
+    def _hedged_get(self, services_to_try, locator, method, timeout, byte_range=None):
+        """Request a block from services_to_try, in order, hedging slow ones.
+
+        Each service is tried in turn, as in the unhedged case, but if
+        a service hasn't started responding after _hedge_delay(), the
+        next service is asked too.  The first successful response is
+        returned, and the other request is cancelled.  Returns None if
+        every service failed.
+        """
+        pending = collections.deque(services_to_try)
+        results = queue.Queue()
+        running = {}
+        hedges = set()
+        cancel = threading.Event()
+
+        def fetch(keep_service, started):
+            blob = None
+            try:
+                blob = keep_service.get(locator, method=method, timeout=timeout,
+                                        started=started, cancel=cancel,
+                                        byte_range=byte_range)
+            finally:
+                started.set()
+                results.put((keep_service, blob))
+
+        def start(keep_service):
+            started = threading.Event()
+            running[keep_service] = started
+            t = threading.Thread(target=fetch, args=(keep_service, started))
+            t.daemon = True
+            t.start()
+            return started
+
+        blob = None
+        while blob is None and (running or pending):
+            if not running:
+                leader = pending.popleft()
+                started = start(leader)
+                delay = self._hedge_delay(leader)
+                if pending and not started.wait(delay):
+                    hedge = pending.popleft()
+                    _logger.debug("%s: no response from %s after %.3fs, also trying %s",
+                                  locator, leader.root, delay, hedge.root)
+                    hedges.add(hedge)
+                    start(hedge)
+                    self.hedges_fired_counter.add(1)
+            keep_service, blob = results.get()
+            del running[keep_service]
+        if blob is not None and keep_service in hedges:
+            self.hedges_won_counter.add(1)
+        # Abort the losing request, if it's still going.
+        cancel.set()
+        return blob
+
     @retry.retry_method
     def put(self, data, copies=2, num_retries=None, request_id=None):
         """Save data in Keep.
@@ -1134,7 +2810,11 @@ class KeepClient(object):
         enough copies, this method raises KeepWriteError.
 
         Arguments:
-        * data: The string of data to upload.
+        * data: The data to upload: bytes, or any object supporting the
+          buffer protocol (bytearray, memoryview, mmap).  Buffers are
+          hashed and sent to each Keep service without being copied,
+          so they must not be modified until put() returns.  put()
+          keeps no reference to them after that.
         * copies: The number of copies that the user requires be saved.
           Default 2.
         * num_retries: The number of times to retry PUT requests to
@@ -1143,8 +2823,7 @@ class KeepClient(object):
           KeepClient is initialized.
         """
 
-        if not isinstance(data, bytes):
-            data = data.encode()
+        data = _block_view(data)
 
         self.put_counter.add(1)
 
@@ -1154,13 +2833,12 @@ class KeepClient(object):
             return loc_s
         locator = KeepLocator(loc_s)
 
-        headers = {
-            'X-Request-Id': (request_id or
-                             (hasattr(self, 'api_client') and self.api_client.request_id) or
-                             arvados.util.new_request_id()),
+        headers = self._request_headers(request_id, {
             'X-Keep-Desired-Replicas': str(copies),
-        }
+        })
         roots_map = {}
+        sorted_roots = []
+        writer_pool = None
         loop = retry.RetryLoop(num_retries, self._check_loop_result,
                                backoff_start=2)
         done = 0
@@ -1179,18 +2857,25 @@ class KeepClient(object):
                                                         data_hash=data_hash,
                                                         copies=copies - done,
                                                         max_service_replicas=self.max_replicas_per_service,
-                                                        timeout=self.current_timeout(num_retries - tries_left))
+                                                        timeout=self.current_timeout(num_retries - tries_left),
+                                                        workers=self._put_workers())
             for service_root, ks in [(root, roots_map[root])
-                                     for root in sorted_roots]:
+                                     for root in self._prefer_healthy(sorted_roots)]:
                 if ks.finished():
                     continue
                 writer_pool.add_task(ks, service_root)
             writer_pool.join()
             done += writer_pool.done()
             loop.save_result((done >= copies, writer_pool.total_task_nr))
+        if loop.attempts() > 1:
+            self.metrics.retried("PUT", loop.attempts() - 1)
 
         if loop.success():
+            self.not_found_cache.discard(data_hash)
             return writer_pool.response()
+        self._raise_write_error(data_hash, loop, sorted_roots, roots_map, copies, writer_pool)
+
+    def _raise_write_error(self, data_hash, loop, sorted_roots, roots_map, copies, writer_pool):
         if not roots_map:
             raise arvados.errors.KeepWriteError(
                 "failed to write {}: no Keep services available ({})".format(
@@ -1209,43 +2894,50 @@ class KeepClient(object):
         This method is used in place of the real put() method when
         using local storage (see constructor's local_store argument).
 
-        copies and num_retries arguments are ignored: they are here
-        only for the sake of offering the same call signature as
-        put().
+        num_retries is ignored: it is here only for the sake of
+        offering the same call signature as put().
 
         Data stored this way can be retrieved via local_store_get().
         """
-        md5 = hashlib.md5(data).hexdigest()
-        locator = '%s+%d' % (md5, len(data))
-        with open(os.path.join(self.local_store, md5 + '.tmp'), 'wb') as f:
-            f.write(data)
-        os.rename(os.path.join(self.local_store, md5 + '.tmp'),
-                  os.path.join(self.local_store, md5))
-        return locator
-
-    def local_store_get(self, loc_s, num_retries=None):
-        """Companion to local_store_put()."""
+        return self._local_store.put(_block_view(data), copies=copies)
+
+    def _local_store_locator(self, loc_s):
         try:
-            locator = KeepLocator(loc_s)
+            return KeepLocator(loc_s)
         except ValueError:
             raise arvados.errors.NotFoundError(
                 "Invalid data locator: '%s'" % loc_s)
+
+    def local_store_get(self, loc_s, num_retries=None, request_id=None, headers=None,
+                        view=False):
+        """Companion to local_store_put().
+
+        num_retries, request_id and headers are ignored, like
+        local_store_put()'s num_retries.
+        """
+        locator = self._local_store_locator(loc_s)
         if locator.md5sum == config.EMPTY_BLOCK_LOCATOR.split('+')[0]:
-            return b''
-        with open(os.path.join(self.local_store, locator.md5sum), 'rb') as f:
-            return f.read()
+            return _block_result(b'', view)
+        return _block_result(self._local_store.get(locator.md5sum), view)
 
-    def local_store_head(self, loc_s, num_retries=None):
+    def local_store_get_range(self, loc_s, offset, length, num_retries=None,
+                              request_id=None, cache_only=False):
         """Companion to local_store_put()."""
-        try:
-            locator = KeepLocator(loc_s)
-        except ValueError:
-            raise arvados.errors.NotFoundError(
-                "Invalid data locator: '%s'" % loc_s)
+        locator = self._local_store_locator(loc_s)
+        if locator.md5sum == config.EMPTY_BLOCK_LOCATOR.split('+')[0]:
+            return b''
+        return self._local_store.get_range(locator.md5sum, offset, length)
+
+    def local_store_head(self, loc_s, num_retries=None, request_id=None, headers=None):
+        """Companion to local_store_put().  Return None if the block
+        isn't stored."""
+        locator = self._local_store_locator(loc_s)
         if locator.md5sum == config.EMPTY_BLOCK_LOCATOR.split('+')[0]:
             return True
-        if os.path.exists(os.path.join(self.local_store, locator.md5sum)):
-            return True
+        try:
+            return self._local_store.head(locator.md5sum)
+        except arvados.errors.NotFoundError:
+            return None
 
     def is_cached(self, locator):
         return self.block_cache.reserve_cache(expect_hash)
@@ -0,0 +1,186 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from builtins import object
+import errno
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+import arvados.errors
+
+class SimulatedLink(object):
+    """A network link shared by all requests to a KeepLocalStore.
+
+    Each transfer gets the link to itself for nbytes / bandwidth
+    seconds, in the order the requests arrive, after latency seconds
+    that overlap with other requests.  transfer() sleeps until the
+    transfer would have finished.
+    """
+
+    def __init__(self, latency=0, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._lock = threading.Lock()
+        self._free_at = 0
+
+    def transfer(self, nbytes):
+        start = time.time() + self.latency
+        end = start
+        if self.bandwidth:
+            with self._lock:
+                end = max(start, self._free_at) + nbytes / float(self.bandwidth)
+                self._free_at = end
+        delay = end - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class KeepLocalStore(object):
+    """Keep blocks in a local directory instead of Keep services.
+
+    This is what KeepClient uses when it has a local_store: a stand-in
+    for a Keep cluster for tests and for benchmarks that need to run
+    without one.  Blocks are stored like keepstore stores them, one
+    file per block in a subdirectory named by the first three digits
+    of its hash, so the store copes with millions of blocks.  Blocks
+    are written to a temporary file and renamed into place.  Blocks
+    written by older versions, directly in the store directory, can
+    still be read.
+
+    Blocks of at least MMAP_MIN_SIZE bytes are read with mmap and
+    returned as memoryviews, without copying them.  Smaller blocks are
+    read into bytes, which is cheaper, and doesn't hold a file
+    descriptor open for each block.
+
+    To make benchmarks more realistic, requests can be slowed down by
+    a SimulatedLink, and the store can pretend to be a cluster of
+    `replicas` Keep services: put() stores at most that many copies of
+    a block, and fails like KeepClient.put() if that's fewer than it
+    was asked for.
+    """
+
+    MMAP_MIN_SIZE = 64 * 1024
+
+    def __init__(self, path, latency=0, bandwidth=None, replicas=None):
+        """
+        :path:
+          Directory to store blocks in.
+
+        :latency:
+          Simulated time, in seconds, before each request starts.
+
+        :bandwidth:
+          Simulated bandwidth, in bytes per second, shared by all
+          requests.  Default None (unlimited).
+
+        :replicas:
+          Simulated number of Keep services, i.e., the most copies of
+          a block that can be stored.  Default None (unlimited).
+        """
+        self.path = path
+        self.link = SimulatedLink(latency, bandwidth)
+        self.replicas = replicas
+        self._copies = {}
+        self._copies_lock = threading.Lock()
+        self._sharddirs = set()
+
+    @classmethod
+    def from_environment(cls, path, environ=os.environ):
+        """Return a KeepLocalStore at path, simulating the latency,
+        bandwidth and number of replicas given by the environment
+        variables KEEP_LOCAL_STORE_LATENCY, KEEP_LOCAL_STORE_BANDWIDTH
+        and KEEP_LOCAL_STORE_REPLICAS, if they are set."""
+        def env(name, convert):
+            value = environ.get('KEEP_LOCAL_STORE_' + name)
+            return convert(value) if value else None
+        return cls(path,
+                   latency=env('LATENCY', float) or 0,
+                   bandwidth=env('BANDWIDTH', float),
+                   replicas=env('REPLICAS', int))
+
+    def _path(self, md5sum):
+        return os.path.join(self.path, md5sum[0:3], md5sum)
+
+    def _find(self, md5sum):
+        # Return the path of a stored block, or None.
+        for path in (self._path(md5sum), os.path.join(self.path, md5sum)):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _open(self, md5sum):
+        path = self._find(md5sum)
+        if path is None:
+            raise arvados.errors.NotFoundError("{} not found".format(md5sum))
+        return open(path, 'rb')
+
+    def put(self, data, copies=1):
+        """Store a block and return its locator (without hints)."""
+        md5sum = hashlib.md5(data).hexdigest()
+        locator = '%s+%d' % (md5sum, len(data))
+        if copies < 1:
+            return locator
+        self.link.transfer(len(data))
+        sharddir = os.path.dirname(self._path(md5sum))
+        if sharddir not in self._sharddirs:
+            try:
+                os.mkdir(sharddir)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+            self._sharddirs.add(sharddir)
+        # Several threads may write the same block at once, so each
+        # needs its own temporary file.
+        fd, tmpname = tempfile.mkstemp(dir=sharddir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmpname, self._path(md5sum))
+        except:
+            os.unlink(tmpname)
+            raise
+        stored = copies if self.replicas is None else min(copies, self.replicas)
+        with self._copies_lock:
+            self._copies[md5sum] = max(stored, self._copies.get(md5sum, 0))
+        if stored < copies:
+            raise arvados.errors.KeepWriteError(
+                "failed to write {} (wanted {} copies but wrote {})".format(
+                    md5sum, copies, stored))
+        return locator
+
+    def copies(self, md5sum):
+        """Return the number of copies of a block stored by this object's
+        put() calls (0 if it hasn't stored any)."""
+        with self._copies_lock:
+            return self._copies.get(md5sum, 0)
+
+    def get(self, md5sum):
+        """Return a block's data, as bytes or a memoryview."""
+        with self._open(md5sum) as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < self.MMAP_MIN_SIZE:
+                data = f.read()
+            else:
+                data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        self.link.transfer(size)
+        return data
+
+    def get_range(self, md5sum, offset, length):
+        """Return length bytes of a block, starting at offset."""
+        with self._open(md5sum) as f:
+            f.seek(offset)
+            data = f.read(length)
+        self.link.transfer(len(data))
+        return data
+
+    def head(self, md5sum):
+        """Return True if the block is stored, else raise NotFoundError."""
+        self.link.transfer(0)
+        if self._find(md5sum) is None:
+            raise arvados.errors.NotFoundError("{} not found".format(md5sum))
+        return True
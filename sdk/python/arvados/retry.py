@@ -75,17 +75,29 @@ class RetryLoop(object):
         return self._running and (self._success is None)
 
     def __next__(self):
+        wait_time = self._wait_time()
+        if wait_time is None:
+            raise StopIteration
+        time.sleep(wait_time)
+        return self._next_try()
+
+    def _wait_time(self):
+        # Return the number of seconds to wait before the next try,
+        # or None if the loop is over.  Callers that can't block on
+        # time.sleep() (e.g., coroutines) wait themselves, then call
+        # _next_try().
         if self._running is None:
             self._running = True
         if (self.tries_left < 1) or not self.running():
             self._running = False
-            raise StopIteration
-        else:
-            wait_time = max(0, self.next_start_time - time.time())
-            time.sleep(wait_time)
-            self.backoff_wait *= self.backoff_growth
-            if self.backoff_wait > self.max_wait:
-                self.backoff_wait = self.max_wait
+            return None
+        wait_time = max(0, self.next_start_time - time.time())
+        self.backoff_wait *= self.backoff_growth
+        if self.backoff_wait > self.max_wait:
+            self.backoff_wait = self.max_wait
+        return wait_time
+
+    def _next_try(self):
         self.next_start_time = time.time() + self.backoff_wait
         self.tries_left -= 1
         return self.tries_left
@@ -90,7 +90,8 @@ class StreamReader(object):
             self._keep = KeepClient(num_retries=self.num_retries)
         data = []
         for lr in locators_and_ranges(self._data_locators, start, size):
-            data.append(self._keepget(lr.locator, num_retries=num_retries)[lr.segment_offset:lr.segment_offset+lr.segment_size])
+            block = memoryview(self._keepget(lr.locator, num_retries=num_retries))
+            data.append(block[lr.segment_offset:lr.segment_offset+lr.segment_size])
         return b''.join(data)
 
     def manifest_text(self, strip=False):
@@ -67,7 +67,7 @@ def mock_api_responses(api_client, body, codes, headers={}):
         (fake_httplib2_response(code, **headers), body) for code in codes)))
 
 def str_keep_locator(s):
-    return '{}+{}'.format(hashlib.md5(s if isinstance(s, bytes) else s.encode()).hexdigest(), len(s))
+    return '{}+{}'.format(hashlib.md5(s if isinstance(s, (bytes, bytearray, memoryview)) else s.encode()).hexdigest(), len(s))
 
 @contextlib.contextmanager
 def redirected_streams(stdout=None, stderr=None):
@@ -146,6 +146,10 @@ class FakeCurl(object):
     def getinfo(self, opt):
         if opt == pycurl.RESPONSE_CODE:
             return self._resp_code
+        if opt == pycurl.NUM_CONNECTS:
+            return 1
+        if opt == pycurl.STARTTRANSFER_TIME:
+            return 0.0
         raise Exception
 
 def mock_keep_responses(body, *codes, **headers):
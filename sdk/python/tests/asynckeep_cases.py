@@ -0,0 +1,159 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import hashlib
+import mock
+import shutil
+import tempfile
+import time
+import unittest
+
+import arvados
+from arvados.asynckeep import AsyncKeepClient
+from . import arvados_testutil as tutil
+from . import keepstub
+
+
+class AsyncKeepClientTestCase(keepstub.StubKeepServers, unittest.TestCase):
+    def setUp(self):
+        super(AsyncKeepClientTestCase, self).setUp()
+        self.keep_client = arvados.KeepClient(api_client=self.api_client)
+        self.client = AsyncKeepClient(self.keep_client)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        super(AsyncKeepClientTestCase, self).tearDown()
+
+    def run_coro(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def gather(self, coros):
+        async def gather():
+            return await asyncio.gather(*coros)
+        return self.run_coro(gather())
+
+    def store(self, data):
+        self.server.store[hashlib.md5(data).hexdigest()] = data
+        return tutil.str_keep_locator(data)
+
+    def test_put_get(self):
+        locator = self.run_coro(self.client.put(b'foo', copies=1))
+        self.assertTrue(locator.startswith(tutil.str_keep_locator(b'foo')))
+        self.assertEqual(b'foo', self.server.store[hashlib.md5(b'foo').hexdigest()])
+        self.keep_client.block_cache = arvados.keep.KeepBlockCache()
+        self.assertEqual(b'foo', self.run_coro(self.client.get(locator)))
+
+    def test_get_shares_block_cache(self):
+        locator = self.store(b'foo')
+        self.assertEqual(b'foo', self.run_coro(self.client.get(locator)))
+        self.server.store.clear()
+        self.assertEqual(b'foo', self.keep_client.get(locator))
+
+    def disk_cached_client(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.keep_client.block_cache = arvados.keep.KeepBlockCache(
+            disk_cache=True, disk_cache_dir=cache_dir)
+        return self.keep_client.block_cache
+
+    def test_disk_write_after_slot_filled(self):
+        block_cache = self.disk_cached_client()
+        locator = self.store(b'foo')
+        md5sum = hashlib.md5(b'foo').hexdigest()
+        async def get():
+            data = await self.client.get(locator)
+            # The slot is filled before the disk write is started.
+            slot = block_cache.get(md5sum)
+            self.assertTrue(slot.ready.is_set())
+            self.assertEqual(b'foo', slot.content)
+            for _ in range(100):
+                if block_cache.disk_cache.get(md5sum) is not None:
+                    break
+                await asyncio.sleep(0.01)
+            return data
+        self.assertEqual(b'foo', self.run_coro(get()))
+        self.assertEqual(b'foo', block_cache.disk_cache.get(md5sum))
+
+    def test_disk_write_failure_logged(self):
+        block_cache = self.disk_cached_client()
+        locator = self.store(b'foo')
+        with mock.patch.object(block_cache, 'persist', side_effect=OSError("disk full")), \
+             mock.patch('arvados._asynckeep._logger') as logger:
+            async def get():
+                data = await self.client.get(locator)
+                for _ in range(100):
+                    if logger.warning.called:
+                        break
+                    await asyncio.sleep(0.01)
+                return data
+            self.assertEqual(b'foo', self.run_coro(get()))
+        self.assertIn("disk full", str(logger.warning.call_args))
+
+    def test_head(self):
+        locator = self.store(b'foo')
+        self.assertIs(True, self.run_coro(self.client.head(locator)))
+
+    def test_not_found(self):
+        with self.assertRaises(arvados.errors.NotFoundError):
+            self.run_coro(self.client.get(tutil.str_keep_locator(b'missing')))
+
+    def test_checksum_mismatch(self):
+        locator = tutil.str_keep_locator(b'foo')
+        self.server.store[hashlib.md5(b'foo').hexdigest()] = b'bar'
+        with self.assertRaises(arvados.errors.KeepReadError):
+            self.run_coro(self.client.get(locator))
+
+    def test_concurrent_transfers(self):
+        self.server.setdelays(response=0.5)
+        locators = [self.store(str(i).encode()) for i in range(20)]
+        t0 = time.time()
+        blobs = self.gather([self.client.get(loc) for loc in locators])
+        self.assertLess(time.time() - t0, 2)
+        self.assertEqual([str(i).encode() for i in range(20)], [bytes(b) for b in blobs])
+
+    def test_same_block_fetched_once(self):
+        self.server.setdelays(response=0.2)
+        locator = self.store(b'foo')
+        blobs = self.gather([self.client.get(locator) for _ in range(5)])
+        self.assertEqual([b'foo'] * 5, [bytes(b) for b in blobs])
+        self.assertEqual(1, self.keep_client.misses_counter.get())
+
+    def test_retry(self):
+        locator = tutil.str_keep_locator(b'foo')
+        self.server.store[hashlib.md5(b'foo').hexdigest()] = b'bar'
+        # The retry waits 2 seconds; other coroutines keep running.
+        ticks = []
+        async def tick():
+            for _ in range(10):
+                ticks.append(time.time())
+                await asyncio.sleep(0.1)
+        with self.assertRaises(arvados.errors.KeepReadError):
+            self.gather([self.client.get(locator, num_retries=1), tick()])
+        self.assertEqual(10, len(ticks))
+        self.assertEqual({'GET': 1}, self.keep_client.metrics_snapshot()['retries'])
+
+    def test_cancel(self):
+        self.server.setdelays(response=5)
+        locator = self.store(b'foo')
+        async def cancel_get():
+            task = asyncio.ensure_future(self.client.get(locator))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        t0 = time.time()
+        self.run_coro(cancel_get())
+        self.assertLess(time.time() - t0, 2)
+        self.assertEqual({'GET': 0}, self.keep_client.metrics_snapshot()['bytes_in_flight'])
+
+    def test_throttle_max_in_flight(self):
+        self.server.setdelays(response=0.2)
+        self.keep_client.throttle.max_in_flight = 1
+        locators = [self.store(str(i).encode()) for i in range(4)]
+        t0 = time.time()
+        self.gather([self.client.get(loc) for loc in locators])
+        self.assertGreater(time.time() - t0, 0.75)
+        self.assertEqual(0, self.keep_client.throttle.in_flight)
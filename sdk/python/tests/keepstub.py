@@ -47,6 +47,8 @@ class StubKeepServers(tutil.ApiClientMock):
 class Server(socketserver.ThreadingMixIn, http.server.HTTPServer, object):
 
     allow_reuse_address = 1
+    # Accept many connections at once, for concurrency tests.
+    request_queue_size = 1024
 
     def __init__(self, *args, **kwargs):
         self.store = {}
@@ -67,6 +69,13 @@ class Server(socketserver.ThreadingMixIn, http.server.HTTPServer, object):
             'mid_read': 0,
         }
         self.bandwidth = None
+        # If true, don't ask clients to close the connection after
+        # GET and HEAD responses.
+        self.keepalive = False
+        # If false, ignore Range headers and send the whole block.
+        self.ranges = True
+        # Range headers received in GET requests.
+        self.range_requests = []
         super(Server, self).__init__(*args, **kwargs)
 
     def setdelays(self, **kwargs):
@@ -168,30 +177,48 @@ class Handler(http.server.BaseHTTPRequestHandler, object):
         self._sent_continue = True
         return super(Handler, self).handle_expect_100()
 
+    def send_error_response(self, code):
+        self.send_response(code)
+        self.send_header('Content-length', '0')
+        self.end_headers()
+
     def do_GET(self):
         self.server._do_delay('response')
         r = re.search(r'[0-9a-f]{32}', self.path)
         if not r:
-            return self.send_response(422)
+            return self.send_error_response(422)
         datahash = r.group(0)
         if datahash not in self.server.store:
-            return self.send_response(404)
-        self.send_response(200)
-        self.send_header('Connection', 'close')
+            return self.send_error_response(404)
+        data = self.server.store[datahash]
+        r = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('range', ''))
+        if r:
+            self.server.range_requests.append(self.headers.get('range'))
+        if r and self.server.ranges:
+            start, end = int(r.group(1)), min(int(r.group(2)) + 1, len(data))
+            self.send_response(206)
+            self.send_header('Content-range', 'bytes {}-{}/{}'.format(start, end - 1, len(data)))
+            data = data[start:end]
+        else:
+            self.send_response(200)
+        if self.server.keepalive:
+            self.send_header('Content-length', str(len(data)))
+        else:
+            self.send_header('Connection', 'close')
         self.send_header('Content-type', 'application/octet-stream')
         self.end_headers()
         self.server._do_delay('response_body')
-        self.wfile_bandwidth_write(self.server.store[datahash])
+        self.wfile_bandwidth_write(data)
         self.server._do_delay('response_close')
 
     def do_HEAD(self):
         self.server._do_delay('response')
         r = re.search(r'[0-9a-f]{32}', self.path)
         if not r:
-            return self.send_response(422)
+            return self.send_error_response(422)
         datahash = r.group(0)
         if datahash not in self.server.store:
-            return self.send_response(404)
+            return self.send_error_response(404)
         self.send_response(200)
         self.send_header('Connection', 'close')
         self.send_header('Content-type', 'application/octet-stream')
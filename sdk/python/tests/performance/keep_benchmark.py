@@ -0,0 +1,318 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""KeepClient throughput benchmark against local keepstub servers.
+
+Each scenario runs a batch of GET or PUT requests through one
+KeepClient, from a number of client threads, and records:
+
+* throughput (requests and MiB per second);
+* p50 and p99 request latency;
+* client CPU time per byte transferred.
+
+Scenarios vary the block size, the concurrency, the number of
+replicas, and (for GET) the fraction of requests that the block
+cache can answer.  The keepstub servers run in their own processes,
+so the CPU time is the client's alone.
+
+Run from sdk/python:
+
+    python -m tests.performance.keep_benchmark --output results.json
+
+Save the JSON output for each commit you want to compare, and pass
+an earlier one with --baseline to see how throughput and latency
+changed.  tests/performance/test_keep_benchmark.py runs a small set
+of scenarios as part of the test suite.
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+from builtins import range
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import arvados
+import arvados.keep
+from arvados.commands._util import _byte_count
+from .. import arvados_testutil as tutil
+from .. import keepstub
+
+Scenario = collections.namedtuple('Scenario', [
+    'method', 'block_size', 'concurrency', 'replicas', 'hit_ratio'])
+
+# Upper bound on the data stored for one scenario, so big blocks
+# don't exhaust the servers' memory: scenarios with big blocks make
+# fewer requests.
+SCENARIO_BYTES = 256 * 2**20
+
+
+class _Handler(keepstub.Handler):
+    # Without this, small responses wait for the client's delayed ACK,
+    # and every small GET takes 40 ms.
+    disable_nagle_algorithm = True
+
+
+def _serve(port_queue):
+    server = keepstub.Server(('127.0.0.1', 0), _Handler)
+    server.keepalive = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class StubCluster(object):
+    """Keepstub servers, each in its own process."""
+
+    def __init__(self, count):
+        self.count = count
+        self._processes = []
+        self.ports = []
+
+    def __enter__(self):
+        port_queue = multiprocessing.Queue()
+        for _ in range(self.count):
+            proc = multiprocessing.Process(target=_serve, args=(port_queue,))
+            proc.daemon = True
+            proc.start()
+            self._processes.append(proc)
+        self.ports = [port_queue.get(timeout=30) for _ in range(self.count)]
+        return self
+
+    def __exit__(self, *exc):
+        for proc in self._processes:
+            proc.terminate()
+        for proc in self._processes:
+            proc.join()
+
+    def keep_client(self, **kwargs):
+        api_client = tutil.ApiClientMock().mock_keep_services(
+            count=0, additional_services=[{
+                'uuid': 'zzzzz-bi6l4-{:015x}'.format(i),
+                'owner_uuid': 'zzzzz-tpzed-000000000000000',
+                'service_host': '127.0.0.1',
+                'service_port': port,
+                'service_ssl_flag': False,
+                'service_type': 'disk',
+                'read_only': False,
+            } for i, port in enumerate(self.ports)])
+        return arvados.KeepClient(api_client=api_client, **kwargs)
+
+
+def _blocks(block_size, count, seed):
+    # count distinct blocks, differing in their first 16 bytes.
+    base = bytearray(random.Random(seed).getrandbits(8) for _ in range(min(block_size, 4096)))
+    base = (base * (block_size // len(base) + 1))[:block_size] if base else bytearray()
+    for i in range(count):
+        block = bytearray(base)
+        block[:16] = struct.pack('<QQ', seed, i)[:block_size]
+        yield bytes(block)
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def _run_requests(requests, concurrency, func):
+    # Call func(request) for each request from concurrency threads.
+    # Return the latency of each call, and the wall clock time.
+    latencies = []
+    lock = threading.Lock()
+    todo = iter(requests)
+    errors = []
+    def worker():
+        while True:
+            with lock:
+                request = next(todo, None)
+            if request is None:
+                return
+            t0 = time.time()
+            try:
+                func(request)
+            except Exception as e:
+                errors.append(e)
+                return
+            elapsed = time.time() - t0
+            with lock:
+                latencies.append(elapsed)
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.time() - t0
+    if errors:
+        raise errors[0]
+    return latencies, wall
+
+
+def _cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_scenario(cluster, scenario, max_requests, seed=0):
+    """Run one scenario and return its results as a dict."""
+    nrequests = max(scenario.concurrency,
+                    min(max_requests, SCENARIO_BYTES // max(scenario.block_size, 1)))
+    if scenario.method == 'PUT':
+        keep_client = cluster.keep_client()
+        blocks = list(_blocks(scenario.block_size, nrequests, seed))
+        func = lambda data: keep_client.put(data, copies=scenario.replicas)
+        requests = blocks
+    else:
+        misses = int(round(nrequests * (1 - scenario.hit_ratio)))
+        hits = nrequests - misses
+        warm = min(hits, 16)
+        loader = cluster.keep_client()
+        blocks = list(_blocks(scenario.block_size, misses + warm, seed))
+        locators = [loader.put(data, copies=scenario.replicas) for data in blocks]
+        # Each miss is for a different block, so a cache big enough
+        # for every block doesn't turn misses into hits, and stops
+        # misses from evicting the warm blocks.
+        keep_client = cluster.keep_client(block_cache=arvados.keep.KeepBlockCache(
+            cache_max=(len(locators) + scenario.concurrency) * max(scenario.block_size, 1)))
+        for loc in locators[misses:]:
+            keep_client.get(loc)
+        keep_client.get_counter.add(-keep_client.get_counter.get())
+        keep_client.hits_counter.add(-keep_client.hits_counter.get())
+        requests = locators[:misses] + [
+            locators[misses + i % warm] for i in range(hits)]
+        random.Random(seed).shuffle(requests)
+        func = keep_client.get
+    cpu0 = _cpu_seconds()
+    latencies, wall = _run_requests(requests, scenario.concurrency, func)
+    cpu = _cpu_seconds() - cpu0
+    latencies.sort()
+    nbytes = nrequests * scenario.block_size
+    result = scenario._asdict()
+    result.update({
+        'requests': nrequests,
+        'seconds': wall,
+        'requests_per_second': nrequests / wall,
+        'mib_per_second': nbytes / wall / 2**20,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'cpu_seconds': cpu,
+        'cpu_ns_per_byte': cpu / nbytes * 1e9 if nbytes else None,
+    })
+    if scenario.method == 'GET':
+        gets = keep_client.get_counter.get()
+        result['observed_hit_ratio'] = keep_client.hits_counter.get() / gets if gets else None
+    return result
+
+
+def scenarios(methods, block_sizes, concurrencies, replicas, hit_ratios):
+    for method, size, conc, nrep in itertools.product(
+            methods, block_sizes, concurrencies, replicas):
+        for ratio in (hit_ratios if method == 'GET' else [0]):
+            yield Scenario(method, size, conc, nrep, ratio)
+
+
+def run(servers, scenario_list, max_requests, progress=None):
+    """Run scenarios against a new StubCluster and return a report dict."""
+    results = []
+    with StubCluster(servers) as cluster:
+        for i, scenario in enumerate(scenario_list):
+            result = run_scenario(cluster, scenario, max_requests, seed=i)
+            if progress:
+                progress(result)
+            results.append(result)
+    return {
+        'commit': _git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'pycurl': arvados.keep.pycurl.version,
+        'servers': servers,
+        'results': results,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(result):
+    return tuple(result[field] for field in Scenario._fields)
+
+
+def format_result(result, baseline=None):
+    line = "{method:4} {block_size:>10} x{concurrency:<3} r{replicas} hit={hit_ratio:<4}: " \
+           "{mib_per_second:9.2f} MiB/s {requests_per_second:8.1f} req/s " \
+           "p50 {p50_ms:8.2f} ms p99 {p99_ms:8.2f} ms".format(**result)
+    if result['cpu_ns_per_byte'] is not None:
+        line += " {:6.2f} cpu ns/B".format(result['cpu_ns_per_byte'])
+    if baseline is not None:
+        line += " ({:+.0%} req/s, {:+.0%} p99)".format(
+            result['requests_per_second'] / baseline['requests_per_second'] - 1,
+            result['p99_ms'] / baseline['p99_ms'] - 1)
+    return line
+
+
+def _list_of(convert):
+    return lambda s: [convert(v) for v in s.split(',')]
+
+
+def main(arguments=None, stdout=sys.stdout):
+    parser = argparse.ArgumentParser(
+        description="Measure KeepClient throughput against local keepstub servers.")
+    parser.add_argument('--servers', type=int, default=4,
+                        help="Number of keepstub servers.  Default 4.")
+    parser.add_argument('--methods', type=_list_of(str.upper), default=['GET', 'PUT'],
+                        help="Comma-separated request methods.  Default GET,PUT.")
+    parser.add_argument('--block-sizes', type=_list_of(_byte_count),
+                        default=[64 * 2**10, 2**20, 16 * 2**20],
+                        help="Comma-separated block sizes (e.g., 64K,1M).  Default 64K,1M,16M.")
+    parser.add_argument('--concurrency', type=_list_of(int), default=[1, 8, 32],
+                        help="Comma-separated numbers of client threads.  Default 1,8,32.")
+    parser.add_argument('--replicas', type=_list_of(int), default=[1, 2],
+                        help="Comma-separated numbers of copies to write.  Default 1,2.")
+    parser.add_argument('--hit-ratios', type=_list_of(float), default=[0, 0.5],
+                        help="Comma-separated fractions of GETs that the block cache can answer.  Default 0,0.5.")
+    parser.add_argument('--requests', type=int, default=200,
+                        help="Requests per scenario (fewer for big blocks).  Default 200.")
+    parser.add_argument('--output', metavar='FILE',
+                        help="Write the results to FILE as JSON.")
+    parser.add_argument('--baseline', metavar='FILE',
+                        help="Compare with the results in FILE, from an earlier run.")
+    args = parser.parse_args(arguments)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {_key(r): r for r in json.load(f)['results']}
+    def progress(result):
+        print(format_result(result, baseline.get(_key(result))), file=stdout)
+        stdout.flush()
+    report = run(args.servers, list(scenarios(
+        args.methods, args.block_sizes, args.concurrency, args.replicas, args.hit_ratios)),
+                 args.requests, progress)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return report
+
+
+if __name__ == '__main__':
+    main()
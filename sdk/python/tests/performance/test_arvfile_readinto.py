@@ -0,0 +1,91 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+from builtins import range
+import mock
+import os
+import re
+import shutil
+import tempfile
+import time
+import unittest
+
+import arvados
+from .. import arvados_testutil as tutil
+
+class ReadintoBenchmark(unittest.TestCase, tutil.ApiClientMock):
+    """read() and readinto() rates for a large file, in 1 MiB reads,
+    from a local store and from the block cache."""
+
+    SIZE = 128 * 2**20
+    CHUNK = 2**20
+
+    def setUp(self):
+        self.local_store = tempfile.mkdtemp()
+        self.keep_client = arvados.KeepClient(local_store=self.local_store)
+        with mock.patch.dict(os.environ, {'KEEP_LOCAL_STORE': self.local_store}):
+            coll = arvados.collection.Collection(
+                api_client=self.api_client_mock(), keep_client=self.keep_client,
+                replication_desired=1)
+            with coll.open('big', 'wb') as f:
+                chunk = os.urandom(self.CHUNK)
+                for i in range(self.SIZE // self.CHUNK):
+                    f.write(chunk)
+            self.manifest = coll.manifest_text()
+
+    def tearDown(self):
+        shutil.rmtree(self.local_store)
+
+    def cached_keep_client(self):
+        # A client with no local store, and every block of the file
+        # already in its block cache.
+        keep_client = arvados.KeepClient(
+            api_client=self.mock_keep_services(count=1),
+            block_cache=arvados.keep.KeepBlockCache(cache_max=2 * self.SIZE))
+        for loc in re.findall(r'\b[0-9a-f]{32}\+\d+', self.manifest):
+            slot, first = keep_client.block_cache.reserve_cache(loc[:32])
+            keep_client.block_cache.set(slot, bytearray(self.keep_client.get(loc)))
+        return keep_client
+
+    def open(self, keep_client):
+        coll = arvados.collection.Collection(
+            self.manifest, api_client=self.api_client_mock(),
+            keep_client=keep_client)
+        return coll.open('big', 'rb')
+
+    def test_read_and_readinto(self):
+        self.read_and_readinto("local store", self.keep_client)
+
+    def test_read_and_readinto_cached(self):
+        self.read_and_readinto("block cache", self.cached_keep_client())
+
+    def read_and_readinto(self, source, keep_client):
+        with self.open(keep_client) as f:
+            t0 = time.time()
+            total = 0
+            while True:
+                data = f.read(self.CHUNK)
+                if not data:
+                    break
+                total += len(data)
+            read_secs = time.time() - t0
+        self.assertEqual(self.SIZE, total)
+        buf = bytearray(self.CHUNK)
+        with self.open(keep_client) as f:
+            t0 = time.time()
+            total = 0
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                total += n
+            readinto_secs = time.time() - t0
+        self.assertEqual(self.SIZE, total)
+        print("{} MiB from the {} in 1 MiB reads: read() {:.0f} MiB/s, readinto() {:.0f} MiB/s".format(
+            self.SIZE // 2**20, source,
+            self.SIZE / 2**20 / read_secs,
+            self.SIZE / 2**20 / readinto_secs))
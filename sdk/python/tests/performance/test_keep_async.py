@@ -0,0 +1,43 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import hashlib
+import time
+import unittest
+
+import arvados
+from arvados.asynckeep import AsyncKeepClient
+from .. import arvados_testutil as tutil
+from .. import keepstub
+
+class AsyncKeepConcurrencyBenchmark(keepstub.StubKeepServers, unittest.TestCase):
+    """Many concurrent block reads on one event loop."""
+
+    BLOCKS = 1000
+    DELAY = 0.5
+
+    def test_concurrent_gets(self):
+        keep_client = arvados.KeepClient(api_client=self.api_client)
+        client = AsyncKeepClient(keep_client)
+        locators = []
+        for i in range(self.BLOCKS):
+            data = str(i).encode() * 1000
+            self.server.store[hashlib.md5(data).hexdigest()] = data
+            locators.append(tutil.str_keep_locator(data))
+        self.server.setdelays(response=self.DELAY)
+
+        async def get_all():
+            return await asyncio.gather(*[client.get(loc) for loc in locators])
+        loop = asyncio.new_event_loop()
+        try:
+            t0 = time.time()
+            loop.run_until_complete(get_all())
+            elapsed = time.time() - t0
+        finally:
+            loop.close()
+        print("{} concurrent gets, {}s server delay each: {:.2f}s".format(
+            self.BLOCKS, self.DELAY, elapsed))
+        # One at a time, this would take BLOCKS * DELAY seconds.
+        self.assertLess(elapsed, self.DELAY * 20)
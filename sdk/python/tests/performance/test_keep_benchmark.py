@@ -0,0 +1,50 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import absolute_import
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import keep_benchmark
+
+class KeepBenchmarkTest(unittest.TestCase):
+    """A small run of the keepstub benchmark, to keep it working."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_small_run(self):
+        output = os.path.join(self.tmpdir, 'results.json')
+        stdout = io.StringIO()
+        report = keep_benchmark.main([
+            '--servers', '2', '--block-sizes', '4K,64K', '--concurrency', '1,4',
+            '--replicas', '2', '--hit-ratios', '0,0.5', '--requests', '20',
+            '--output', output], stdout=stdout)
+        # 2 sizes x 2 concurrencies x (2 GET hit ratios + 1 PUT)
+        self.assertEqual(12, len(report['results']))
+        for result in report['results']:
+            self.assertGreater(result['requests_per_second'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertIsNotNone(result['cpu_ns_per_byte'])
+        hit_ratios = {r['hit_ratio']: r['observed_hit_ratio']
+                      for r in report['results'] if r['method'] == 'GET'}
+        self.assertEqual(0, hit_ratios[0])
+        self.assertAlmostEqual(0.5, hit_ratios[0.5], delta=0.1)
+        with open(output) as f:
+            self.assertEqual(report['results'], json.load(f)['results'])
+        print(stdout.getvalue())
+
+        stdout = io.StringIO()
+        keep_benchmark.main([
+            '--servers', '2', '--block-sizes', '4K', '--concurrency', '4',
+            '--methods', 'put', '--requests', '20', '--baseline', output],
+                            stdout=stdout)
+        self.assertIn('req/s,', stdout.getvalue())
@@ -0,0 +1,41 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+from builtins import range
+import hashlib
+import timeit
+import unittest
+
+import arvados.keep
+
+class KeepBlockCacheBenchmark(unittest.TestCase):
+    """Cache hit latency should not depend on the number of cached blocks."""
+
+    BLOCK = b'x' * 1024
+    HITS = 20000
+
+    def hit_latency(self, nblocks):
+        cache = arvados.keep.KeepBlockCache(cache_max=nblocks * len(self.BLOCK))
+        locators = [hashlib.md5(str(i).encode()).hexdigest()
+                    for i in range(nblocks)]
+        for loc in locators:
+            slot, _ = cache.reserve_cache(loc)
+            cache.set(slot, self.BLOCK)
+        # Hit the least recently used block each time, which was the
+        # worst case for the old list-based cache.
+        oldest = iter(locators * (self.HITS // nblocks + 1))
+        t = timeit.timeit(lambda: cache.reserve_cache(next(oldest)),
+                          number=self.HITS)
+        return t / self.HITS
+
+    def test_hit_latency_flat(self):
+        results = {n: self.hit_latency(n) for n in (10, 1000, 10000)}
+        for n, secs in sorted(results.items()):
+            print("KeepBlockCache {:6d} blocks: {:.2f} usec/hit".format(n, secs * 1e6))
+        # Generous bound to keep this stable on loaded test hosts;
+        # an O(n) scan is ~1000x slower at 10000 blocks.
+        self.assertLess(results[10000], results[10] * 10)
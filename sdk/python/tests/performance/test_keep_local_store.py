@@ -0,0 +1,51 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+from builtins import range
+import shutil
+import tempfile
+import time
+import unittest
+
+import arvados
+from arvados.localstore import KeepLocalStore
+
+class KeepLocalStoreBenchmark(unittest.TestCase):
+    """Small-block put() and get() rates through a local store."""
+
+    BLOCKS = 20000
+
+    def setUp(self):
+        self.local_store = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.local_store)
+
+    def test_many_blocks(self):
+        keep_client = arvados.KeepClient(local_store=KeepLocalStore(self.local_store))
+        blocks = [str(i).encode() for i in range(self.BLOCKS)]
+        t0 = time.time()
+        locators = [keep_client.put(data) for data in blocks]
+        put_rate = self.BLOCKS / (time.time() - t0)
+        t0 = time.time()
+        for loc in locators:
+            keep_client.get(loc)
+        get_rate = self.BLOCKS / (time.time() - t0)
+        print("local store, {} blocks: {:.0f} puts/s, {:.0f} gets/s".format(
+            self.BLOCKS, put_rate, get_rate))
+        self.assertEqual(blocks[-1], keep_client.get(locators[-1]))
+
+    def test_simulated_bandwidth(self):
+        store = KeepLocalStore(self.local_store, latency=0.01, bandwidth=10 * 2**20)
+        keep_client = arvados.KeepClient(local_store=store)
+        data = b'x' * 2**20
+        t0 = time.time()
+        for i in range(5):
+            keep_client.put(data + str(i).encode())
+        secs = time.time() - t0
+        print("local store, 5 MiB at a simulated 10 MiB/s: {:.2f} s".format(secs))
+        self.assertGreater(secs, 0.5)
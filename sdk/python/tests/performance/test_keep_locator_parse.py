@@ -0,0 +1,69 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+import mock
+import os
+import re
+import shutil
+import tempfile
+import timeit
+import unittest
+
+import arvados
+from arvados.keep import KeepLocator
+from .. import arvados_testutil as tutil
+from .. import manifest_examples
+
+class KeepLocatorBenchmark(unittest.TestCase, tutil.ApiClientMock,
+                           manifest_examples.ManifestExamples):
+    """Cost of reading locators while exporting a large manifest."""
+
+    SIGNATURE = '+A' + 'a' * 40 + '@7fffffff'
+
+    def setUp(self):
+        self.local_store = tempfile.mkdtemp()
+        with mock.patch.dict(os.environ, {'KEEP_LOCAL_STORE': self.local_store}):
+            manifest = self.make_manifest(files_per_stream=1000, streams=20)
+        # Sign the locators, as the API server does.
+        self.manifest = re.sub(r'\b([0-9a-f]{32}\+\d+)\b', r'\1' + self.SIGNATURE, manifest)
+        self.locators = [word for line in self.manifest.splitlines()
+                         for word in line.split()[1:] if '+A' in word]
+
+    def tearDown(self):
+        shutil.rmtree(self.local_store)
+
+    def test_manifest_export(self):
+        coll = arvados.collection.Collection(
+            self.manifest, api_client=self.api_client_mock(),
+            keep_client=arvados.KeepClient(local_store=self.local_store))
+        segments = sum(len(coll[stream][name].segments())
+                       for stream in coll for name in coll[stream])
+        secs = min(timeit.repeat(lambda: coll.manifest_text(strip=True), number=1, repeat=3))
+        print("manifest_text(strip=True): {} segments, {:.2f} usec/segment".format(
+            segments, secs / segments * 1e6))
+        self.assertNotIn('+A', coll.manifest_text(strip=True))
+
+    def test_strip_and_size(self):
+        # What manifest export does for each segment, with and without
+        # building a KeepLocator each time.
+        locators = self.locators * (20000 // len(self.locators) + 1)
+        def with_objects():
+            for loc in locators:
+                loc = KeepLocator(loc).stripped()
+                KeepLocator(loc).size
+        def with_helpers():
+            for loc in locators:
+                loc = KeepLocator.strip_hints(loc)
+                KeepLocator.size_of(loc)
+        objects = min(timeit.repeat(with_objects, number=1, repeat=3))
+        helpers = min(timeit.repeat(with_helpers, number=1, repeat=3))
+        print("KeepLocator(loc).stripped(), .size: {:.2f} usec/locator".format(
+            objects / len(locators) * 1e6))
+        print("KeepLocator.strip_hints(), .size_of(): {:.2f} usec/locator".format(
+            helpers / len(locators) * 1e6))
+        # Generous bound to keep this stable on loaded test hosts.
+        self.assertLess(helpers, objects)
@@ -0,0 +1,102 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+import hashlib
+import mock
+import pycurl
+import unittest
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import arvados
+import arvados.keep
+from .. import arvados_testutil as tutil
+
+class ChunkedFakeCurl(tutil.FakeCurl):
+    """Deliver the response body in 16 KiB pieces, like libcurl."""
+    CHUNK = 2**14
+
+    def perform(self):
+        self._headerfunction("HTTP/1.1 200 OK")
+        self._headerfunction("Content-Length: {}".format(len(self._resp_body)))
+        for i in range(0, len(self._resp_body), self.CHUNK):
+            self._writer(self._resp_body[i:i+self.CHUNK])
+
+
+class DrainingFakeCurl(tutil.FakeCurl):
+    """Read the whole request body in 64 KiB pieces, like libcurl."""
+    CHUNK = 2**16
+
+    def setopt(self, opt, val):
+        if opt == pycurl.READFUNCTION:
+            self._reader = val
+        else:
+            super(DrainingFakeCurl, self).setopt(opt, val)
+
+    def perform(self):
+        while len(self._reader(self.CHUNK)) > 0:
+            pass
+        self._headerfunction("HTTP/1.1 200 OK")
+        self._writer(self._resp_body)
+
+
+@unittest.skipIf(not hasattr(tracemalloc, 'reset_peak'), "needs Python 3.9 tracemalloc")
+class KeepGetMemoryBenchmark(unittest.TestCase, tutil.ApiClientMock):
+    """Peak memory allocated per block fetched by KeepClient.get(view=True)."""
+
+    BLOCK_SIZE = 2**24
+
+    def test_peak_memory_per_block(self):
+        data = b'x' * self.BLOCK_SIZE
+        loc = '{}+{}'.format(hashlib.md5(data).hexdigest(), len(data))
+        keep_client = arvados.KeepClient(api_client=self.mock_keep_services(count=1))
+        keep_client.build_services_list()
+        with mock.patch('pycurl.Curl', lambda: ChunkedFakeCurl(200, data)):
+            tracemalloc.start()
+            try:
+                blob = keep_client.get(loc, view=True)
+                _, get_peak = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                view = memoryview(blob)
+                part = b''.join([view[:self.BLOCK_SIZE//2], view[self.BLOCK_SIZE//2:]])
+                _, read_peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        self.assertEqual(data, part)
+        print("KeepClient.get: {:.2f}x block size peak allocation".format(get_peak / self.BLOCK_SIZE))
+        print("read whole block from cache: {:.2f}x block size peak allocation".format(read_peak / self.BLOCK_SIZE))
+        # One buffer for the block; the old BytesIO + getvalue() path
+        # needed two.
+        self.assertLess(get_peak, 1.25 * self.BLOCK_SIZE)
+        # The cached block plus one copy for the caller.
+        self.assertLess(read_peak, 2.25 * self.BLOCK_SIZE)
+
+
+@unittest.skipIf(not hasattr(tracemalloc, 'reset_peak'), "needs Python 3.9 tracemalloc")
+class KeepPutMemoryBenchmark(unittest.TestCase, tutil.ApiClientMock):
+    """Peak memory allocated by KeepClient.put() beyond the block itself."""
+
+    BLOCK_SIZE = 2**24
+
+    def test_peak_memory_per_block(self):
+        buf = bytearray(b'x' * self.BLOCK_SIZE)
+        loc = '{}+{}'.format(hashlib.md5(buf).hexdigest(), len(buf))
+        keep_client = arvados.KeepClient(api_client=self.mock_keep_services(count=2))
+        keep_client.build_services_list()
+        with mock.patch('pycurl.Curl', lambda: DrainingFakeCurl(200, loc.encode())):
+            tracemalloc.start()
+            try:
+                self.assertEqual(loc, keep_client.put(memoryview(buf), copies=2))
+                _, put_peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        print("KeepClient.put, 2 copies: {:.2f}x block size peak allocation".format(put_peak / self.BLOCK_SIZE))
+        # Copying the block to bytes, then into a BytesIO per replica,
+        # used to allocate 3x the block size.
+        self.assertLess(put_peak, 0.25 * self.BLOCK_SIZE)
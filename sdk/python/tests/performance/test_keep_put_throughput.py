@@ -0,0 +1,40 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+from builtins import range
+import mock
+import time
+import unittest
+
+import arvados
+from .. import arvados_testutil as tutil
+
+class KeepPutThroughputBenchmark(unittest.TestCase, tutil.ApiClientMock):
+    """Small-block put() throughput, with and without shared writer threads."""
+
+    PUTS = 500
+
+    def puts_per_second(self, shared_workers):
+        keep_client = arvados.KeepClient(api_client=self.mock_keep_services(count=2))
+        keep_client.build_services_list()
+        if not shared_workers:
+            # Start threads for each block, like put() used to.
+            keep_client._put_workers = lambda: None
+        blocks = [str(i).encode() for i in range(self.PUTS)]
+        with mock.patch('pycurl.Curl', lambda: tutil.FakeCurl(200, b'')):
+            t0 = time.time()
+            for data in blocks:
+                keep_client.put(data, copies=2)
+            return self.PUTS / (time.time() - t0)
+
+    def test_put_throughput(self):
+        per_block = self.puts_per_second(False)
+        shared = self.puts_per_second(True)
+        print("put() with threads per block: {:.0f} blocks/s".format(per_block))
+        print("put() with shared writer pool: {:.0f} blocks/s".format(shared))
+        # Generous bound to keep this stable on loaded test hosts.
+        self.assertGreater(shared, per_block * 0.8)
@@ -0,0 +1,46 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import division
+from builtins import range
+import hashlib
+import timeit
+import unittest
+
+import arvados
+from .. import arvados_testutil as tutil
+
+class KeepRoutingBenchmark(unittest.TestCase, tutil.ApiClientMock):
+    """Per-block cost of choosing Keep services, by number of services."""
+
+    BLOCKS = 200
+    ROUNDS = 10
+
+    def routing_latency(self, nservices, cached):
+        keep_client = arvados.KeepClient(
+            api_client=self.mock_keep_services(count=nservices))
+        keep_client.build_services_list()
+        locators = [arvados.KeepLocator(hashlib.md5(str(i).encode()).hexdigest())
+                    for i in range(self.BLOCKS)]
+        if not cached:
+            keep_client.SERVICE_ROOTS_CACHE_SIZE = 0
+        def route_all():
+            for loc in locators:
+                keep_client.weighted_service_roots(loc)
+        route_all()
+        t = timeit.timeit(route_all, number=self.ROUNDS)
+        return t / (self.ROUNDS * self.BLOCKS)
+
+    def test_routing_overhead(self):
+        results = {}
+        for n in (4, 32, 256):
+            results[n] = (self.routing_latency(n, False), self.routing_latency(n, True))
+            print("{:4d} services: {:8.2f} usec/block uncached, {:6.2f} usec/block cached".format(
+                n, results[n][0] * 1e6, results[n][1] * 1e6))
+        # A cached lookup doesn't hash or sort, so it should barely
+        # depend on the number of services (the roots list is still
+        # copied), and be much cheaper than computing the order.
+        self.assertLess(results[256][1], results[256][0] / 5)
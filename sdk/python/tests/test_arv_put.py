@@ -108,6 +108,20 @@ class ArvadosPutResumeCacheTest(ArvadosBaseTestCase):
             self.cache_path_from_arglist(['-', '--max-manifest-depth', '1']),
             "cache path considered --max-manifest-depth for file")
 
+    def test_cache_names_ignore_throttle_arguments(self):
+        self.assertEqual(
+            self.cache_path_from_arglist(['/tmp']),
+            self.cache_path_from_arglist(['/tmp', '--max-bandwidth', '2M',
+                                          '--max-requests', '4']))
+
+    def test_throttle_arguments(self):
+        args = arv_put.parse_arguments(['--max-bandwidth', '1.5K', '--max-requests', '4', '/tmp'])
+        self.assertEqual(1536, args.max_bandwidth)
+        self.assertEqual(4, args.max_requests)
+        args = arv_put.parse_arguments(['/tmp'])
+        self.assertIsNone(args.max_bandwidth)
+        self.assertIsNone(args.max_requests)
+
     def test_cache_names_treat_negative_manifest_depths_identically(self):
         base_args = ['/tmp', '--max-manifest-depth']
         self.assertEqual(
@@ -718,7 +732,7 @@ class ArvadosPutTest(run_test_server.TestCaseWithServers,
             path = testfile.name
             self.call_main_with_args(['--stream', '--no-progress'] + args + [path])
         self.assertTrue(
-            os.path.exists(os.path.join(os.environ['KEEP_LOCAL_STORE'],
+            os.path.exists(os.path.join(os.environ['KEEP_LOCAL_STORE'], '098',
                                         '098f6bcd4621d373cade4e832627b4f6')),
             "did not find file stream in Keep store")
 
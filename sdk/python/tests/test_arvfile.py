@@ -7,12 +7,16 @@ from builtins import hex
 from builtins import str
 from builtins import range
 from builtins import object
+import array
 import bz2
 import datetime
 import gzip
+import hashlib
 import io
+import mmap
 import mock
 import os
+import threading
 import unittest
 import time
 
@@ -23,6 +27,7 @@ from arvados.collection import Collection, CollectionReader
 from arvados.arvfile import ArvadosFile, ArvadosFileReader
 
 from . import arvados_testutil as tutil
+from . import keepstub
 from .test_stream import StreamFileReaderTestCase, StreamRetryTestMixin
 
 class ArvadosFileWriterTestCase(unittest.TestCase):
@@ -30,10 +35,10 @@ class ArvadosFileWriterTestCase(unittest.TestCase):
         def __init__(self, blocks):
             self.blocks = blocks
             self.requests = []
-        def get(self, locator, num_retries=0):
+        def get(self, locator, num_retries=0, view=False):
             self.requests.append(locator)
             return self.blocks.get(locator)
-        def get_from_cache(self, locator):
+        def get_from_cache(self, locator, view=False):
             self.requests.append(locator)
             return self.blocks.get(locator)
         def put(self, data, num_retries=None, copies=None):
@@ -637,7 +642,10 @@ class ArvadosFileReaderTestCase(StreamFileReaderTestCase):
                 self.blocks = blocks
                 self.nocache = nocache
 
-            def block_prefetch(self, loc):
+            def block_prefetch(self, loc, owner=None, demand=False):
+                pass
+
+            def cancel_prefetch(self, owner):
                 pass
 
             def get_block_contents(self, loc, num_retries=0, cache_only=False):
@@ -645,6 +653,13 @@ class ArvadosFileReaderTestCase(StreamFileReaderTestCase):
                     return None
                 return self.blocks[loc]
 
+            def get_block_range(self, loc, offset, size, num_retries=0, cache_only=False):
+                block = self.get_block_contents(loc, num_retries, cache_only)
+                return None if block is None else block[offset:offset+size]
+
+            def use_range_read(self, size):
+                return False
+
         def __init__(self, blocks, nocache):
             self.blocks = blocks
             self.nocache = nocache
@@ -689,6 +704,35 @@ class ArvadosFileReaderTestCase(StreamFileReaderTestCase):
         self.assertEqual(b'12345678', sfile.read(8))
         self.assertEqual(8, sfile.tell())
 
+    def test_readinto(self):
+        expect = self.make_count_reader().read()
+        sfile = self.make_count_reader(nocache=True)
+        buf = bytearray(4)
+        with mock.patch.object(ArvadosFileReader, 'read', side_effect=AssertionError):
+            self.assertEqual(4, sfile.readinto(buf))
+            self.assertEqual(expect[:4], buf)
+            view = memoryview(bytearray(8))
+            self.assertEqual(4, sfile.readinto(view[2:6]))
+            self.assertEqual(expect[4:8], view[2:6].tobytes())
+            self.assertEqual(1, sfile.readinto(buf))
+            self.assertEqual(expect[8:9], buf[:1])
+            self.assertEqual(0, sfile.readinto(buf))
+        self.assertEqual(9, sfile.tell())
+
+    def test_readinto_typed_buffer(self):
+        expect = self.make_count_reader().read(8)
+        ints = array.array('i', [0, 0])
+        self.assertEqual(8, self.make_count_reader(nocache=True).readinto(ints))
+        self.assertEqual(expect, ints.tobytes())
+
+    def test_readinto_from(self):
+        sfile = self.make_count_reader()
+        expect = sfile.read()
+        buf = bytearray(5)
+        self.assertEqual(5, sfile.arvadosfile.readinto_from(2, buf, exact=True))
+        self.assertEqual(expect[2:7], buf)
+        self.assertEqual(0, sfile.arvadosfile.readinto_from(9, buf))
+
     def test_prefetch(self):
         keep = ArvadosFileWriterTestCase.MockKeep({
             "2e9ec317e197819358fbc43afca7d837+8": b"01234567",
@@ -791,6 +835,459 @@ class ArvadosFileTestCase(unittest.TestCase):
             self.assertFalse(f.permission_expired(a_month_ago))
 
 
+class ArvadosFileRangeReadTestCase(unittest.TestCase):
+    class MockKeep(ArvadosFileWriterTestCase.MockKeep):
+        def __init__(self, blocks):
+            super(ArvadosFileRangeReadTestCase.MockKeep, self).__init__(blocks)
+            self.range_requests = []
+        def get_range(self, locator, offset, length, num_retries=0, cache_only=False):
+            if cache_only:
+                return None
+            self.range_requests.append((locator, offset, length))
+            return self.blocks.get(locator)[offset:offset+length]
+
+    LOCATOR = "781e5e245d69b566979b86e28d23f2c7+10"
+
+    def read(self, offset, size, read_policy=None, range_read_max=None):
+        keep = ArvadosFileRangeReadTestCase.MockKeep({self.LOCATOR: b"0123456789"})
+        with Collection('. {} 0:10:count.txt\n'.format(self.LOCATOR),
+                        api_client=ArvadosFileWriterTestCase.MockApi({}, {}),
+                        keep_client=keep, read_policy=read_policy) as c:
+            if range_read_max is not None:
+                c._my_block_manager().range_read_max = range_read_max
+            with c.open("count.txt", "rb") as f:
+                f.seek(offset)
+                return f.read(size), keep
+
+    def test_whole_block_reads_by_default(self):
+        data, keep = self.read(3, 4)
+        self.assertEqual(b"3456", data)
+        self.assertEqual([self.LOCATOR], keep.requests)
+        self.assertEqual([], keep.range_requests)
+
+    def test_range_read(self):
+        data, keep = self.read(3, 4, read_policy=arvados.arvfile._BlockManager.READ_RANGES)
+        self.assertEqual(b"3456", data)
+        self.assertEqual([], keep.requests)
+        self.assertEqual([(self.LOCATOR, 3, 4)], keep.range_requests)
+
+    def test_large_read_fetches_whole_block(self):
+        data, keep = self.read(3, 4, read_policy=arvados.arvfile._BlockManager.READ_RANGES,
+                               range_read_max=2)
+        self.assertEqual(b"3456", data)
+        self.assertEqual([self.LOCATOR], keep.requests)
+        self.assertEqual([], keep.range_requests)
+
+
+class ArvadosFileReadaheadTestCase(unittest.TestCase):
+    class MockKeep(ArvadosFileWriterTestCase.MockKeep):
+        def __init__(self, blocks, cache_max=2**20):
+            super(ArvadosFileReadaheadTestCase.MockKeep, self).__init__(blocks)
+            self.block_cache = arvados.keep.KeepBlockCache(cache_max=cache_max)
+            self.release = threading.Event()
+            self.release.set()
+            self.waiting = threading.Event()
+        def get(self, locator, num_retries=0, view=False):
+            slot, first = self.block_cache.reserve_cache(KeepLocator(locator).md5sum)
+            if first:
+                if not self.release.is_set():
+                    self.waiting.set()
+                self.release.wait()
+                self.requests.append(locator)
+                self.block_cache.set(slot, self.blocks.get(locator))
+            return slot.get()
+        def get_from_cache(self, locator, view=False):
+            slot = self.block_cache.get(KeepLocator(locator).md5sum)
+            if slot is not None and slot.ready.is_set():
+                return slot.get()
+            return None
+
+    def setUp(self):
+        self.data = [str(i).zfill(10).encode() for i in range(40)]
+        self.locators = [tutil.str_keep_locator(d) for d in self.data]
+        patcher = mock.patch('arvados.config.KEEP_BLOCK_SIZE', 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def collection(self, keep):
+        return Collection('. {} 0:{}:count.txt\n'.format(' '.join(self.locators), 10 * len(self.locators)),
+                          api_client=ArvadosFileWriterTestCase.MockApi({}, {}),
+                          keep_client=keep)
+
+    def test_window(self):
+        readahead = arvados.arvfile._Readahead()
+        windows = []
+        for offset in [0, 10, 20, 30, 40, 50, 60, 0, 100, 0, 100, 0, 100, 0]:
+            windows.append(readahead.window(offset))
+            readahead.next_offset = offset + 10
+        self.assertEqual([1, 2, 4, 8, 16, 16, 16, 8, 4, 2, 1, 0, 0, 0], windows)
+        self.assertEqual(1, readahead.window(10))
+
+    def test_sequential_reads_grow_readahead(self):
+        keep = self.MockKeep(dict(zip(self.locators, self.data)))
+        with self.collection(keep) as c:
+            with c.open("count.txt", "rb") as f:
+                for i in range(4):
+                    self.assertEqual(self.data[i], f.read(10))
+                    # Let the prefetches finish before the next read.
+                    c._my_block_manager().stop_threads()
+            stats = c._my_block_manager().prefetch_stats()
+        # Windows of 1, 2, 4 and 8 blocks after the 4 reads.
+        self.assertEqual(set(self.locators[:12]), set(keep.requests))
+        self.assertEqual(11, stats['requests'])
+        self.assertEqual(3, stats['hits'])
+
+    def test_random_reads_stop_readahead(self):
+        keep = self.MockKeep(dict(zip(self.locators, self.data)))
+        with self.collection(keep) as c:
+            with c.open("count.txt", "rb") as f:
+                for offset in [50, 300, 120, 250, 10, 380]:
+                    f.seek(offset)
+                    f.read(10)
+            c._my_block_manager().stop_threads()
+            stats = c._my_block_manager().prefetch_stats()
+        # The first read prefetches one block, the second none.
+        self.assertEqual(1, stats['requests'])
+        self.assertEqual(0, stats['hits'])
+
+    def test_readers_have_own_readahead(self):
+        keep = self.MockKeep(dict(zip(self.locators, self.data)))
+        with self.collection(keep) as c:
+            with c.open("count.txt", "rb") as f, c.open("count.txt", "rb") as g:
+                g.seek(200)
+                for i in range(3):
+                    self.assertEqual(self.data[i], f.read(10))
+                    self.assertEqual(self.data[20+i], g.read(10))
+                # Interleaved sequential reads are still sequential
+                # for each reader.
+                self.assertEqual(4, f._readahead.blocks)
+                self.assertEqual(4, g._readahead.blocks)
+            c._my_block_manager().stop_threads()
+
+    def test_prefetch_limited_by_cache(self):
+        keep = self.MockKeep(dict(zip(self.locators, self.data)), cache_max=40)
+        with arvados.arvfile._BlockManager(keep) as blockmanager:
+            for loc in self.locators[:5]:
+                blockmanager.block_prefetch(loc)
+            blockmanager.stop_threads()
+            self.assertEqual(self.locators[:2], keep.requests)
+            self.assertEqual(self.data[0], blockmanager.get_block_contents(self.locators[0], 0))
+            blockmanager.block_prefetch(self.locators[2])
+            blockmanager.stop_threads()
+            for loc in self.locators[10:14]:
+                keep.get(loc)
+            stats = blockmanager.prefetch_stats()
+        self.assertEqual(3, stats['requests'])
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(2, stats['wasted'])
+        self.assertEqual(0, stats['unread_bytes'])
+
+    def test_prefetch_threads_grow_with_queue(self):
+        keep = self.MockKeep(dict(zip(self.locators, self.data)))
+        keep.release.clear()
+        with arvados.arvfile._BlockManager(keep) as blockmanager:
+            for loc in self.locators:
+                blockmanager.block_prefetch(loc)
+                blockmanager.block_prefetch(loc)
+            stats = blockmanager.prefetch_stats()
+            keep.release.set()
+        self.assertEqual(len(self.locators), stats['requests'])
+        self.assertEqual(blockmanager.max_get_threads, stats['threads'])
+        self.assertEqual(sorted(self.locators), sorted(keep.requests))
+
+    def test_seek_cancels_readahead(self):
+        keep = self.MockKeep(dict(zip(self.locators, self.data)))
+        keep.get(self.locators[30])
+        with self.collection(keep) as c:
+            blockmanager = c._my_block_manager()
+            blockmanager.num_get_threads = blockmanager.max_get_threads = 1
+            with c.open("count.txt", "rb") as f:
+                for i in range(4):
+                    f.read(10)
+                    blockmanager.stop_threads()
+                # The 5th read queues blocks 12-20 (the rest of its
+                # 16-block window is cached), and the prefetch thread
+                # gets stuck on the first.
+                keep.release.clear()
+                f.read(10)
+                keep.waiting.wait()
+                queued = blockmanager.prefetch_stats()['queued']
+                f.seek(300)
+                self.assertEqual(self.data[30], f.read(10))
+                keep.release.set()
+                blockmanager.stop_threads()
+            stats = blockmanager.prefetch_stats()
+        self.assertEqual(8, queued)
+        self.assertEqual(queued, stats['cancelled'])
+        self.assertEqual(0, stats['pending'])
+        self.assertIn(self.locators[12], keep.requests)
+        self.assertNotIn(self.locators[13], keep.requests)
+
+    def test_close_cancels_readahead(self):
+        keep = self.MockKeep(dict(zip(self.locators, self.data)))
+        for loc in self.locators[:3]:
+            keep.get(loc)
+        keep.release.clear()
+        with self.collection(keep) as c:
+            blockmanager = c._my_block_manager()
+            blockmanager.num_get_threads = blockmanager.max_get_threads = 1
+            with c.open("count.txt", "rb") as f:
+                for i in range(3):
+                    f.read(10)
+            keep.release.set()
+            blockmanager.stop_threads()
+            stats = blockmanager.prefetch_stats()
+        self.assertEqual(4, stats['requests'])
+        self.assertGreater(stats['cancelled'], 0)
+        self.assertEqual(stats['requests'], stats['cancelled'] + len(keep.requests) - 3)
+
+
+    def test_close_keeps_other_readers_readahead(self):
+        keep = self.MockKeep(dict(zip(self.locators, self.data)))
+        for loc in self.locators[:3]:
+            keep.get(loc)
+        keep.release.clear()
+        with self.collection(keep) as c:
+            blockmanager = c._my_block_manager()
+            blockmanager.num_get_threads = blockmanager.max_get_threads = 1
+            g = c.open("count.txt", "rb")
+            with c.open("count.txt", "rb") as f:
+                for i in range(3):
+                    f.read(10)
+                    g.read(10)
+                self.assertTrue(keep.waiting.wait(5))
+                queued = blockmanager.prefetch_stats()['queued']
+            # The blocks f queued were queued by g too.
+            cancelled = blockmanager.prefetch_stats()['cancelled']
+            g.close()
+            keep.release.set()
+            blockmanager.stop_threads()
+            stats = blockmanager.prefetch_stats()
+        self.assertGreater(queued, 0)
+        self.assertEqual(0, cancelled)
+        self.assertEqual(queued, stats['cancelled'])
+
+
+class PrefetchQueueTest(unittest.TestCase):
+    def test_priority_order(self):
+        q = arvados.arvfile._PrefetchQueue(10)
+        q.push('a', q.READAHEAD)
+        q.push('b', q.READAHEAD)
+        q.push('c', q.DEMAND)
+        q.push('b', q.DEMAND)
+        q.push('a', q.READAHEAD)
+        self.assertEqual(3, len(q))
+        self.assertEqual(['c', 'b', 'a', None], [q.pop() for _ in range(4)])
+
+    def test_bounded(self):
+        q = arvados.arvfile._PrefetchQueue(2)
+        self.assertEqual([], q.push('a', q.READAHEAD))
+        self.assertEqual([], q.push('b', q.READAHEAD))
+        self.assertEqual([], q.push('c', q.READAHEAD))
+        self.assertNotIn('c', q)
+        self.assertEqual(['b'], q.push('d', q.DEMAND))
+        self.assertEqual(['a'], q.push('e', q.DEMAND))
+        self.assertEqual([], q.push('f', q.DEMAND))
+        self.assertNotIn('f', q)
+        self.assertEqual(['d', 'e', None], [q.pop() for _ in range(3)])
+
+    def test_cancel(self):
+        q = arvados.arvfile._PrefetchQueue(10)
+        reader1, reader2 = object(), object()
+        for i in range(5):
+            q.push(str(i), q.READAHEAD, reader1 if i % 2 else reader2)
+        self.assertEqual(['1', '3'], sorted(q.cancel(reader1)))
+        self.assertEqual([], q.cancel(reader1))
+        self.assertTrue(q.remove('2'))
+        self.assertFalse(q.remove('2'))
+        self.assertEqual(['0', '4', None], [q.pop() for _ in range(3)])
+
+    def test_cancel_shared_blocks(self):
+        q = arvados.arvfile._PrefetchQueue(10)
+        reader1, reader2 = object(), object()
+        q.push('a', q.READAHEAD, reader1)
+        q.push('a', q.READAHEAD, reader2)
+        q.push('b', q.READAHEAD, reader1)
+        q.push('b', q.DEMAND, reader2)
+        q.push('c', q.READAHEAD, reader1)
+        q.push('c', q.READAHEAD)
+        self.assertEqual([], q.cancel(reader1))
+        self.assertEqual(['a', 'b'], sorted(q.cancel(reader2)))
+        self.assertEqual(['c', None], [q.pop() for _ in range(2)])
+
+    def test_heap_compacted(self):
+        q = arvados.arvfile._PrefetchQueue(4)
+        for i in range(100):
+            q.push(str(i), q.READAHEAD)
+            q.remove(str(i))
+        self.assertLessEqual(len(q._heap), 8)
+        self.assertEqual(0, len(q))
+
+
+class BufferPoolTest(unittest.TestCase):
+    def bufferblock(self, pool, size):
+        bufferblock = arvados.arvfile._BufferBlock('bufferblock', 16, None, pool)
+        bufferblock.append(b'x' * size)
+        return bufferblock
+
+    def test_small_blocks_not_pooled(self):
+        pool = arvados.arvfile._BufferPool(1024, 2)
+        bufferblock = self.bufferblock(pool, 32)
+        self.assertLess(len(bufferblock.buffer_block), 1024)
+        bufferblock.set_state(arvados.arvfile._BufferBlock.PENDING)
+        bufferblock.set_state(arvados.arvfile._BufferBlock.COMMITTED, 'loc')
+        self.assertEqual({'allocated': 0, 'reused': 0, 'idle': 0}, pool.stats())
+
+    def test_buffers_reused(self):
+        pool = arvados.arvfile._BufferPool(1024, 2)
+        for i in range(5):
+            bufferblock = self.bufferblock(pool, 1000)
+            self.assertEqual(1024, len(bufferblock.buffer_block))
+            self.assertEqual(b'x' * 1000, bufferblock.buffer_view[0:1000].tobytes())
+            bufferblock.set_state(arvados.arvfile._BufferBlock.PENDING)
+            bufferblock.set_state(arvados.arvfile._BufferBlock.COMMITTED, 'loc')
+            self.assertIsNone(bufferblock.buffer_block)
+        self.assertEqual({'allocated': 1, 'reused': 4, 'idle': 1}, pool.stats())
+
+    def test_only_own_buffers_adopted(self):
+        pool = arvados.arvfile._BufferPool(1024, 2)
+        pool.put(bytearray(1024))
+        pool.put(mmap.mmap(-1, 1024))
+        self.assertEqual(0, pool.stats()['idle'])
+        buf = pool.get()
+        self.assertTrue(pool.owns(buf))
+        self.assertFalse(pool.owns(bytearray(1024)))
+        pool.put(buf)
+        self.assertEqual(1, pool.stats()['idle'])
+
+    def test_padding_block_not_pooled(self):
+        mockkeep = mock.MagicMock()
+        with mock.patch('arvados.config.KEEP_BLOCK_SIZE', 2**16), \
+             arvados.arvfile._BlockManager(mockkeep) as blockmanager:
+            blockmanager.get_padding_block().wait_for_commit.wait()
+            self.assertEqual(0, blockmanager.buffer_pool.stats()['idle'])
+
+    def test_pool_size_capped(self):
+        pool = arvados.arvfile._BufferPool(1024, 2)
+        bufferblocks = [self.bufferblock(pool, 1000) for _ in range(4)]
+        for bufferblock in bufferblocks:
+            bufferblock.clear()
+        self.assertEqual({'allocated': 4, 'reused': 0, 'idle': 2}, pool.stats())
+        pool.clear()
+        self.assertEqual(0, pool.stats()['idle'])
+
+    def test_readers_get_copies(self):
+        pool = arvados.arvfile._BufferPool(1024, 2)
+        bufferblock = self.bufferblock(pool, 1000)
+        data = bufferblock.contents(0, 1000)
+        bufferblock.clear()
+        self.assertEqual(1, pool.stats()['idle'])
+        self.bufferblock(pool, 1000).append(b'y' * 24)
+        self.assertEqual(b'x' * 1000, data)
+        self.assertIsNone(bufferblock.contents(0, 1000))
+
+    def test_buffer_in_upload_not_reused(self):
+        pool = arvados.arvfile._BufferPool(1024, 2)
+        bufferblock = self.bufferblock(pool, 1000)
+        bufferblock.set_state(arvados.arvfile._BufferBlock.PENDING)
+        bufferblock.clear()
+        self.assertEqual(0, pool.stats()['idle'])
+
+    def test_repack_returns_old_buffer(self):
+        pool = arvados.arvfile._BufferPool(1024, 2)
+        bufferblock = self.bufferblock(pool, 100)
+        bufferblock.append(b'y' * 900)
+        owner = mock.MagicMock()
+        owner.segments.return_value = [Range(bufferblock.blockid, 0, 900, 100)]
+        bufferblock.owner = owner
+        bufferblock.repack_writes()
+        self.assertEqual(b'y' * 900, bufferblock.buffer_view[0:bufferblock.size()].tobytes())
+        self.assertEqual({'allocated': 2, 'reused': 0, 'idle': 1}, pool.stats())
+
+    def test_mmap_buffers(self):
+        pool = arvados.arvfile._BufferPool(1024, 2, use_mmap=True)
+        bufferblock = self.bufferblock(pool, 1000)
+        self.assertIsInstance(bufferblock.buffer_block, mmap.mmap)
+        self.assertEqual(hashlib.md5(b'x' * 1000).hexdigest() + '+1000',
+                         bufferblock.locator())
+        bufferblock.clear()
+        self.assertEqual(1, pool.stats()['idle'])
+
+    def test_padding_block_zeros(self):
+        mockkeep = mock.MagicMock()
+        with arvados.arvfile._BlockManager(mockkeep) as blockmanager:
+            blockmanager.get_padding_block().wait_for_commit.wait()
+            data = mockkeep.put.call_args[0][0]
+            self.assertEqual(arvados.config.KEEP_BLOCK_SIZE, len(data))
+            self.assertEqual(b'\0' * 4096, bytes(data[-4096:]))
+
+
+class BufferPoolKeepTest(keepstub.StubKeepServers, unittest.TestCase):
+    def test_buffers_reused_after_put(self):
+        keep_client = arvados.KeepClient(api_client=self.api_client)
+        with mock.patch('arvados.config.KEEP_BLOCK_SIZE', 2**16):
+            blockmanager = arvados.arvfile._BlockManager(keep_client, copies=1)
+        with blockmanager:
+            locators = []
+            for sync in (True, False, True, False):
+                bufferblock = blockmanager.alloc_bufferblock()
+                data = os.urandom(60000)
+                bufferblock.append(data)
+                blockmanager.commit_bufferblock(bufferblock, sync)
+                bufferblock.wait_for_commit.wait()
+                self.assertEqual(arvados.arvfile._BufferBlock.COMMITTED, bufferblock.state())
+                locators.append((bufferblock.locator(), data))
+            self.assertEqual({'allocated': 1, 'reused': 3, 'idle': 1},
+                             blockmanager.buffer_pool.stats())
+        for locator, data in locators:
+            self.assertEqual(data, self.server.store[locator.split('+')[0]])
+
+
+class BlockManagerCachedReadTest(unittest.TestCase, tutil.ApiClientMock):
+    def setUp(self):
+        self.keep_client = arvados.KeepClient(api_client=self.mock_keep_services(count=1))
+        self.data = bytearray(os.urandom(4096))
+        self.locator = tutil.str_keep_locator(bytes(self.data))
+        slot, first = self.keep_client.block_cache.reserve_cache(KeepLocator(self.locator).md5sum)
+        self.keep_client.block_cache.set(slot, self.data)
+
+    def test_reads_view_cached_block(self):
+        with arvados.arvfile._BlockManager(self.keep_client) as blockmanager:
+            for cache_only in (False, True):
+                block = blockmanager.get_block_contents(self.locator, 0, cache_only=cache_only)
+                self.assertIs(self.data, block.obj)
+                block = blockmanager.get_block_range(self.locator, 10, 20, 0, cache_only=cache_only)
+                self.assertIs(self.data, block.obj)
+                self.assertEqual(self.data[10:30], block.tobytes())
+
+    def test_readinto_copies_once(self):
+        coll = Collection('. {} 0:4096:f\n'.format(self.locator),
+                          api_client=ArvadosFileWriterTestCase.MockApi({}, {}),
+                          keep_client=self.keep_client)
+        buf = bytearray(1000)
+        with mock.patch('arvados.keep._block_result', wraps=arvados.keep._block_result) as block_result:
+            with coll.open('f', 'rb') as f:
+                f.seek(100)
+                self.assertEqual(1000, f.readinto(buf))
+        self.assertEqual(self.data[100:1100], buf)
+        # The block is only read through views; readinto() makes the
+        # one copy, into buf.
+        self.assertTrue(block_result.called)
+        for (blob, view), _ in block_result.call_args_list:
+            self.assertIs(self.data, blob)
+            self.assertTrue(view)
+
+    def test_prefetch_checks_cache_without_reading(self):
+        with arvados.arvfile._BlockManager(self.keep_client) as blockmanager:
+            with mock.patch.object(self.keep_client, 'get') as get, \
+                 mock.patch.object(self.keep_client, 'get_from_cache') as get_from_cache:
+                blockmanager.block_prefetch(self.locator)
+                blockmanager.stop_threads()
+            get.assert_not_called()
+            get_from_cache.assert_not_called()
+            self.assertEqual(0, blockmanager.prefetch_stats()['requests'])
+
+
 class BlockManagerTest(unittest.TestCase):
     def test_bufferblock_append(self):
         keep = ArvadosFileWriterTestCase.MockKeep({})
@@ -892,3 +1389,60 @@ class BlockManagerTest(unittest.TestCase):
             self.assertTrue(bufferblock.owner.flush.called)
             self.assertEqual(str(err.exception), "Error writing some blocks: block acbd18db4cc2f85cedef654fccc4a4d8+3 raised KeepWriteError (fail)")
             self.assertEqual(bufferblock.state(), arvados.arvfile._BufferBlock.ERROR)
+
+    def blocked_put_manager(self, max_pending_bytes):
+        # A block manager with one put thread, whose uploads wait for
+        # self.release to be set.
+        self.release = threading.Event()
+        mockkeep = mock.MagicMock()
+        def put(data, **kwargs):
+            self.release.wait()
+            return hashlib.md5(data).hexdigest() + '+' + str(len(data))
+        mockkeep.put.side_effect = put
+        return arvados.arvfile._BlockManager(
+            mockkeep, put_threads=1, max_pending_bytes=max_pending_bytes)
+
+    def queue_block(self, blockmanager, size):
+        bufferblock = blockmanager.alloc_bufferblock()
+        bufferblock.append(b'x' * size)
+        blockmanager.commit_bufferblock(bufferblock, False)
+        return bufferblock
+
+    def test_put_budget_counts_bytes(self):
+        with self.blocked_put_manager(1000) as blockmanager:
+            bufferblocks = [self.queue_block(blockmanager, 50) for _ in range(10)]
+            stats = blockmanager.put_stats()
+            self.assertEqual(500, stats['pending_bytes'])
+            self.assertEqual(0, stats['budget_waits'])
+            self.release.set()
+            for bufferblock in bufferblocks:
+                bufferblock.wait_for_commit.wait()
+            blockmanager.stop_threads()
+            stats = blockmanager.put_stats()
+            self.assertEqual(0, stats['pending_bytes'])
+            self.assertEqual(10, stats['blocks'])
+            self.assertEqual(500, stats['bytes'])
+
+    def test_put_budget_exhausted(self):
+        with self.blocked_put_manager(100) as blockmanager:
+            self.queue_block(blockmanager, 60)
+            writer = threading.Thread(target=self.queue_block, args=(blockmanager, 60))
+            writer.start()
+            writer.join(0.2)
+            self.assertTrue(writer.is_alive())
+            self.assertEqual(1, blockmanager.put_stats()['budget_waits'])
+            self.release.set()
+            writer.join(5)
+            self.assertFalse(writer.is_alive())
+            blockmanager.stop_threads()
+            stats = blockmanager.put_stats()
+            self.assertEqual(2, stats['blocks'])
+            self.assertGreater(stats['budget_wait_seconds'], 0)
+
+    def test_put_block_bigger_than_budget(self):
+        with self.blocked_put_manager(10) as blockmanager:
+            bufferblock = self.queue_block(blockmanager, 100)
+            self.assertEqual(100, blockmanager.put_stats()['pending_bytes'])
+            self.release.set()
+            bufferblock.wait_for_commit.wait()
+            self.assertEqual(arvados.arvfile._BufferBlock.COMMITTED, bufferblock.state())
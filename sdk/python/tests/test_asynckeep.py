@@ -0,0 +1,9 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import sys
+
+# The test cases use Python 3.5 syntax, like arvados.asynckeep.
+if sys.version_info >= (3, 5):
+    from .asynckeep_cases import AsyncKeepClientTestCase
@@ -0,0 +1,199 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import absolute_import
+
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import arvados.diskcache
+import arvados.errors
+import arvados.keep
+
+
+def _block(n, fill=b'x'):
+    data = fill * n
+    return hashlib.md5(data).hexdigest(), data
+
+
+class DiskCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_set_and_get(self):
+        c = arvados.diskcache.DiskCache(self._dir, 1000)
+        loc, data = _block(10)
+        self.assertIsNone(c.get(loc))
+        self.assertTrue(c.set(loc, data))
+        self.assertEqual(data, c.get(loc)[:])
+        self.assertTrue(os.path.exists(os.path.join(self._dir, loc[0:3], loc)))
+
+    def test_empty_block(self):
+        c = arvados.diskcache.DiskCache(self._dir, 1000)
+        loc, data = _block(0)
+        c.set(loc, data)
+        self.assertEqual(b'', c.get(loc))
+
+    def test_evict_least_recently_used(self):
+        c = arvados.diskcache.DiskCache(self._dir, 30)
+        blocks = [_block(10, fill) for fill in (b'a', b'b', b'c', b'd')]
+        for loc, data in blocks[:3]:
+            c.set(loc, data)
+        c.get(blocks[0][0])
+        c.set(*blocks[3])
+        self.assertIsNone(c.get(blocks[1][0]))
+        for loc, data in (blocks[0], blocks[2], blocks[3]):
+            self.assertEqual(data, c.get(loc)[:])
+        self.assertEqual(30, c.cache_total)
+
+    def test_reopen_finds_existing_blocks(self):
+        loc, data = _block(10)
+        arvados.diskcache.DiskCache(self._dir, 1000).set(loc, data)
+        c = arvados.diskcache.DiskCache(self._dir, 1000)
+        self.assertEqual(10, c.cache_total)
+        self.assertEqual(data, c.get(loc)[:])
+
+    def test_reopen_with_smaller_budget_evicts(self):
+        old = arvados.diskcache.DiskCache(self._dir, 1000)
+        for fill in (b'a', b'b', b'c'):
+            old.set(*_block(10, fill))
+        c = arvados.diskcache.DiskCache(self._dir, 15)
+        self.assertEqual(10, c.cache_total)
+
+    def test_mapped_block_survives_eviction(self):
+        c = arvados.diskcache.DiskCache(self._dir, 10)
+        loc, data = _block(10, b'a')
+        c.set(loc, data)
+        mapped = c.get(loc)
+        c.set(*_block(10, b'b'))
+        self.assertIsNone(c.get(loc))
+        self.assertEqual(data, mapped[:])
+
+
+    def test_small_blocks_read_into_memory(self):
+        c = arvados.diskcache.DiskCache(self._dir, 2**22)
+        small_loc, small = _block(10)
+        big_loc, big = _block(c.MMAP_MIN_SIZE)
+        c.set(small_loc, small)
+        c.set(big_loc, big)
+        self.assertEqual(small, c.get(small_loc))
+        self.assertIsInstance(c.get(small_loc), bytes)
+        self.assertIsInstance(c.get(big_loc), mmap.mmap)
+
+    def test_corrupt_block_removed(self):
+        c = arvados.diskcache.DiskCache(self._dir, 1000)
+        loc, data = _block(10)
+        c.set(loc, data)
+        path = os.path.join(self._dir, loc[0:3], loc)
+        with open(path, 'wb') as f:
+            f.write(b'x' * 5)
+        self.assertIsNone(c.get(loc))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(0, c.cache_total)
+
+    def test_instances_share_budget(self):
+        a = arvados.diskcache.DiskCache(self._dir, 30)
+        b = arvados.diskcache.DiskCache(self._dir, 30)
+        blocks = [_block(10, fill) for fill in (b'a', b'b', b'c', b'd')]
+        a.set(*blocks[0])
+        a.set(*blocks[1])
+        b.set(*blocks[2])
+        self.assertEqual(30, a.cache_total)
+        b.set(*blocks[3])
+        self.assertEqual(30, a.cache_total)
+        self.assertEqual(3, sum(1 for loc, _ in blocks if a.get(loc) is not None))
+
+
+class SharedMemoryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_instances_share_blocks_and_total(self):
+        a = arvados.diskcache.SharedMemoryCache(self._dir, 1000)
+        b = arvados.diskcache.SharedMemoryCache(self._dir, 1000)
+        loc, data = _block(10)
+        self.assertTrue(a.set(loc, data))
+        self.assertEqual(data, b.get(loc)[:])
+        b.set(*_block(20, b'y'))
+        self.assertEqual(30, a.cache_total)
+        self.assertEqual(30, b.cache_total)
+
+    def test_same_block_counted_once(self):
+        a = arvados.diskcache.SharedMemoryCache(self._dir, 1000)
+        b = arvados.diskcache.SharedMemoryCache(self._dir, 1000)
+        loc, data = _block(10)
+        a.set(loc, data)
+        b.set(loc, data)
+        self.assertEqual(10, a.cache_total)
+
+    def test_evict_least_recently_used_across_instances(self):
+        a = arvados.diskcache.SharedMemoryCache(self._dir, 30)
+        b = arvados.diskcache.SharedMemoryCache(self._dir, 30)
+        blocks = [_block(10, fill) for fill in (b'a', b'b', b'c', b'd')]
+        for loc, data in blocks[:3]:
+            a.set(loc, data)
+            # Leave room for coarse filesystem timestamps.
+            time.sleep(0.02)
+        b.get(blocks[0][0])
+        time.sleep(0.02)
+        b.set(*blocks[3])
+        self.assertIsNone(a.get(blocks[1][0]))
+        for loc, data in (blocks[0], blocks[3]):
+            self.assertEqual(data, a.get(loc)[:])
+        self.assertLessEqual(a.cache_total, 27)
+
+    def test_reopen_recounts_total(self):
+        a = arvados.diskcache.SharedMemoryCache(self._dir, 1000)
+        a.set(*_block(10))
+        os.unlink(os.path.join(self._dir, 'total'))
+        b = arvados.diskcache.SharedMemoryCache(self._dir, 1000)
+        self.assertEqual(10, b.cache_total)
+
+    def test_block_cache_keeps_shared_maps(self):
+        size = arvados.diskcache.DiskCache.MMAP_MIN_SIZE
+        cache = arvados.keep.KeepBlockCache(shared_cache_dir=self._dir,
+                                            shared_cache_max=2 * size)
+        loc, data = _block(size)
+        slot, first = cache.reserve_cache(loc)
+        self.assertTrue(first)
+        cache.set(slot, data)
+        self.assertIsInstance(slot.content, mmap.mmap)
+        self.assertEqual(data, cache.get(loc).get()[:])
+        other = arvados.keep.KeepBlockCache(shared_cache_dir=self._dir,
+                                            shared_cache_max=2 * size)
+        self.assertEqual(data, other.get_from_disk(loc)[:])
+
+    def test_block_cache_copies_small_shared_blocks(self):
+        cache = arvados.keep.KeepBlockCache(shared_cache_dir=self._dir,
+                                            shared_cache_max=1000)
+        loc, data = _block(10)
+        slot, first = cache.reserve_cache(loc)
+        cache.set(slot, data)
+        self.assertIs(data, slot.content)
+        self.assertEqual(data, cache.get_from_disk(loc))
+
+    def test_corrupt_block_removed(self):
+        a = arvados.diskcache.SharedMemoryCache(self._dir, 1000)
+        loc, data = _block(10)
+        a.set(loc, data)
+        with open(os.path.join(self._dir, loc[0:3], loc), 'wb') as f:
+            f.write(b'y' * 10)
+        self.assertIsNone(a.get(loc))
+        self.assertFalse(os.path.exists(os.path.join(self._dir, loc[0:3], loc)))
+        self.assertEqual(0, a.cache_total)
+
+    def test_shared_and_disk_cache_conflict(self):
+        with self.assertRaises(arvados.errors.ArgumentError):
+            arvados.keep.KeepBlockCache(disk_cache=True, shared_cache_dir=self._dir)
@@ -10,13 +10,17 @@ from builtins import str
 from builtins import range
 from builtins import object
 import hashlib
+import mmap
 import mock
 import os
 import pycurl
 import random
 import re
+import shutil
 import socket
 import sys
+import tempfile
+import threading
 import time
 import unittest
 import urllib.parse
@@ -28,6 +32,11 @@ from . import arvados_testutil as tutil
 from . import keepstub
 from . import run_test_server
 
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
 class KeepTestCase(run_test_server.TestCaseWithServers):
     MAIN_SERVER = {}
     KEEP_SERVER = {}
@@ -296,6 +305,30 @@ class KeepClientServiceTestCase(unittest.TestCase, tutil.ApiClientMock):
             self.assertEqual("HEAD", kwargs['method'])
             self.assertIn('X-Keep-Signature', kwargs['headers'])
 
+    def test_head_many_refresh_signatures(self):
+        blk_digest = '6f5902ac237024bdd0c176cb93063dc4+11'
+        blk_sig = 'da39a3ee5e6b4b0d3255bfef95601890afd80709@53bed294'
+        local_loc = blk_digest+'+A'+blk_sig
+        remote_loc = blk_digest+'+R'+blk_sig
+        api_client = self.mock_keep_services(count=1)
+        with tutil.mock_keep_responses('', 200, 200, **{'X-Keep-Locator': local_loc}) as mock:
+            keep_client = arvados.KeepClient(api_client=api_client)
+            results = keep_client.head_many([remote_loc, remote_loc], refresh_signatures=True)
+        self.assertEqual([(arvados.KeepClient.HEAD_PRESENT, local_loc)] * 2, results)
+        for resp in mock.responses:
+            self.assertIn('X-Keep-Signature: local, ',
+                          ' '.join(resp.getopt(pycurl.HTTPHEADER)))
+
+    def test_head_many_reports_errors(self):
+        api_client = self.mock_keep_services(count=1)
+        with tutil.mock_keep_responses('', 500):
+            keep_client = arvados.KeepClient(api_client=api_client)
+            results = keep_client.head_many(['acbd18db4cc2f85cedef654fccc4a4d8+3'],
+                                            num_retries=0)
+        self.assertEqual(arvados.KeepClient.HEAD_ERROR, results[0].status)
+        self.assertIsInstance(results[0].value, arvados.errors.KeepReadError)
+        self.assertNotIsInstance(results[0].value, arvados.errors.NotFoundError)
+
     # test_*_timeout verify that KeepClient instructs pycurl to use
     # the appropriate connection and read timeouts. They don't care
     # whether pycurl actually exhibits the expected timeout behavior
@@ -335,6 +368,22 @@ class KeepClientServiceTestCase(unittest.TestCase, tutil.ApiClientMock):
                 mock.responses[0].getopt(pycurl.LOW_SPEED_LIMIT),
                 int(arvados.KeepClient.DEFAULT_TIMEOUT[2]))
 
+    def test_throttled_get_timeout(self):
+        api_client = self.mock_keep_services(count=1)
+        force_timeout = socket.timeout("timed out")
+        with tutil.mock_keep_responses(force_timeout, 0) as mock:
+            keep_client = arvados.KeepClient(api_client=api_client,
+                                             max_bytes_per_second=10000)
+            with self.assertRaises(arvados.errors.KeepReadError):
+                keep_client.get('ffffffffffffffffffffffffffffffff')
+            # A transfer throttled below the timeout's minimum
+            # bandwidth can still be aborted if it stalls.
+            self.assertEqual(
+                mock.responses[0].getopt(pycurl.LOW_SPEED_LIMIT), 5000)
+            self.assertGreaterEqual(
+                mock.responses[0].getopt(pycurl.LOW_SPEED_TIME),
+                int(arvados.KeepClient.DEFAULT_TIMEOUT[1]))
+
     def test_head_timeout(self):
         api_client = self.mock_keep_services(count=1)
         force_timeout = socket.timeout("timed out")
@@ -512,6 +561,16 @@ class KeepClientCacheTestCase(unittest.TestCase, tutil.ApiClientMock):
         # Request already cached, don't require more than one request
         get_mock.assert_called_once()
 
+    def test_cache_hits_counted_once(self):
+        cache = self.keep_client.block_cache
+        with tutil.mock_keep_responses(self.data, 200, 200):
+            for _ in range(100):
+                self.assertEqual(self.data, self.keep_client.get(self.locator))
+        self.assertEqual(len(self.data), cache.cache_total)
+        self.assertEqual(sum(slot.size() for slot in cache._cache.values()),
+                         cache.cache_total)
+        self.assertEqual(0, cache.evictions)
+
     @mock.patch('arvados.KeepClient.KeepService.get')
     def test_head_request_cache(self, get_mock):
         with tutil.mock_keep_responses(self.data, 200, 200):
@@ -533,6 +592,116 @@ class KeepClientCacheTestCase(unittest.TestCase, tutil.ApiClientMock):
         self.assertNotEqual(head_resp, get_resp)
 
 
+class KeepBlockCacheTestCase(unittest.TestCase):
+    def fill(self, cache, locator, content):
+        slot, first = cache.reserve_cache(locator)
+        self.assertTrue(first)
+        cache.set(slot, content)
+        return slot
+
+    def test_reserve_returns_existing_slot(self):
+        cache = arvados.keep.KeepBlockCache(cache_max=100)
+        slot = self.fill(cache, 'a', b'x')
+        got, first = cache.reserve_cache('a')
+        self.assertFalse(first)
+        self.assertIs(slot, got)
+        self.assertEqual(b'x', got.get())
+
+    def test_set_filled_slot_ignored(self):
+        cache = arvados.keep.KeepBlockCache(cache_max=100)
+        slot = self.fill(cache, 'a', b'x' * 10)
+        cache.set(slot, b'y' * 20)
+        self.assertEqual(b'x' * 10, slot.get())
+        self.assertEqual(10, cache.cache_total)
+
+    def test_evict_least_recently_used(self):
+        cache = arvados.keep.KeepBlockCache(cache_max=30)
+        for loc in 'abc':
+            self.fill(cache, loc, b'x' * 10)
+        self.assertEqual(30, cache.cache_total)
+        # Touch 'a' so 'b' becomes the least recently used slot.
+        cache.get('a')
+        self.fill(cache, 'd', b'x' * 10)
+        self.assertIsNone(cache.get('b'))
+        for loc in 'acd':
+            self.assertIsNotNone(cache.get(loc))
+        self.assertEqual(30, cache.cache_total)
+
+    def test_pending_slots_are_not_evicted(self):
+        cache = arvados.keep.KeepBlockCache(cache_max=10)
+        pending, _ = cache.reserve_cache('a')
+        self.fill(cache, 'b', b'x' * 10)
+        self.fill(cache, 'c', b'x' * 10)
+        self.assertIs(pending, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        cache.set(pending, b'x' * 5)
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(5, cache.cache_total)
+
+    def test_failed_slot_is_dropped(self):
+        cache = arvados.keep.KeepBlockCache(cache_max=100)
+        slot = self.fill(cache, 'a', None)
+        self.assertIsNone(slot.get())
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(0, cache.cache_total)
+
+
+@tutil.skip_sleep
+class KeepClientDiskCacheTestCase(unittest.TestCase, tutil.ApiClientMock):
+    def setUp(self):
+        self.disk_cache_dir = tempfile.mkdtemp()
+        self.api_client = self.mock_keep_services(count=2)
+        self.data = b'xyzzy'
+        self.locator = '1271ed5ef305aadabc605b1609e24c52'
+
+    def tearDown(self):
+        shutil.rmtree(self.disk_cache_dir)
+
+    def new_client(self):
+        return arvados.KeepClient(
+            api_client=self.api_client,
+            block_cache=arvados.keep.KeepBlockCache(
+                disk_cache_dir=self.disk_cache_dir))
+
+    def test_disk_cache_shared_between_clients(self):
+        with tutil.mock_keep_responses(self.data, 200) as mock:
+            self.assertEqual(self.data, self.new_client().get(self.locator))
+        self.assertEqual(1, mock.call_count)
+        # A new client (e.g., in a new process) finds the block on disk
+        # without making any requests.
+        keep_client = self.new_client()
+        with tutil.mock_keep_responses(self.data, 500) as mock:
+            self.assertEqual(self.data, keep_client.get(self.locator)[:])
+        self.assertEqual(0, mock.call_count)
+        self.assertEqual(1, keep_client.hits_counter.get())
+
+    def test_failed_read_not_written_to_disk(self):
+        with tutil.mock_keep_responses(self.data, 404, 404):
+            with self.assertRaises(arvados.errors.NotFoundError):
+                self.new_client().get(self.locator)
+        self.assertIsNone(arvados.diskcache.DiskCache(self.disk_cache_dir).get(self.locator))
+
+    def test_slot_filled_before_disk_write(self):
+        keep_client = self.new_client()
+        disk_cache = keep_client.block_cache.disk_cache
+        slot_ready = []
+        def disk_set(locator, content):
+            slot_ready.append(keep_client.block_cache.get(locator).ready.is_set())
+            return True
+        with mock.patch.object(disk_cache, 'set', side_effect=disk_set), \
+             tutil.mock_keep_responses(self.data, 200):
+            keep_client.get(self.locator)
+        self.assertEqual([True], slot_ready)
+
+    def test_disk_hit_not_written_again(self):
+        with tutil.mock_keep_responses(self.data, 200):
+            self.new_client().get(self.locator)
+        keep_client = self.new_client()
+        with mock.patch.object(keep_client.block_cache.disk_cache, 'set') as disk_set:
+            self.assertEqual(self.data, keep_client.get(self.locator))
+        self.assertFalse(disk_set.called)
+
+
 @tutil.skip_sleep
 class KeepXRequestIdTestCase(unittest.TestCase, tutil.ApiClientMock):
     def setUp(self):
@@ -758,6 +927,775 @@ class KeepClientRendezvousTestCase(unittest.TestCase, tutil.ApiClientMock):
     def test_put_error_shows_probe_order(self):
         self.check_64_zeros_error_order('put', arvados.errors.KeepWriteError)
 
+    def test_service_order_is_cached(self):
+        locator = arvados.KeepLocator(self.hashes[0])
+        expected = self.keep_client.weighted_service_roots(locator)
+        with mock.patch.object(self.keep_client, '_service_weight') as weight:
+            self.assertEqual(expected, self.keep_client.weighted_service_roots(locator))
+            self.assertFalse(weight.called)
+
+    def test_service_order_cache_is_bounded(self):
+        self.keep_client.SERVICE_ROOTS_CACHE_SIZE = 2
+        for h in self.hashes:
+            self.keep_client.weighted_service_roots(arvados.KeepLocator(h))
+        self.assertEqual(2, len(self.keep_client._service_roots_cache))
+
+    def test_service_order_cache_reset_by_rebuild(self):
+        locator = arvados.KeepLocator(self.hashes[0])
+        self.assertEqual(self.services,
+                         len(self.keep_client.weighted_service_roots(locator)))
+        self.mock_keep_services(self.api_client, count=self.services+1)
+        self.assertEqual(self.services+1,
+                         len(self.keep_client.weighted_service_roots(locator, force_rebuild=True)))
+
+
+@tutil.skip_sleep
+class KeepGetResultTestCase(unittest.TestCase, tutil.ApiClientMock):
+    def setUp(self):
+        self.keep_client = arvados.KeepClient(api_client=self.mock_keep_services(count=2))
+        self.data = b'xyzzy'
+        self.locator = '1271ed5ef305aadabc605b1609e24c52+5'
+
+    def test_get_returns_bytes(self):
+        with tutil.mock_keep_responses(self.data, 200):
+            blob = self.keep_client.get(self.locator)
+        self.assertIsInstance(blob, bytes)
+        self.assertEqual(self.data, blob)
+        self.assertIsInstance(self.keep_client.get(self.locator), bytes)
+        self.assertIsInstance(self.keep_client.get_from_cache(self.locator), bytes)
+
+    def test_get_view_is_read_only(self):
+        with tutil.mock_keep_responses(self.data, 200):
+            view = self.keep_client.get(self.locator, view=True)
+        self.assertIsInstance(view, memoryview)
+        self.assertTrue(view.readonly)
+        with self.assertRaises(TypeError):
+            view[0:1] = b'!'
+        self.assertEqual(self.data, self.keep_client.get(self.locator))
+        self.assertTrue(self.keep_client.get_from_cache(self.locator, view=True).readonly)
+
+
+class KeepResponseBodyTestCase(unittest.TestCase):
+    def receive(self, chunks, headers={}, size_hint=None):
+        body = arvados.keep._ResponseBody(dict(headers), size_hint)
+        for chunk in chunks:
+            body.write(chunk)
+        return body
+
+    def test_preallocated_from_content_length(self):
+        body = self.receive([b'foo', b'bar'], {'content-length': '6'})
+        self.assertEqual(b'foobar', body.getvalue())
+        self.assertEqual(hashlib.md5(b'foobar').hexdigest(), body.md5.hexdigest())
+
+    def test_preallocated_from_size_hint(self):
+        body = self.receive([b'foo', b'bar'], size_hint=6)
+        self.assertEqual(b'foobar', body.getvalue())
+
+    def test_longer_than_expected(self):
+        body = self.receive([b'foo', b'bar'], size_hint=4)
+        self.assertEqual(b'foobar', body.getvalue())
+
+    def test_shorter_than_expected(self):
+        body = self.receive([b'foo'], {'content-length': '6'})
+        self.assertEqual(b'foo', body.getvalue())
+
+    def test_empty(self):
+        self.assertEqual(b'', self.receive([], size_hint=6).getvalue())
+
+    def test_huge_size_hint_is_capped(self):
+        body = self.receive([b'foo'], size_hint=2**40)
+        self.assertEqual(b'foo', body.getvalue())
+
+
+class KeepUserAgentPoolTestCase(unittest.TestCase):
+    def test_reuse_most_recently_used(self):
+        pool = arvados.keep._UserAgentPool()
+        ua1, ua2 = mock.Mock(), mock.Mock()
+        pool.put(ua1)
+        pool.put(ua2)
+        self.assertIs(ua2, pool.get())
+        self.assertIs(ua1, pool.get())
+
+    def test_close_beyond_max_idle(self):
+        pool = arvados.keep._UserAgentPool(max_idle=2)
+        uas = [mock.Mock() for _ in range(3)]
+        for ua in uas:
+            pool.put(ua)
+        uas[0].close.assert_called_once_with()
+        self.assertIs(uas[2], pool.get())
+        self.assertIs(uas[1], pool.get())
+
+    def test_close_idle_handles(self):
+        pool = arvados.keep._UserAgentPool(idle_timeout=60)
+        ua = mock.Mock()
+        with mock.patch('time.time', return_value=1000):
+            pool.put(ua)
+        with mock.patch('time.time', return_value=1061), \
+             mock.patch('pycurl.Curl') as curl_mock:
+            self.assertIs(curl_mock.return_value, pool.get())
+        ua.close.assert_called_once_with()
+
+    def test_pool_per_service(self):
+        keep_client = arvados.KeepClient(api_client=tutil.ApiClientMock().mock_keep_services())
+        self.assertIs(keep_client._user_agent_pool('http://a/'),
+                      keep_client._user_agent_pool('http://a/'))
+        self.assertIsNot(keep_client._user_agent_pool('http://a/'),
+                         keep_client._user_agent_pool('http://b/'))
+
+
+class KeepServiceHealthTestCase(unittest.TestCase):
+    def record_failures(self, health, n):
+        for _ in range(n):
+            health.record_failure()
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        health = arvados.keep.KeepServiceHealth('http://a/')
+        with mock.patch('time.time', return_value=1000):
+            self.record_failures(health, health.FAILURE_THRESHOLD - 1)
+            self.assertEqual(health.CLOSED, health.state())
+            health.record_failure()
+            self.assertEqual(health.OPEN, health.state())
+
+    def test_success_resets_failure_count(self):
+        health = arvados.keep.KeepServiceHealth('http://a/')
+        self.record_failures(health, health.FAILURE_THRESHOLD - 1)
+        health.record_success(0.01)
+        self.record_failures(health, health.FAILURE_THRESHOLD - 1)
+        self.assertEqual(health.CLOSED, health.state())
+
+    def test_half_open_probe(self):
+        health = arvados.keep.KeepServiceHealth('http://a/')
+        with mock.patch('time.time', return_value=1000):
+            self.record_failures(health, health.FAILURE_THRESHOLD)
+        with mock.patch('time.time', return_value=1000 + health.OPEN_DURATION):
+            self.assertEqual(health.HALF_OPEN, health.state())
+            health.record_failure()
+            self.assertEqual(health.OPEN, health.state())
+        with mock.patch('time.time', return_value=1000 + 2*health.OPEN_DURATION):
+            self.assertEqual(health.HALF_OPEN, health.state())
+            health.record_success(0.01)
+            self.assertEqual(health.CLOSED, health.state())
+
+    def test_averages(self):
+        health = arvados.keep.KeepServiceHealth('http://a/')
+        health.record_success(2.0, ttfb=1.0, nbytes=2**24)
+        self.assertEqual(2**24, health.bandwidth)
+        health.record_failure()
+        snapshot = health.snapshot()
+        self.assertEqual(2.0, snapshot['latency'])
+        self.assertEqual(1.0, snapshot['ttfb'])
+        self.assertEqual(health.EWMA_WEIGHT, snapshot['error_rate'])
+        self.assertEqual(2, snapshot['requests'])
+        self.assertEqual(1, snapshot['failures'])
+
+    def test_small_responses_do_not_estimate_bandwidth(self):
+        health = arvados.keep.KeepServiceHealth('http://a/')
+        health.record_success(0.1, ttfb=0.05, nbytes=3)
+        self.assertIsNone(health.bandwidth)
+
+    def test_adjust_timeout(self):
+        health = arvados.keep.KeepServiceHealth('http://a/')
+        self.assertEqual((2, 256, 32768), health.adjust_timeout((2, 256, 32768)))
+        health.record_success(2.0, ttfb=1.0, nbytes=2**24)
+        self.assertEqual((2, 256, health.BANDWIDTH_FLOOR_CAP),
+                         health.adjust_timeout((2, 256, 32768)))
+        self.assertEqual((2, 256, 32768),
+                         health.adjust_timeout((2, 256, 32768), for_download=False))
+        self.record_failures(health, health.FAILURE_THRESHOLD)
+        self.assertEqual((health.OPEN_CONNECT_TIMEOUT, 256, 32768),
+                         health.adjust_timeout((2, 256), for_download=False))
+
+
+@tutil.skip_sleep
+class KeepClientServiceHealthTestCase(unittest.TestCase, tutil.ApiClientMock):
+    def setUp(self):
+        self.keep_client = arvados.KeepClient(api_client=self.mock_keep_services(count=4))
+        self.locator = tutil.str_keep_locator(b'foo')
+        self.roots = self.keep_client.weighted_service_roots(
+            arvados.KeepLocator(self.locator))
+
+    def test_failing_service_tried_last(self):
+        with mock.patch('time.time', return_value=1000):
+            health = self.keep_client._health_record(self.roots[0])
+            for _ in range(health.FAILURE_THRESHOLD):
+                health.record_failure()
+            with tutil.mock_keep_responses(b'foo', 500, 500, 500, 200) as mock_curl:
+                self.assertEqual(b'foo', self.keep_client.get(self.locator))
+        urls = [resp.getopt(pycurl.URL).decode() for resp in mock_curl.responses]
+        self.assertEqual(self.roots[1:] + self.roots[:1],
+                         [url[:-len(self.locator)] for url in urls])
+
+    def test_health_recorded(self):
+        with tutil.mock_keep_responses(b'foo', 500, 200):
+            self.assertEqual(b'foo', self.keep_client.get(self.locator))
+        health = self.keep_client.service_health()
+        self.assertEqual(1, health[self.roots[0]]['failures'])
+        self.assertEqual(1, health[self.roots[1]]['requests'])
+        self.assertEqual(0, health[self.roots[1]]['failures'])
+
+    def test_not_found_is_not_a_failure(self):
+        with tutil.mock_keep_responses(b'', 404, 404, 404, 404), \
+             self.assertRaises(arvados.errors.NotFoundError):
+            self.keep_client.get(self.locator)
+        for root in self.roots:
+            self.assertEqual(0, self.keep_client.service_health()[root]['failures'])
+
+
+class KeepNotFoundCacheTestCase(unittest.TestCase):
+    def test_expires(self):
+        cache = arvados.keep.KeepNotFoundCache(ttl=10)
+        with mock.patch('time.time', return_value=1000):
+            cache.set('foo', 'foo not found', [])
+            self.assertEqual(('foo not found', []), cache.get('foo'))
+        with mock.patch('time.time', return_value=1010):
+            self.assertIsNone(cache.get('foo'))
+
+    def test_oldest_dropped(self):
+        cache = arvados.keep.KeepNotFoundCache(max_entries=2)
+        for loc in ('a', 'b', 'c'):
+            cache.set(loc, loc, [])
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_disabled(self):
+        cache = arvados.keep.KeepNotFoundCache(ttl=0)
+        cache.set('foo', 'foo not found', [])
+        self.assertIsNone(cache.get('foo'))
+
+
+class KeepClientNotFoundCacheTestCase(unittest.TestCase, tutil.ApiClientMock):
+    def setUp(self):
+        self.keep_client = arvados.KeepClient(
+            api_client=self.mock_keep_services(count=2),
+            not_found_ttl=arvados.keep.KeepNotFoundCache.DEFAULT_TTL)
+        self.locator = tutil.str_keep_locator(b'foo')
+
+    def get_missing(self, *codes, **kwargs):
+        method = kwargs.pop('method', self.keep_client.get)
+        with tutil.mock_keep_responses(b'', *codes) as mock_curl, \
+             self.assertRaises(arvados.errors.NotFoundError):
+            method(self.locator, **kwargs)
+        return mock_curl.call_count
+
+    def test_missing_block_remembered(self):
+        self.assertEqual(2, self.get_missing(404, 410))
+        self.assertEqual(0, self.get_missing())
+        self.assertEqual(1, self.keep_client.not_found_hits_counter.get())
+
+    def test_recheck_missing(self):
+        self.get_missing(404, 404)
+        self.assertEqual(2, self.get_missing(404, 404, recheck_missing=True))
+
+    def test_forbidden_not_remembered(self):
+        self.get_missing(403, 404)
+        self.assertEqual(2, self.get_missing(404, 404))
+
+    def test_expires(self):
+        with mock.patch('time.time', return_value=1000):
+            self.get_missing(404, 404)
+        self.assertEqual(2, self.get_missing(404, 404))
+
+    def test_put_forgets_missing(self):
+        self.get_missing(404, 404)
+        with tutil.mock_keep_responses(self.locator, 200, 200):
+            self.keep_client.put(b'foo', copies=2)
+        with tutil.mock_keep_responses(b'foo', 200):
+            self.assertEqual(b'foo', self.keep_client.get(self.locator))
+
+    def test_disabled_by_default(self):
+        self.keep_client = arvados.KeepClient(api_client=self.mock_keep_services(count=2))
+        self.get_missing(404, 404)
+        self.assertEqual(2, self.get_missing(404, 404))
+
+    def test_head_always_asks(self):
+        self.get_missing(404, 404, method=self.keep_client.head)
+        self.assertEqual(2, self.get_missing(404, 404))
+        self.assertEqual(2, self.get_missing(404, 404, method=self.keep_client.head))
+        self.assertEqual(2, self.get_missing(
+            404, 404, method=self.keep_client.refresh_signature))
+
+
+class KeepMetricsTestCase(unittest.TestCase, tutil.ApiClientMock):
+    def setUp(self):
+        self.keep_client = arvados.KeepClient(api_client=self.mock_keep_services(count=2))
+        self.locator = tutil.str_keep_locator(b'foo')
+        self.roots = self.keep_client.weighted_service_roots(
+            arvados.KeepLocator(self.locator))
+
+    def test_histogram(self):
+        metrics = arvados.keep.KeepMetrics(buckets=(1, 10))
+        for elapsed in (0.5, 1, 5, 20):
+            metrics.request_finished('root', 'GET', 0, 200, elapsed)
+        hist = metrics.snapshot()['latency']['root']['GET'][200]
+        self.assertEqual(4, hist['count'])
+        self.assertEqual(26.5, hist['sum'])
+        self.assertEqual([[1, 2], [10, 3], [float('inf'), 4]], hist['buckets'])
+
+    def test_requests_recorded(self):
+        with tutil.mock_keep_responses(b'foo', 500, 200):
+            self.keep_client.get(self.locator)
+        snap = self.keep_client.metrics_snapshot()
+        self.assertEqual(1, snap['latency'][self.roots[0]]['GET'][500]['count'])
+        self.assertEqual(1, snap['latency'][self.roots[1]]['GET'][200]['count'])
+        self.assertEqual({'GET': 0}, snap['bytes_in_flight'])
+        self.assertEqual(1, snap['counters']['get'])
+        self.assertEqual(3, snap['counters']['download'])
+        self.assertEqual(1, snap['block_cache']['blocks'])
+
+    def test_network_error_recorded(self):
+        with tutil.mock_keep_responses(b'', 0, 0), \
+             self.assertRaises(arvados.errors.KeepReadError):
+            self.keep_client.get(self.locator)
+        snap = self.keep_client.metrics_snapshot()
+        self.assertEqual(1, snap['latency'][self.roots[0]]['GET'][0]['count'])
+
+    def test_retries_recorded(self):
+        with tutil.mock_keep_responses(b'foo', 500, 500, 200), \
+             mock.patch('time.sleep'):
+            self.keep_client.get(self.locator, num_retries=1)
+        with tutil.mock_keep_responses(self.locator, 200, 200):
+            self.keep_client.put(b'foo', copies=2)
+        self.assertEqual({'GET': 1}, self.keep_client.metrics_snapshot()['retries'])
+
+    def test_bytes_in_flight(self):
+        in_flight = []
+        class Metrics(arvados.keep.KeepMetrics):
+            def request_started(self, *args):
+                super(Metrics, self).request_started(*args)
+                in_flight.append(self.snapshot()['bytes_in_flight'])
+        self.keep_client = arvados.KeepClient(api_client=self.mock_keep_services(count=2),
+                                              metrics=Metrics())
+        with tutil.mock_keep_responses(self.locator, 200, 200):
+            self.keep_client.put(b'foo', copies=1)
+        self.assertEqual([{'PUT': 3}], in_flight)
+        self.assertEqual({'PUT': 0}, self.keep_client.metrics_snapshot()['bytes_in_flight'])
+
+    def test_block_cache_evictions(self):
+        cache = arvados.keep.KeepBlockCache(cache_max=4)
+        for data in (b'foo', b'bar'):
+            slot, _ = cache.reserve_cache(hashlib.md5(data).hexdigest())
+            cache.set(slot, data)
+        self.assertEqual({'bytes': 3, 'max_bytes': 4, 'blocks': 1, 'evictions': 1},
+                         cache.stats())
+
+    @unittest.skipIf(prometheus_client is None, "prometheus_client is not installed")
+    def test_prometheus_export(self):
+        with tutil.mock_keep_responses(b'foo', 200):
+            self.keep_client.get(self.locator)
+        registry = prometheus_client.CollectorRegistry()
+        registry.register(arvados.keep.KeepPrometheusCollector(self.keep_client))
+        self.assertEqual(1, registry.get_sample_value(
+            'arvados_keep_request_duration_seconds_count',
+            {'service': self.roots[0], 'method': 'GET', 'status': '200'}))
+        self.assertEqual(1, registry.get_sample_value('arvados_keep_get_total'))
+        self.assertEqual(3, registry.get_sample_value('arvados_keep_block_cache_bytes'))
+
+
+class KeepClientConnectionReuseTestCase(keepstub.StubKeepServers, unittest.TestCase):
+    def test_connection_reused(self):
+        self.server.keepalive = True
+        keep_client = arvados.KeepClient(api_client=self.api_client)
+        for data in (b'foo', b'bar', b'baz'):
+            self.server.store[hashlib.md5(data).hexdigest()] = data
+            self.assertEqual(data, keep_client.get(tutil.str_keep_locator(data)))
+        self.assertEqual(1, keep_client.new_connections_counter.get())
+        self.assertEqual(2, keep_client.reused_connections_counter.get())
+
+    def test_new_connection_when_server_closes(self):
+        keep_client = arvados.KeepClient(api_client=self.api_client)
+        for data in (b'foo', b'bar'):
+            self.server.store[hashlib.md5(data).hexdigest()] = data
+            self.assertEqual(data, keep_client.get(tutil.str_keep_locator(data)))
+        self.assertEqual(2, keep_client.new_connections_counter.get())
+        self.assertEqual(0, keep_client.reused_connections_counter.get())
+
+
+class KeepClientGetManyTestCase(keepstub.StubKeepServers, unittest.TestCase):
+    def setUp(self):
+        super(KeepClientGetManyTestCase, self).setUp()
+        self.keep_client = arvados.KeepClient(api_client=self.api_client)
+        self.blocks = [str(i).encode() * 10 for i in range(8)]
+        for data in self.blocks:
+            self.server.store[hashlib.md5(data).hexdigest()] = data
+        self.locators = [tutil.str_keep_locator(data) for data in self.blocks]
+
+    def test_get_many_in_order(self):
+        self.assertEqual(self.blocks, self.keep_client.get_many(self.locators))
+
+    def test_get_many_concurrent(self):
+        self.server.setdelays(response=0.5)
+        t0 = time.time()
+        self.keep_client.get_many(self.locators[:4], max_concurrency=4)
+        self.assertLess(time.time() - t0, 1.5)
+
+    def test_get_many_reports_each_error(self):
+        missing = [tutil.str_keep_locator(b'missing1'), tutil.str_keep_locator(b'missing2')]
+        with self.assertRaises(arvados.errors.KeepReadError) as err:
+            self.keep_client.get_many([self.locators[0], missing[0], self.locators[1], missing[1]])
+        errors = err.exception.request_errors()
+        self.assertEqual([1, 3], list(errors.keys()))
+        for e in errors.values():
+            self.assertIsInstance(e, arvados.errors.NotFoundError)
+
+    def test_get_as_completed(self):
+        missing = tutil.str_keep_locator(b'missing')
+        results = {}
+        for index, data, error in self.keep_client.get_as_completed(self.locators + [missing]):
+            results[index] = (data, error)
+        for i, data in enumerate(self.blocks):
+            self.assertEqual((data, None), results[i])
+        self.assertIsNone(results[len(self.blocks)][0])
+        self.assertIsInstance(results[len(self.blocks)][1], arvados.errors.NotFoundError)
+
+    def test_get_many_uses_block_cache(self):
+        self.keep_client.get_many(self.locators)
+        self.server.store.clear()
+        self.assertEqual(self.blocks, self.keep_client.get_many(self.locators))
+
+    def test_get_comma_separated_locators(self):
+        self.assertEqual(b''.join(self.blocks[:3]),
+                         self.keep_client.get(','.join(self.locators[:3])))
+
+    def test_head_many(self):
+        missing = tutil.str_keep_locator(b'missing')
+        results = self.keep_client.head_many([self.locators[0], missing, self.locators[1]])
+        self.assertEqual([arvados.KeepClient.HEAD_PRESENT,
+                          arvados.KeepClient.HEAD_MISSING,
+                          arvados.KeepClient.HEAD_PRESENT],
+                         [r.status for r in results])
+        self.assertIs(True, results[0].value)
+        self.assertIsInstance(results[1].value, arvados.errors.NotFoundError)
+
+    def test_head_many_concurrent(self):
+        self.server.setdelays(response=0.5)
+        t0 = time.time()
+        results = self.keep_client.head_many(self.locators, max_concurrency=8)
+        self.assertLess(time.time() - t0, 1.5)
+        self.assertEqual(set([arvados.KeepClient.HEAD_PRESENT]),
+                         set(r.status for r in results))
+
+
+class KeepThrottleTestCase(unittest.TestCase):
+    def test_unlimited(self):
+        throttle = arvados.keep.KeepThrottle()
+        self.assertEqual(0, throttle.reserve(10**12))
+        for _ in range(100):
+            self.assertTrue(throttle.try_start())
+
+    def test_bandwidth(self):
+        throttle = arvados.keep.KeepThrottle(max_bytes_per_second=1000)
+        with mock.patch('time.time', return_value=1000):
+            # The bucket starts full: BURST_SECONDS worth of bytes.
+            self.assertEqual(0, throttle.reserve(250))
+            self.assertAlmostEqual(0.5, throttle.reserve(500))
+            self.assertAlmostEqual(1.0, throttle.reserve(500))
+        with mock.patch('time.time', return_value=1002):
+            self.assertEqual(0, throttle.reserve(10))
+
+    def test_bandwidth_shared_by_threads(self):
+        throttle = arvados.keep.KeepThrottle(max_bytes_per_second=100000)
+        def transfer():
+            for _ in range(5):
+                throttle.consume(10000)
+        threads = [threading.Thread(target=transfer) for _ in range(2)]
+        t0 = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # 100 KB, less the 25 KB burst, at 100 KB/s.
+        self.assertGreater(time.time() - t0, 0.7)
+        self.assertLess(time.time() - t0, 2)
+
+    def test_stall_limits(self):
+        throttle = arvados.keep.KeepThrottle()
+        self.assertEqual((32768, 256), throttle.stall_limits(32768, 256))
+        throttle.max_bytes_per_second = 1000000
+        self.assertEqual((32768, 256), throttle.stall_limits(32768, 256))
+        throttle.max_bytes_per_second = 10000
+        self.assertEqual((5000, 256), throttle.stall_limits(32768, 256))
+        throttle.max_in_flight = 4
+        limit, seconds = throttle.stall_limits(32768, 10)
+        self.assertEqual(1250, limit)
+        self.assertGreater(seconds, 10)
+
+    def test_max_in_flight(self):
+        throttle = arvados.keep.KeepThrottle(max_in_flight=1)
+        throttle.start()
+        self.assertFalse(throttle.try_start())
+        started = threading.Event()
+        def start():
+            throttle.start()
+            started.set()
+        threading.Thread(target=start).start()
+        self.assertFalse(started.wait(0.1))
+        throttle.finish()
+        self.assertTrue(started.wait(5))
+        self.assertEqual(1, throttle.in_flight)
+
+    def test_change_limits(self):
+        throttle = arvados.keep.KeepThrottle(max_in_flight=1)
+        throttle.start()
+        started = threading.Event()
+        def start():
+            throttle.start()
+            started.set()
+        threading.Thread(target=start).start()
+        self.assertFalse(started.wait(0.1))
+        throttle.max_in_flight = 2
+        self.assertTrue(started.wait(5))
+        throttle.max_in_flight = None
+        throttle.max_bytes_per_second = 1000
+        self.assertGreater(throttle.reserve(10000), 0)
+        throttle.max_bytes_per_second = None
+        self.assertEqual(0, throttle.reserve(10000))
+        self.assertEqual({'max_bytes_per_second': None,
+                          'max_in_flight': None,
+                          'in_flight': 2},
+                         {k: v for k, v in throttle.snapshot().items() if k != 'wait_seconds'})
+
+
+class KeepClientThrottleTestCase(keepstub.StubKeepServers, unittest.TestCase):
+    def store(self, data):
+        self.server.store[hashlib.md5(data).hexdigest()] = data
+        return tutil.str_keep_locator(data)
+
+    def test_max_in_flight(self):
+        self.server.setdelays(response=0.2)
+        keep_client = arvados.KeepClient(api_client=self.api_client, max_in_flight=1)
+        locators = [self.store(str(i).encode()) for i in range(4)]
+        t0 = time.time()
+        keep_client.get_many(locators, max_concurrency=4)
+        self.assertGreater(time.time() - t0, 0.75)
+        self.assertEqual(0, keep_client.metrics_snapshot()['throttle']['in_flight'])
+
+    def test_bandwidth(self):
+        keep_client = arvados.KeepClient(api_client=self.api_client,
+                                         max_bytes_per_second=400000)
+        data = os.urandom(200000)
+        t0 = time.time()
+        loc = keep_client.put(data, copies=1)
+        keep_client.block_cache = arvados.keep.KeepBlockCache()
+        self.assertEqual(data, keep_client.get(loc))
+        # 400 KB, less the 100 KB burst, at 400 KB/s.
+        self.assertGreater(time.time() - t0, 0.6)
+        self.assertGreater(keep_client.throttle.wait_seconds, 0)
+
+    def test_unthrottled_at_runtime(self):
+        self.server.setdelays(response=0.2)
+        keep_client = arvados.KeepClient(api_client=self.api_client, max_in_flight=1)
+        keep_client.throttle.max_in_flight = None
+        locators = [self.store(str(i).encode()) for i in range(4)]
+        t0 = time.time()
+        keep_client.get_many(locators, max_concurrency=4)
+        self.assertLess(time.time() - t0, 0.6)
+
+
+class KeepClientHedgedReadTestCase(keepstub.StubKeepServers, unittest.TestCase):
+    DATA = b'hedge'
+
+    def setUp(self):
+        super(KeepClientHedgedReadTestCase, self).setUp()
+        self.server2 = keepstub.Server(('0.0.0.0', 0), keepstub.Handler)
+        thread = threading.Thread(target=self.server2.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.api_client = self.mock_keep_services(
+            count=1,
+            service_host='localhost',
+            service_port=self.port,
+            additional_services=[{
+                'uuid': 'zzzzz-bi6l4-{:015x}'.format(1),
+                'owner_uuid': 'zzzzz-tpzed-000000000000000',
+                'service_host': 'localhost',
+                'service_port': self.server2.server_address[1],
+                'service_ssl_flag': False,
+                'service_type': 'disk',
+                'read_only': False,
+            }])
+        self.locator = tutil.str_keep_locator(self.DATA)
+        for server in (self.server, self.server2):
+            server.store[hashlib.md5(self.DATA).hexdigest()] = self.DATA
+        # Find out which server is asked first.
+        roots = arvados.KeepClient(api_client=self.api_client).weighted_service_roots(
+            arvados.KeepLocator(self.locator))
+        if roots[0].endswith(':{}/'.format(self.port)):
+            self.first, self.second = self.server, self.server2
+        else:
+            self.first, self.second = self.server2, self.server
+
+    def tearDown(self):
+        self.server2.shutdown()
+        super(KeepClientHedgedReadTestCase, self).tearDown()
+
+    def test_slow_service_is_hedged(self):
+        self.first.setdelays(response=3)
+        keep_client = arvados.KeepClient(api_client=self.api_client, hedge_after=0.1)
+        t0 = time.time()
+        self.assertEqual(self.DATA, keep_client.get(self.locator))
+        self.assertLess(time.time() - t0, 2)
+        self.assertEqual(1, keep_client.hedges_fired_counter.get())
+        self.assertEqual(1, keep_client.hedges_won_counter.get())
+
+    def test_fast_service_is_not_hedged(self):
+        keep_client = arvados.KeepClient(api_client=self.api_client, hedge_after=2)
+        self.assertEqual(self.DATA, keep_client.get(self.locator))
+        self.assertEqual(0, keep_client.hedges_fired_counter.get())
+        self.assertEqual(0, keep_client.hedges_won_counter.get())
+
+    def test_leader_wins_hedge(self):
+        self.first.setdelays(response=0.3)
+        self.second.setdelays(response=3)
+        keep_client = arvados.KeepClient(api_client=self.api_client, hedge_after=0.1)
+        t0 = time.time()
+        self.assertEqual(self.DATA, keep_client.get(self.locator))
+        self.assertLess(time.time() - t0, 2)
+        self.assertEqual(1, keep_client.hedges_fired_counter.get())
+        self.assertEqual(0, keep_client.hedges_won_counter.get())
+
+    def test_hedged_read_falls_back_after_failure(self):
+        self.first.store.clear()
+        keep_client = arvados.KeepClient(api_client=self.api_client, hedge_after=2)
+        self.assertEqual(self.DATA, keep_client.get(self.locator))
+        self.assertEqual(0, keep_client.hedges_fired_counter.get())
+
+    def test_hedged_read_not_found(self):
+        self.first.store.clear()
+        self.second.store.clear()
+        keep_client = arvados.KeepClient(api_client=self.api_client, hedge_after=0.1)
+        with self.assertRaises(arvados.errors.NotFoundError):
+            keep_client.get(self.locator)
+
+    def test_adaptive_hedge_delay(self):
+        keep_client = arvados.KeepClient(api_client=self.api_client,
+                                         hedge_after=arvados.KeepClient.HEDGE_ADAPTIVE)
+        self.assertEqual(self.DATA, keep_client.get(self.locator))
+        measured = [(root, h['ttfb']) for root, h in keep_client.service_health().items()
+                    if h['ttfb'] is not None]
+        self.assertEqual(1, len(measured))
+        root, ttfb = measured[0]
+        ks = keep_client.KeepService(root)
+        self.assertEqual(max(keep_client.HEDGE_ADAPTIVE_MIN, ttfb * keep_client.HEDGE_ADAPTIVE_FACTOR),
+                         keep_client._hedge_delay(ks))
+        self.assertEqual(keep_client.HEDGE_ADAPTIVE_INITIAL,
+                         keep_client._hedge_delay(keep_client.KeepService('http://unknown/')))
+
+
+class KeepRangeCacheTestCase(unittest.TestCase):
+    def test_covering_range(self):
+        cache = arvados.keep.KeepRangeCache()
+        cache.set('a'*32, 10, b'0123456789')
+        self.assertEqual(b'2345', bytes(cache.get('a'*32, 12, 4)))
+        self.assertIsNone(cache.get('a'*32, 8, 4))
+        self.assertIsNone(cache.get('a'*32, 18, 4))
+        self.assertIsNone(cache.get('b'*32, 12, 4))
+
+    def test_evict_least_recently_used(self):
+        cache = arvados.keep.KeepRangeCache(cache_max=20)
+        cache.set('a'*32, 0, b'x'*10)
+        cache.set('b'*32, 0, b'y'*10)
+        cache.get('a'*32, 0, 1)
+        cache.set('c'*32, 0, b'z'*10)
+        self.assertIsNone(cache.get('b'*32, 0, 1))
+        self.assertEqual(b'x', bytes(cache.get('a'*32, 0, 1)))
+        self.assertEqual(20, cache.cache_total)
+
+
+class KeepClientRangeReadTestCase(keepstub.StubKeepServers, unittest.TestCase):
+    def setUp(self):
+        super(KeepClientRangeReadTestCase, self).setUp()
+        self.data = bytes(bytearray(range(256))) * 1024
+        self.server.store[hashlib.md5(self.data).hexdigest()] = self.data
+        self.locator = tutil.str_keep_locator(self.data)
+        self.keep_client = arvados.KeepClient(api_client=self.api_client)
+        self.align = self.keep_client.RANGE_READ_ALIGN
+
+    def test_get_range(self):
+        self.assertEqual(self.data[70000:70010],
+                         bytes(self.keep_client.get_range(self.locator, 70000, 10)))
+        self.assertEqual(['bytes={}-{}'.format(self.align, 2*self.align - 1)],
+                         self.server.range_requests)
+        self.assertIsNone(self.keep_client.get_from_cache(self.locator))
+
+    def test_nearby_read_uses_range_cache(self):
+        self.keep_client.get_range(self.locator, 70000, 10)
+        self.assertEqual(self.data[70100:70200],
+                         bytes(self.keep_client.get_range(self.locator, 70100, 100)))
+        self.assertEqual(1, len(self.server.range_requests))
+
+    def test_cached_block_is_sliced(self):
+        self.keep_client.get(self.locator)
+        self.assertEqual(self.data[5:15],
+                         bytes(self.keep_client.get_range(self.locator, 5, 10)))
+        self.assertEqual([], self.server.range_requests)
+
+    def test_range_past_end_of_block(self):
+        self.assertEqual(self.data[-5:],
+                         bytes(self.keep_client.get_range(self.locator, len(self.data) - 5, 100)))
+        self.assertEqual(b'', self.keep_client.get_range(self.locator, len(self.data), 100))
+
+    def test_server_ignores_range(self):
+        self.server.ranges = False
+        self.assertEqual(self.data[70000:70010],
+                         bytes(self.keep_client.get_range(self.locator, 70000, 10)))
+        # The whole block went into the block cache.
+        self.assertEqual(self.data, self.keep_client.get_from_cache(self.locator))
+        self.assertEqual(self.data[5:15],
+                         bytes(self.keep_client.get_range(self.locator, 5, 10)))
+        self.assertEqual(1, len(self.server.range_requests))
+
+    def test_cache_only(self):
+        self.assertIsNone(self.keep_client.get_range(self.locator, 0, 10, cache_only=True))
+        self.assertEqual([], self.server.range_requests)
+
+    def test_not_found(self):
+        with self.assertRaises(arvados.errors.NotFoundError):
+            self.keep_client.get_range(tutil.str_keep_locator(b'missing'), 0, 1)
+
+
+class KeepRequestBodyTestCase(unittest.TestCase):
+    def test_read_chunks(self):
+        body = arvados.keep._RequestBody(bytearray(b'foobarbaz'))
+        self.assertEqual(9, len(body))
+        self.assertEqual([b'foob', b'arba', b'z', b''],
+                         [bytes(body.read(4)) for _ in range(4)])
+
+    def test_readers_share_buffer(self):
+        data = bytearray(b'foobar')
+        first = arvados.keep._RequestBody(data)
+        second = arvados.keep._RequestBody(data)
+        self.assertEqual(b'foo', bytes(first.read(3)))
+        self.assertEqual(b'foobar', bytes(second.read(10)))
+        self.assertEqual(b'bar', bytes(first.read(10)))
+
+
+class KeepClientPutBufferTestCase(keepstub.StubKeepServers, unittest.TestCase):
+    DATA = b'foobar' * 1000
+
+    def put(self, data):
+        keep_client = arvados.KeepClient(api_client=self.api_client)
+        loc = keep_client.put(data, copies=1)
+        self.assertEqual(tutil.str_keep_locator(self.DATA),
+                         arvados.KeepLocator(loc).stripped())
+        self.assertEqual(self.DATA, self.server.store[hashlib.md5(self.DATA).hexdigest()])
+
+    def test_put_bytearray(self):
+        self.put(bytearray(self.DATA))
+
+    def test_put_memoryview_slice(self):
+        buf = bytearray(b'x' + self.DATA + b'y')
+        self.put(memoryview(buf)[1:-1])
+
+    def test_put_mmap(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(self.DATA)
+            f.flush()
+            self.put(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @unittest.skipIf(sys.version_info < (3, 0), "memoryview.cast needs Python 3")
+    def test_put_multibyte_memoryview(self):
+        self.put(memoryview(bytearray(self.DATA)).cast('H'))
+
 
 class KeepClientTimeout(keepstub.StubKeepServers, unittest.TestCase):
     # BANDWIDTH_LOW_LIM must be less than len(DATA) so we can transfer
@@ -1238,6 +2176,71 @@ class AvoidOverreplication(unittest.TestCase, tutil.ApiClientMock):
         self.assertEqual(self.pool.done(), self.copies-1)
 
 
+class AvoidOverreplicationSharedWorkers(AvoidOverreplication):
+    def setUp(self):
+        self.copies = 3
+        self.pool = arvados.KeepClient.KeepWriterThreadPool(
+            data = 'foo',
+            data_hash = 'acbd18db4cc2f85cedef654fccc4a4d8+3',
+            max_service_replicas = 1,
+            copies = self.copies,
+            workers = arvados.KeepClient.KeepWriterPool(2),
+        )
+
+
+class KeepWriterPoolTestCase(unittest.TestCase):
+    def test_writers_share_bounded_workers(self):
+        workers = arvados.KeepClient.KeepWriterPool(2)
+        pools = []
+        for _ in range(8):
+            pool = arvados.KeepClient.KeepWriterThreadPool(
+                data='foo', data_hash='acbd18db4cc2f85cedef654fccc4a4d8+3',
+                copies=2, max_service_replicas=1, workers=workers)
+            for i in range(3):
+                pool.add_task(AvoidOverreplication.FakeKeepService(
+                    delay=0.01, will_succeed=(i > 0)), None)
+            pools.append(pool)
+        threads = [threading.Thread(target=pool.join) for pool in pools]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+            self.assertFalse(t.is_alive())
+        self.assertEqual([2]*8, [pool.done() for pool in pools])
+        self.assertLessEqual(workers._threads, 2)
+
+    def test_no_services(self):
+        pool = arvados.KeepClient.KeepWriterThreadPool(
+            data='foo', data_hash='acbd18db4cc2f85cedef654fccc4a4d8+3',
+            copies=2, max_service_replicas=1)
+        pool.join()
+        self.assertEqual(0, pool.done())
+
+    def test_idle_workers_exit(self):
+        workers = arvados.KeepClient.KeepWriterPool(2, idle_timeout=0.1)
+        pool = arvados.KeepClient.KeepWriterThreadPool(
+            data='foo', data_hash='acbd18db4cc2f85cedef654fccc4a4d8+3',
+            copies=1, max_service_replicas=1, workers=workers)
+        pool.add_task(AvoidOverreplication.FakeKeepService(delay=0, will_succeed=True), None)
+        pool.join()
+        for _ in range(50):
+            if workers._threads == 0:
+                break
+            time.sleep(0.05)
+        self.assertEqual(0, workers._threads)
+
+
+class KeepClientPutWorkersTestCase(keepstub.StubKeepServers, unittest.TestCase):
+    def test_put_reuses_workers(self):
+        keep_client = arvados.KeepClient(api_client=self.api_client)
+        keep_client.put(b'foo', copies=1)
+        workers = keep_client._writer_pool
+        keep_client.put(b'bar', copies=1)
+        self.assertIs(workers, keep_client._writer_pool)
+        self.assertEqual(1, workers._threads)
+        self.assertEqual(b'bar', self.server.store[hashlib.md5(b'bar').hexdigest()])
+
+
 @tutil.skip_sleep
 class RetryNeedsMultipleServices(unittest.TestCase, tutil.ApiClientMock):
     # Test put()s that need two distinct servers to succeed, possibly
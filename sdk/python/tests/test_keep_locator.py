@@ -88,6 +88,52 @@ class ArvadosKeepLocatorTest(unittest.TestCase):
         self.assertTrue(locator.permission_expired(dt2000))
         self.assertFalse(locator.permission_expired(dt1980))
 
+    def test_strip_hints_and_size_of(self):
+        base = next(self.base_locators(1))
+        md5sum, size = base.split('+')
+        for locator in [base,
+                        '+'.join([base, next(self.perm_hints(1))]),
+                        '+'.join([base, 'Kab1cd', next(self.perm_hints(1))]),
+                        '+'.join([base, 'Zfoo'])]:
+            self.assertEqual(base, KeepLocator.strip_hints(locator))
+            self.assertEqual(int(size), KeepLocator.size_of(locator))
+            self.assertEqual(md5sum, KeepLocator.md5_of(locator))
+        self.assertEqual(md5sum, KeepLocator.strip_hints(md5sum))
+        self.assertIsNone(KeepLocator.size_of(md5sum))
+        self.assertRaises(ValueError, KeepLocator.strip_hints, '0:3:foo.txt')
+        self.assertRaises(ValueError, KeepLocator.size_of, base + '+lowercase')
+
+    def test_hints_parsed_on_demand(self):
+        base = next(self.base_locators(1))
+        perm = next(self.perm_hints(1))
+        locator = KeepLocator('+'.join([base, perm, 'Kab1cd']))
+        self.assertEqual(['Kab1cd'], locator.hints)
+        self.assertEqual(perm[1:41], locator.perm_sig)
+        self.assertEqual(datetime.datetime.utcfromtimestamp(int(perm[42:], 16)),
+                         locator.perm_expiry)
+
+    def test_changes_not_shared(self):
+        md5sum = next(self.checksums(1))
+        locator_str = md5sum + '+3+Kab1cd'
+        locator = KeepLocator(locator_str)
+        locator.hints.append('Kef2gh')
+        locator.size = 1
+        self.assertEqual(md5sum + '+1+Kab1cd+Kef2gh', str(locator))
+        self.assertEqual(locator_str, str(KeepLocator(locator_str)))
+
+    def test_noncanonical_locators_normalized(self):
+        md5sum = next(self.checksums(1))
+        signature = next(self.signatures(1))
+        self.assertEqual(md5sum + '+3', str(KeepLocator(md5sum + '+03')))
+        self.assertEqual(
+            '{}+3+A{}@0000001f+Kab1cd'.format(md5sum, signature),
+            str(KeepLocator('{}+3+Kab1cd+A{}@1f'.format(md5sum, signature))))
+
+    def test_no_instance_dict(self):
+        locator = KeepLocator(next(self.base_locators(1)))
+        with self.assertRaises(AttributeError):
+            locator.foo = 'bar'
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,148 @@
+# Copyright (C) The Arvados Authors. All rights reserved.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import arvados
+import arvados.errors
+from arvados.localstore import KeepLocalStore, SimulatedLink
+
+
+class KeepLocalStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_put_get_sharded(self):
+        store = KeepLocalStore(self._dir)
+        md5sum = hashlib.md5(b'foo').hexdigest()
+        self.assertEqual(md5sum + '+3', store.put(b'foo'))
+        self.assertTrue(os.path.exists(os.path.join(self._dir, md5sum[:3], md5sum)))
+        self.assertEqual(b'foo', store.get(md5sum))
+        self.assertEqual(b'oo', store.get_range(md5sum, 1, 5))
+        self.assertIs(True, store.head(md5sum))
+
+    def test_large_blocks_mapped(self):
+        store = KeepLocalStore(self._dir)
+        data = os.urandom(store.MMAP_MIN_SIZE)
+        md5sum = store.put(data).split('+')[0]
+        block = store.get(md5sum)
+        self.assertIsInstance(block, memoryview)
+        self.assertEqual(data, block.tobytes())
+
+    def test_missing_block(self):
+        store = KeepLocalStore(self._dir)
+        md5sum = hashlib.md5(b'missing').hexdigest()
+        for method in (store.get, store.head):
+            with self.assertRaises(arvados.errors.NotFoundError):
+                method(md5sum)
+
+    def test_read_flat_layout(self):
+        md5sum = hashlib.md5(b'foo').hexdigest()
+        with open(os.path.join(self._dir, md5sum), 'wb') as f:
+            f.write(b'foo')
+        self.assertEqual(b'foo', KeepLocalStore(self._dir).get(md5sum))
+
+    def test_concurrent_puts_of_same_block(self):
+        store = KeepLocalStore(self._dir)
+        data = os.urandom(1 << 20)
+        threads = [threading.Thread(target=store.put, args=(data,)) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        md5sum = hashlib.md5(data).hexdigest()
+        self.assertEqual(data, store.get(md5sum).tobytes())
+        self.assertEqual([md5sum], os.listdir(os.path.join(self._dir, md5sum[:3])))
+
+    def test_replicas(self):
+        store = KeepLocalStore(self._dir, replicas=2)
+        md5sum = hashlib.md5(b'foo').hexdigest()
+        store.put(b'foo', copies=2)
+        self.assertEqual(2, store.copies(md5sum))
+        with self.assertRaises(arvados.errors.KeepWriteError):
+            store.put(b'foo', copies=3)
+        self.assertEqual(2, store.copies(md5sum))
+        self.assertEqual(b'foo', store.get(md5sum))
+
+    def test_from_environment(self):
+        store = KeepLocalStore.from_environment(self._dir, {
+            'KEEP_LOCAL_STORE_LATENCY': '0.5',
+            'KEEP_LOCAL_STORE_BANDWIDTH': '1000000',
+            'KEEP_LOCAL_STORE_REPLICAS': '3',
+        })
+        self.assertEqual(0.5, store.link.latency)
+        self.assertEqual(1000000, store.link.bandwidth)
+        self.assertEqual(3, store.replicas)
+        store = KeepLocalStore.from_environment(self._dir, {})
+        self.assertEqual((0, None, None),
+                         (store.link.latency, store.link.bandwidth, store.replicas))
+
+    def test_keep_client(self):
+        store = KeepLocalStore(self._dir, replicas=1)
+        kc = arvados.KeepClient(local_store=store)
+        self.assertEqual(self._dir, kc.local_store)
+        loc = kc.put(b'foo')
+        self.assertEqual(b'foo', kc.get(loc))
+        self.assertIs(True, kc.head(loc))
+        self.assertIsNone(kc.head(hashlib.md5(b'baz').hexdigest() + '+3'))
+
+    def test_keep_client_get_many(self):
+        kc = arvados.KeepClient(local_store=KeepLocalStore(self._dir, replicas=1))
+        blocks = [b'foo', b'bar', b'']
+        locators = [kc.put(data) for data in blocks]
+        self.assertEqual(blocks, kc.get_many(locators))
+        self.assertEqual(b'ar', kc.get_range(locators[1], 1, 5, request_id='zzzzz-req-000000000000000'))
+        missing = hashlib.md5(b'baz').hexdigest() + '+3'
+        with self.assertRaises(arvados.errors.KeepReadError) as err:
+            kc.get_many([locators[0], missing])
+        self.assertEqual([1], list(err.exception.request_errors()))
+        self.assertIsInstance(err.exception.request_errors()[1], arvados.errors.NotFoundError)
+
+    def test_keep_client_head_many(self):
+        kc = arvados.KeepClient(local_store=KeepLocalStore(self._dir, replicas=1))
+        loc = kc.put(b'foo')
+        missing = hashlib.md5(b'baz').hexdigest() + '+3'
+        results = kc.head_many([loc, missing])
+        self.assertEqual(kc.HeadResult(kc.HEAD_PRESENT, True), results[0])
+        self.assertEqual(kc.HEAD_MISSING, results[1].status)
+        self.assertIsInstance(results[1].value, arvados.errors.NotFoundError)
+        with self.assertRaises(arvados.errors.KeepWriteError):
+            kc.put(b'bar', copies=2)
+        with self.assertRaises(arvados.errors.NotFoundError):
+            kc.get(arvados.keep.KeepLocator(hashlib.md5(b'baz').hexdigest() + '+3').stripped())
+
+
+class SimulatedLinkTest(unittest.TestCase):
+    def test_latency_overlaps(self):
+        link = SimulatedLink(latency=0.2)
+        threads = [threading.Thread(target=link.transfer, args=(1000,)) for _ in range(5)]
+        t0 = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertGreater(time.time() - t0, 0.19)
+        self.assertLess(time.time() - t0, 0.6)
+
+    def test_bandwidth_shared(self):
+        link = SimulatedLink(bandwidth=100000)
+        threads = [threading.Thread(target=link.transfer, args=(10000,)) for _ in range(5)]
+        t0 = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertGreater(time.time() - t0, 0.45)
+        self.assertLess(time.time() - t0, 1.5)
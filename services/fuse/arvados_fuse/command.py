@@ -89,6 +89,12 @@ class ArgumentParser(argparse.ArgumentParser):
         self.add_argument('--encoding', type=str, help="Character encoding to use for filesystem, default is utf-8 (see Python codec registry for list of available encodings)", default="utf-8")
 
         self.add_argument('--file-cache', type=int, help="File data cache size, in bytes (default 256MiB)", default=256*1024*1024)
+        self.add_argument('--disk-cache', action='store_true', help="Also cache file data on local disk, so it can be reused by other processes and after a restart (default false)", default=False)
+        self.add_argument('--disk-cache-dir', type=str, metavar='PATH', help="Directory for the disk cache (implies --disk-cache, default ~/.cache/arvados/keep)", default=None)
+        self.add_argument('--disk-cache-size', type=int, help="Disk cache size, in bytes (default 10%% of free space)", default=None)
+        self.add_argument('--shared-cache', action='store_true', help="Also cache file data in shared memory, where other processes on this host can use it (default false)", default=False)
+        self.add_argument('--shared-cache-dir', type=str, metavar='PATH', help="Directory for the shared cache (implies --shared-cache, default /dev/shm/arvados-keep-UID)", default=None)
+        self.add_argument('--shared-cache-size', type=int, help="Shared cache size, in bytes, for all processes using it (default 10%% of free space)", default=None)
         self.add_argument('--directory-cache', type=int, help="Directory data cache size, in bytes (default 128MiB)", default=128*1024*1024)
 
         self.add_argument('--disable-event-listening', action='store_true', help="Don't subscribe to events on the API server", dest="disable_event_listening", default=False)
@@ -213,7 +219,14 @@ class Mount(object):
             self.api = arvados.safeapi.ThreadSafeApiCache(
                 apiconfig=arvados.config.settings(),
                 keep_params={
-                    'block_cache': arvados.keep.KeepBlockCache(self.args.file_cache),
+                    'block_cache': arvados.keep.KeepBlockCache(
+                        self.args.file_cache,
+                        disk_cache=self.args.disk_cache,
+                        disk_cache_dir=self.args.disk_cache_dir,
+                        disk_cache_max=self.args.disk_cache_size,
+                        shared_cache=self.args.shared_cache,
+                        shared_cache_dir=self.args.shared_cache_dir,
+                        shared_cache_max=self.args.shared_cache_size),
                     'num_retries': self.args.retries,
                 })
         except KeyError as e:
@@ -71,6 +71,12 @@ class FuseArvadosFile(File):
     def stale(self):
         return False
 
+    def dec_use(self):
+        super(FuseArvadosFile, self).dec_use()
+        if not self.in_use():
+            # Nobody has the file open, so stop its readahead.
+            self.arvfile.cancel_prefetch()
+
     def writable(self):
         return self.arvfile.writable()
 